@@ -0,0 +1,236 @@
+import os
+import sys
+import io
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+from functools import partial
+import tempfile
+import subprocess
+from PIL import Image
+
+import exif_tool
+
+# Config ---------------------------------------------------------
+DEFAULT_CENTER = (47.3769, 8.5417)
+BENCHMARK_VERSION = 1
+# ----------------------------------------------------------------
+
+# Corpus generator -----------------------------------------------
+def base_jpeg(size=(16, 16)):
+    """Encode one small JPEG without metadata; every corpus file reuses its image data."""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (128, 96, 64)).save(buffer, 'JPEG', quality=50)
+    return buffer.getvalue()
+
+def to_dms(value):
+    """Convert decimal degrees into the (degrees, minutes, seconds) triple stored in EXIF."""
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 4)
+    return (float(degrees), float(minutes), seconds)
+
+def random_offset(center, spread, rng):
+    """Return a random coordinate within spread meters of center."""
+    distance = spread * math.sqrt(rng.random())
+    bearing = rng.random() * 2 * math.pi
+    lat = center[0] + math.degrees(distance * math.cos(bearing) / exif_tool.EARTH_RADIUS)
+    lon = center[1] + math.degrees(distance * math.sin(bearing) / (exif_tool.EARTH_RADIUS * math.cos(math.radians(center[0]))))
+    return lat, lon
+
+def exif_segment(exif_datetime, coords):
+    """Build the APP1 segment holding DateTime and, if coords are given, the GPS IFD."""
+    exif = Image.Exif()
+    exif[0x0132] = exif_datetime
+    if coords:
+        exif[0x8825] = {
+            1: 'N' if coords[0] >= 0 else 'S', 2: to_dms(coords[0]),
+            3: 'E' if coords[1] >= 0 else 'W', 4: to_dms(coords[1]),
+        }
+    payload = exif.tobytes()
+    return b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
+
+def folder_paths(root, depth, fanout):
+    """Return the folders of a tree with the given depth and number of subfolders per folder."""
+    folders = [root]
+    level = [root]
+    for _ in range(depth):
+        level = [os.path.join(parent, f"dir{i}") for parent in level for i in range(fanout)]
+        folders.extend(level)
+    return folders
+
+def generate_corpus(root, files=1000, depth=2, fanout=3, spread=5000.0, no_exif_share=0.1, no_gps_share=0.2,
+                    center=DEFAULT_CENTER, seed=0):
+    """Write a reproducible corpus of small JPEGs with synthetic DateTime and GPS tags.
+    Returns the generation parameters."""
+    rng = random.Random(seed)
+    jpeg = base_jpeg()
+    folders = folder_paths(root, depth, fanout)
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+
+    start = 1_600_000_000
+    for i in range(files):
+        folder = folders[i % len(folders)]
+        data = jpeg
+        if rng.random() >= no_exif_share:
+            timestamp = time.gmtime(start + rng.randrange(0, 3 * 365 * 86400))
+            coords = random_offset(center, spread, rng) if rng.random() >= no_gps_share else None
+            data = jpeg[:2] + exif_segment(time.strftime("%Y:%m:%d %H:%M:%S", timestamp), coords) + jpeg[2:]
+        with open(os.path.join(folder, f"img{i:07d}.jpg"), 'wb') as f:
+            f.write(data)
+
+    return {'files': files, 'depth': depth, 'fanout': fanout, 'spread': spread, 'no_exif_share': no_exif_share,
+            'no_gps_share': no_gps_share, 'center': list(center), 'seed': seed}
+# ----------------------------------------------------------------
+
+# Benchmarks -----------------------------------------------------
+def measure(func, items, repeat=3):
+    """Run func repeat times and report the best wall time and the items processed per second."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'seconds': best, 'items': items, 'per_second': items / best if best > 0 else None}
+
+def run_startup_benchmarks(repeat=3):
+    """Time fresh interpreters that only start, that import exif_tool, and that run the CLI's --help."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        'python_startup': [sys.executable, '-c', 'pass'],
+        'import_exif_tool': [sys.executable, '-c', 'import exif_tool'],
+        'cli_help': [sys.executable, os.path.join(here, 'exif_tool.py'), '--help'],
+    }
+    return {name: measure(partial(subprocess.run, command, cwd=here, stdout=subprocess.DEVNULL, check=True), 1, repeat)
+            for name, command in commands.items()}
+
+def list_images(corpus):
+    return sorted(os.path.join(root, f) for root, _, files in os.walk(corpus) for f in files if exif_tool.is_valid_image(f))
+
+def run_benchmarks(corpus, repeat=3, jobs=4):
+    """Time each stage and the end-to-end operations on a corpus. Returns a dict of results."""
+    paths = list_images(corpus)
+    metadata = [exif_tool.extract_image_metadata(p) for p in paths]
+    coords = [c for _, c in metadata if c]
+    located = [(p, c) for p, (_, c) in zip(paths, metadata) if c]
+    pairs = list(zip(coords, coords[1:] + coords[:1]))
+    radius = 500.0
+    results = {}
+
+    results['extract_exif_data'] = measure(
+        lambda: [exif_tool.extract_exif_data(p, tags=('DateTime',)) for p in paths], len(paths), repeat)
+    results['extract_exif_data_pillow'] = measure(
+        lambda: [exif_tool.extract_exif_data_pillow(p) for p in paths], len(paths), repeat)
+    results['calculate_distance'] = measure(
+        lambda: [exif_tool.calculate_distance(a, b) for a, b in pairs], len(pairs), repeat)
+    if coords:
+        results['calculate_distances'] = measure(
+            lambda: exif_tool.calculate_distances(coords[0], coords), len(coords), repeat)
+    results['group_coordinates_greedy'] = measure(
+        lambda: exif_tool.group_coordinates(located, radius), len(located), repeat)
+    results['group_coordinates_dbscan'] = measure(
+        lambda: exif_tool.group_coordinates(located, radius, 'dbscan'), len(located), repeat)
+
+    with tempfile.TemporaryDirectory() as output:
+        def end_to_end(func, *args, **kwargs):
+            def run():
+                target = os.path.join(output, 'run')
+                shutil.rmtree(target, ignore_errors=True)
+                func(corpus, target, *args, **kwargs)
+            return run
+        results['rename_images_by_datetime'] = measure(
+            end_to_end(exif_tool.rename_images_by_datetime, "%Y-%m-%d_%H-%M-%S", recursive=True), len(paths), repeat)
+        results[f'rename_images_by_datetime_jobs{jobs}'] = measure(
+            end_to_end(exif_tool.rename_images_by_datetime, "%Y-%m-%d_%H-%M-%S", recursive=True, jobs=jobs), len(paths), repeat)
+        results['group_images_by_location'] = measure(
+            end_to_end(exif_tool.group_images_by_location, recursive=True, radius=radius), len(paths), repeat)
+        results[f'group_images_by_location_jobs{jobs}'] = measure(
+            end_to_end(exif_tool.group_images_by_location, recursive=True, radius=radius, jobs=jobs), len(paths), repeat)
+    return results
+# ----------------------------------------------------------------
+
+# Main CLI function ----------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic EXIF corpus and benchmark the stages of exif_tool.py.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=(
+            "Example usage:\n"
+            "  Benchmark a temporary corpus of 5000 images and save the results:\n"
+            "    python benchmark.py --files 5000 --output results.json\n\n"
+            "  Only generate a corpus:\n"
+            "    python benchmark.py --corpus corpus_dir --generate-only\n"
+        )
+    )
+    parser.add_argument('--corpus', type=str, help='Folder for the corpus (default: a temporary folder). An existing corpus is reused.')
+    parser.add_argument('--generate-only', action='store_true', help='Generate the corpus and exit.')
+    parser.add_argument('--startup-only', action='store_true', help='Only measure interpreter startup and import time.')
+    parser.add_argument('--files', type=int, default=1000, help='Number of images in the corpus (default: 1000).')
+    parser.add_argument('--depth', type=int, default=2, help='Depth of the folder tree (default: 2).')
+    parser.add_argument('--fanout', type=int, default=3, help='Subfolders per folder (default: 3).')
+    parser.add_argument('--spread', type=str, default='5km', help='Radius around the center the GPS positions are spread over (default: 5km).')
+    parser.add_argument('--no-exif-share', type=float, default=0.1, help='Share of images without any EXIF data (default: 0.1).')
+    parser.add_argument('--no-gps-share', type=float, default=0.2, help='Share of images with EXIF data but no GPS (default: 0.2).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the corpus (default: 0).')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the best one is reported (default: 3).')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Jobs for the parallel end-to-end runs (default: 4).')
+    parser.add_argument('--output', type=str, help='Write the JSON results to this file instead of stdout.')
+    args = parser.parse_args()
+
+    try:
+        spread = exif_tool.parse_radius(args.spread)
+    except ValueError as e:
+        print(e)
+        return
+
+    temporary = None
+    corpus = args.corpus
+    if corpus is None:
+        temporary = tempfile.TemporaryDirectory()
+        corpus = temporary.name
+
+    try:
+        if args.startup_only:
+            print(json.dumps({'version': BENCHMARK_VERSION, 'startup': run_startup_benchmarks(args.repeat)}, indent=2))
+            return
+        if os.path.isdir(corpus) and os.listdir(corpus):
+            corpus_info = {'path': os.path.abspath(corpus), 'reused': True}
+        else:
+            print(f"Generating {args.files} images in {corpus}...", file=sys.stderr)
+            corpus_info = generate_corpus(corpus, args.files, args.depth, args.fanout, spread, args.no_exif_share,
+                                          args.no_gps_share, seed=args.seed)
+        if args.generate_only:
+            return
+
+        print("Running benchmarks...", file=sys.stderr)
+        report = {
+            'version': BENCHMARK_VERSION,
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': exif_tool.load_numpy() is not None,
+            'corpus': corpus_info,
+            'startup': run_startup_benchmarks(args.repeat),
+            'results': run_benchmarks(corpus, args.repeat, args.jobs),
+        }
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+    finally:
+        if temporary:
+            temporary.cleanup()
+
+# ----------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,31 @@
 import os
-import argparse
-import shutil
+import sys
 import math
-import re
-from PIL import Image
-from PIL.ExifTags import TAGS, GPSTAGS
-from datetime import datetime
+import struct
+import threading
+import queue
+from array import array
+import time
+from contextlib import nullcontext, contextmanager
+from collections import deque, namedtuple
+from functools import partial, lru_cache
+from datetime import datetime, timedelta
+
+# Pillow, NumPy, SQLite, argparse, concurrent.futures and the other modules only some operations need are imported on first
+# use, so that importing this module as a library stays fast.
+
+@lru_cache(maxsize=None)
+def load_numpy():
+    """Return the numpy module, or None if it is not installed (batch distances then fall back to calculate_distance)."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
 
 # Config ---------------------------------------------------------
 SUPPORTED_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+SUPPORTED_EXTENSION_SET = frozenset(SUPPORTED_EXTENSIONS)
 UNIT_CONVERSIONS = {
     'm': 1,            # meters
     'km': 1000,        # kilometers
@@ -18,44 +35,455 @@ UNIT_CONVERSIONS = {
     'ac': 63.614907234075, # acres
     'ha': 10000,       # hectares
 }
+DURATION_UNITS = {
+    's': 1,            # seconds
+    'm': 60,           # minutes
+    'min': 60,         # minutes
+    'h': 3600,         # hours
+    'd': 86400,        # days
+    'w': 604800,       # weeks
+}
 # ----------------------------------------------------------------
 
 # Constants ------------------------------------------------------
 EARTH_RADIUS = 6371000
+PIPELINE_QUEUE_SIZE = 256  # Maximum number of files buffered between two pipeline stages
+PROGRESS_INTERVAL = 0.5  # Minimum number of seconds between two progress events
+# ----------------------------------------------------------------
+
+# Reporting and statistics ---------------------------------------
+class Reporter:
+    """Destination of the messages, errors and progress events of a run.
+
+    By default messages and errors are printed as plain text and progress events are dropped. In JSON mode
+    every one of them is written to stdout as a single-line JSON object with an "event" field, so monitoring
+    tools and the GUI can follow a run without parsing free-form text."""
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        """Send a structured event: one JSON line in JSON mode, a short text line in text mode."""
+        if self.progress == 'json':
+            import json
+            line = json.dumps({'event': event, 'time': time.time(), **fields})
+        elif self.progress == 'text' and event == 'progress':
+            line = (f"Progress: {fields['files_scanned']} scanned, {fields['files_extracted']} extracted, "
+                    f"{fields['files_placed']} placed, {fields['elapsed']:.1f}s")
+        else:
+            return
+        with self._lock:
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+
+    def message(self, text):
+        if self.progress == 'json':
+            self.emit('message', message=text)
+        else:
+            print(text)
+
+    def error(self, text):
+        with self._lock:
+            self.errors += 1
+        if self.progress == 'json':
+            self.emit('error', message=text)
+        else:
+            print(text)
+
+reporter = Reporter()
+
+def set_reporter(new_reporter):
+    """Replace the module-wide Reporter, e.g. to switch to JSON progress events."""
+    global reporter
+    reporter = new_reporter
+
+class RunStats:
+    """Per-stage timing and counters of one run.
+
+    Pipeline stages are wrapped with timed(), which measures the time spent producing each item. Stages
+    on the same thread are nested generators, so a stage's own time is its measured time minus that of
+    the stage feeding it."""
+
+    STAGES = ['scan', 'extract', 'plan', 'dedupe', 'execute', 'place']
+
+    def __init__(self):
+        self.counters = {'files_scanned': 0, 'files_extracted': 0}
+        self.placement = None
+        self.cache = None
+        self.deduplicator = None
+        self._inclusive = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._last_progress = 0.0
+        self._errors_at_start = reporter.errors
+        self._cache_at_start = (0, 0)
+
+    def attach(self, placement, cache):
+        """Set the execute stage sink and the cache whose counters the run reports. Cache hits and misses
+        are counted from the first time the cache is attached, as it may be shared with other runs."""
+        if cache is not None and cache is not self.cache:
+            self._cache_at_start = (cache.hits, cache.misses)
+        self.placement, self.cache = placement, cache
+
+    def timed(self, iterable, stage, counter=None):
+        """Wrap a stage's iterator, adding the time spent in it to the stage and counting its items."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            if counter:
+                with self._lock:
+                    self.counters[counter] += 1
+                self.maybe_progress()
+            yield item
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self._inclusive[stage] = self._inclusive.get(stage, 0.0) + seconds
+
+    def stage_seconds(self):
+        """Return the time spent in each stage itself, excluding the stages feeding it."""
+        inclusive = self._inclusive
+        place_seconds = getattr(self.placement, 'busy_seconds', 0.0)
+        return {
+            'scan': inclusive.get('scan', 0.0),
+            'extract': inclusive.get('extract', 0.0) - inclusive.get('scan', 0.0),
+            'plan': inclusive.get('plan', 0.0) - inclusive.get('extract_queue', 0.0),
+            'dedupe': inclusive['dedupe'] - inclusive.get('plan', 0.0) if 'dedupe' in inclusive else 0.0,
+            'execute': inclusive.get('execute', 0.0),
+            'place': place_seconds,
+        }
+
+    def snapshot(self):
+        """Return the current counters of the run."""
+        elapsed = time.perf_counter() - self._start
+        placement, cache = self.placement, self.cache
+        return {
+            'elapsed': elapsed,
+            **self.counters,
+            'files_placed': getattr(placement, 'files_placed', getattr(placement, 'files_planned', 0)),
+            'bytes_copied': getattr(placement, 'bytes_copied', 0),
+            'cache_hits': cache.hits - self._cache_at_start[0] if cache else 0,
+            'cache_misses': cache.misses - self._cache_at_start[1] if cache else 0,
+            'duplicates': getattr(self.deduplicator, 'duplicates', 0),
+            'bytes_saved': getattr(self.deduplicator, 'bytes_saved', 0),
+            'errors': reporter.errors - self._errors_at_start,
+        }
+
+    def maybe_progress(self):
+        """Emit a progress event if none was sent in the last PROGRESS_INTERVAL seconds."""
+        now = time.perf_counter()
+        if now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        reporter.emit('progress', **self.snapshot())
+
+    def summary(self):
+        """Return the final statistics of the run as a dict."""
+        stats = self.snapshot()
+        elapsed = stats['elapsed']
+        stats['stage_seconds'] = self.stage_seconds()
+        stats['files_per_second'] = stats['files_extracted'] / elapsed if elapsed > 0 else 0.0
+        stats['bytes_per_second'] = stats['bytes_copied'] / elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def summary_lines(self):
+        return stats_lines(self.summary())
+
+def stats_lines(stats):
+    """Format the dict returned by RunStats.summary() as the lines printed by --stats."""
+    stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in stats['stage_seconds'].items())
+    return [
+        f"Total time: {stats['elapsed']:.2f}s ({stats['files_per_second']:.1f} files/s)",
+        f"Stage times: {stages}",
+        f"Files: {stats['files_scanned']} scanned, {stats['files_extracted']} extracted, {stats['files_placed']} placed",
+        f"Bytes copied: {stats['bytes_copied']} ({stats['bytes_per_second']:,.0f} bytes/s)",
+        f"Cache: {stats['cache_hits']} hits, {stats['cache_misses']} misses",
+        f"Duplicates: {stats['duplicates']} ({stats['bytes_saved']} bytes saved)",
+        f"Errors: {stats['errors']}",
+    ]
+# ----------------------------------------------------------------
+
+# Header-only EXIF reader ----------------------------------------
+# Tag name -> (IFD, tag id) for the tags the built-in reader can decode without Pillow.
+EXIF_TAG_IDS = {
+    'Make': ('ifd0', 0x010F),
+    'Model': ('ifd0', 0x0110),
+    'Orientation': ('ifd0', 0x0112),
+    'DateTime': ('ifd0', 0x0132),
+    'DateTimeOriginal': ('exif', 0x9003),
+    'DateTimeDigitized': ('exif', 0x9004),
+    'SubSecTime': ('exif', 0x9290),
+    'SubSecTimeOriginal': ('exif', 0x9291),
+}
+GPS_TAG_IDS = {
+    'GPSLatitudeRef': 0x0001,
+    'GPSLatitude': 0x0002,
+    'GPSLongitudeRef': 0x0003,
+    'GPSLongitude': 0x0004,
+    'GPSAltitudeRef': 0x0005,
+    'GPSAltitude': 0x0006,
+}
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+class UnsupportedFormat(Exception):
+    """Raised when the built-in reader cannot handle a file and Pillow has to be used instead."""
+
+def read_exif_block(f):
+    """Return the raw TIFF/EXIF block of a JPEG or PNG file object, or None if the file has no EXIF.
+    Only the marker/chunk headers and the EXIF payload are read, never the image data."""
+    head = f.read(8)
+    if head[:2] == b'\xff\xd8':
+        f.seek(2)
+        while True:
+            marker = f.read(4)
+            if len(marker) < 4 or marker[0] != 0xFF:
+                return None
+            # Start of scan or end of image: no more metadata segments follow
+            if marker[1] in (0xDA, 0xD9):
+                return None
+            length = struct.unpack('>H', marker[2:])[0]
+            if marker[1] == 0xE1:
+                data = f.read(length - 2)
+                if data[:6] == b'Exif\x00\x00':
+                    return data[6:]
+            else:
+                f.seek(length - 2, os.SEEK_CUR)
+    if head == PNG_SIGNATURE:
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            length, chunk_type = struct.unpack('>I4s', chunk)
+            if chunk_type == b'eXIf':
+                return f.read(length)
+            if chunk_type in (b'IDAT', b'IEND'):
+                return None
+            f.seek(length + 4, os.SEEK_CUR)  # chunk data + CRC
+    raise UnsupportedFormat(f"Unrecognized image header: {head!r}")
+
+def parse_ifd(block, offset, endian, wanted_ids):
+    """Decode only the requested tag ids from the IFD at the given offset of a TIFF block."""
+    values = {}
+    count = struct.unpack_from(endian + 'H', block, offset)[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, type_id, n = struct.unpack_from(endian + 'HHI', block, entry)
+        if tag not in wanted_ids or type_id not in TIFF_TYPE_SIZES:
+            continue
+        size = TIFF_TYPE_SIZES[type_id] * n
+        data_offset = entry + 8 if size <= 4 else struct.unpack_from(endian + 'I', block, entry + 8)[0]
+        raw = block[data_offset:data_offset + size]
+        if len(raw) < size:
+            continue
+        if type_id == 2:
+            values[tag] = raw.split(b'\x00', 1)[0].decode('ascii', 'replace')
+        elif type_id in (5, 10):
+            fmt = endian + ('I' if type_id == 5 else 'i') * (2 * n)
+            parts = struct.unpack(fmt, raw)
+            rationals = tuple(num / den if den else float('nan') for num, den in zip(parts[::2], parts[1::2]))
+            values[tag] = rationals[0] if n == 1 else rationals
+        elif type_id in (3, 4, 8, 9, 13):
+            fmt = endian + {3: 'H', 4: 'I', 8: 'h', 9: 'i', 13: 'I'}[type_id] * n
+            ints = struct.unpack(fmt, raw)
+            values[tag] = ints[0] if n == 1 else ints
+        else:
+            values[tag] = raw
+    return values
+
+def parse_exif_block(block, tags, gps=True):
+    """Decode the named tags (and optionally the GPS IFD) from a raw TIFF/EXIF block."""
+    endian = {b'II': '<', b'MM': '>'}.get(block[:2])
+    if endian is None:
+        raise UnsupportedFormat("Invalid TIFF byte order")
+    ifd0_offset = struct.unpack_from(endian + 'I', block, 4)[0]
+
+    ifd0_ids = {EXIF_TAG_IDS[t][1] for t in tags if EXIF_TAG_IDS[t][0] == 'ifd0'}
+    exif_ids = {EXIF_TAG_IDS[t][1] for t in tags if EXIF_TAG_IDS[t][0] == 'exif'}
+    ifd0 = parse_ifd(block, ifd0_offset, endian, ifd0_ids | {EXIF_IFD_POINTER, GPS_IFD_POINTER})
+
+    exif = {name: ifd0[tag_id] for name, (_, tag_id) in EXIF_TAG_IDS.items() if name in tags and tag_id in ifd0}
+    if exif_ids and EXIF_IFD_POINTER in ifd0:
+        sub_ifd = parse_ifd(block, ifd0[EXIF_IFD_POINTER], endian, exif_ids)
+        exif.update({name: sub_ifd[tag_id] for name, (_, tag_id) in EXIF_TAG_IDS.items() if name in tags and tag_id in sub_ifd})
+
+    gps_info = {}
+    if gps and GPS_IFD_POINTER in ifd0:
+        gps_ifd = parse_ifd(block, ifd0[GPS_IFD_POINTER], endian, set(GPS_TAG_IDS.values()))
+        gps_info = {name: gps_ifd[tag_id] for name, tag_id in GPS_TAG_IDS.items() if tag_id in gps_ifd}
+    return exif, gps_info
 # ----------------------------------------------------------------
 
 # EXIF helper functions ------------------------------------------
-def extract_exif_data(image_path):
-    """Extract EXIF data including DateTime and GPS information from an image."""
+def extract_exif_data_pillow(image_path):
+    """Extract and decode every EXIF tag of an image using Pillow."""
+    from PIL import Image
+    from PIL.ExifTags import TAGS, GPSTAGS
+    with Image.open(image_path) as img:
+        exif_data = img._getexif() if hasattr(img, '_getexif') else img.getexif()
+    if not exif_data:
+        return None, None
+    exif = {}
+    gps_info = {}
+    for tag, value in exif_data.items():
+        decoded_tag = TAGS.get(tag, tag)
+        if decoded_tag == "GPSInfo":
+            for gps_tag, gps_value in value.items():
+                gps_info[GPSTAGS.get(gps_tag, gps_tag)] = gps_value
+        else:
+            exif[decoded_tag] = value
+    return exif, gps_info
+
+def extract_exif_data(image_path, tags=None, gps=True):
+    """Extract EXIF data including DateTime and GPS information from an image.
+
+    If tags is given, only those tags (and the GPS IFD if gps is True) are decoded, using the
+    header-only reader where possible and falling back to Pillow for other formats."""
     try:
-        img = Image.open(image_path)
-        exif_data = img._getexif()
-        if not exif_data:
-            return None, None
-        exif = {}
-        gps_info = {}
-        for tag, value in exif_data.items():
-            decoded_tag = TAGS.get(tag, tag)
-            if decoded_tag == "GPSInfo":
-                for gps_tag, gps_value in value.items():
-                    gps_info[GPSTAGS.get(gps_tag, gps_tag)] = gps_value
-            else:
-                exif[decoded_tag] = value
-        return exif, gps_info
+        if tags is None or not set(tags) <= EXIF_TAG_IDS.keys():
+            exif, gps_info = extract_exif_data_pillow(image_path)
+        else:
+            try:
+                with open(image_path, 'rb') as f:
+                    block = read_exif_block(f)
+                if block is None:
+                    return None, None
+                return parse_exif_block(block, tags, gps)
+            except (UnsupportedFormat, struct.error):
+                exif, gps_info = extract_exif_data_pillow(image_path)
+        if exif is None or tags is None:
+            return exif, gps_info
+        exif = {tag: value for tag, value in exif.items() if tag in tags}
+        return exif, (gps_info if gps else {})
     except Exception as e:
-        print(f"Error extracting EXIF data from {image_path}: {e}")
+        reporter.error(f"Error extracting EXIF data from {image_path}: {e}")
         return None, None
 
-def format_exif_datetime(exif_datetime, date_format="%Y-%m-%d_%H-%M-%S"):
-    """Format the EXIF DateTime into the specified format."""
-    if exif_datetime:
+def extract_image_metadata(image_path):
+    """Return the (DateTime, GPS coordinates) pair used by the rename and group operations."""
+    exif, gps_info = extract_exif_data(image_path, tags=('DateTime',), gps=True)
+    if exif is None:
+        return None, None
+    return exif.get('DateTime'), extract_gps_coordinates(gps_info)
+
+def stat_image(image_path):
+    """Return the stat result of an image, reusing the cached one of an os.DirEntry from scan_images."""
+    return image_path.stat() if isinstance(image_path, os.DirEntry) else os.stat(image_path)
+
+def extract_image_record(image_path, cache=None):
+    """Return (exif_datetime, gps_coordinates, size, mtime_ns) for an image, from the cache if it is unchanged."""
+    try:
+        st = stat_image(image_path)
+    except OSError as e:
+        reporter.error(f"Error extracting EXIF data from {os.fspath(image_path)}: {e}")
+        return None, None, -1, -1
+    if cache:
+        exif_datetime, gps_coordinates = cache.get_or_extract(image_path, st)
+    else:
+        exif_datetime, gps_coordinates = extract_image_metadata(image_path)
+    return exif_datetime, gps_coordinates, st.st_size, st.st_mtime_ns
+
+def extract_metadata_batch(file_paths, executor=None, cache=None, window=None):
+    """Extract metadata for several images (paths or os.DirEntry objects), yielding
+    (file_path, exif_datetime, gps_coordinates, size, mtime_ns) in input order.
+    If an executor is given the files are read concurrently with at most window files in flight,
+    and if a cache is given unchanged files are answered from it without being opened."""
+    extract = partial(extract_image_record, cache=cache)
+    if executor is None:
+        for file_path in file_paths:
+            yield (os.fspath(file_path), *extract(file_path))
+        return
+    window = window or PIPELINE_QUEUE_SIZE
+    pending = deque()
+    for file_path in file_paths:
+        pending.append((os.fspath(file_path), executor.submit(extract, file_path)))
+        if len(pending) >= window:
+            done_path, future = pending.popleft()
+            yield (done_path, *future.result())
+    while pending:
+        done_path, future = pending.popleft()
+        yield (done_path, *future.result())
+
+# Warm thread pool installed by the job server, shared by the runs it executes
+shared_executor = None
+
+def new_thread_pool(workers):
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=workers)
+
+def create_executor(jobs):
+    """Return a thread pool for jobs > 1, or a no-op context for serial extraction.
+    If a shared_executor is installed it is reused, and left running, instead of starting new threads."""
+    if jobs <= 1:
+        return nullcontext()
+    if shared_executor is not None:
+        return nullcontext(shared_executor)
+    return new_thread_pool(jobs)
+
+# strftime directives compile_date_format turns into str.format fields
+DATE_FORMAT_FIELDS = {
+    'Y': '{0.year:04d}', 'm': '{0.month:02d}', 'd': '{0.day:02d}',
+    'H': '{0.hour:02d}', 'M': '{0.minute:02d}', 'S': '{0.second:02d}', '%': '%',
+}
+
+@lru_cache(maxsize=4096)
+def _parse_exif_datetime(exif_datetime):
+    # The standard "YYYY:MM:DD HH:MM:SS" layout is sliced directly; anything else goes through strptime
+    if len(exif_datetime) != 19 or exif_datetime[4] != ':' or exif_datetime[7] != ':' or exif_datetime[10] != ' ' \
+            or exif_datetime[13] != ':' or exif_datetime[16] != ':':
         try:
-            return datetime.strptime(exif_datetime, "%Y:%m:%d %H:%M:%S").strftime(date_format)
+            return datetime.strptime(exif_datetime, "%Y:%m:%d %H:%M:%S")
         except ValueError:
-            print(f"Could not parse EXIF date-time: {exif_datetime}")
             return None
+    try:
+        return datetime(int(exif_datetime[0:4]), int(exif_datetime[5:7]), int(exif_datetime[8:10]),
+                        int(exif_datetime[11:13]), int(exif_datetime[14:16]), int(exif_datetime[17:19]))
+    except ValueError:
+        return None
+
+def parse_exif_datetime(exif_datetime):
+    """Parse an EXIF DateTime string into a datetime, or None if it is missing or invalid."""
+    if exif_datetime:
+        parsed = _parse_exif_datetime(exif_datetime)
+        if parsed is None:
+            reporter.error(f"Could not parse EXIF date-time: {exif_datetime}")
+        return parsed
     return None
 
+@lru_cache(maxsize=32)
+def compile_date_format(date_format):
+    """Return a function formatting a datetime like datetime.strftime(date_format). Formats using only
+    %Y %m %d %H %M %S are compiled into a str.format template; others fall back to strftime."""
+    parts = []
+    i = 0
+    while i < len(date_format):
+        char = date_format[i]
+        if char == '%':
+            field = DATE_FORMAT_FIELDS.get(date_format[i + 1:i + 2])
+            if field is None:
+                return lambda value: value.strftime(date_format)
+            parts.append(field)
+            i += 2
+        else:
+            parts.append(char.replace('{', '{{').replace('}', '}}'))
+            i += 1
+    return ''.join(parts).format
+
+def format_exif_datetime(exif_datetime, date_format="%Y-%m-%d_%H-%M-%S"):
+    """Format the EXIF DateTime into the specified format."""
+    parsed = parse_exif_datetime(exif_datetime)
+    return compile_date_format(date_format)(parsed) if parsed else None
+
 def extract_gps_coordinates(gps_info):
     """Convert the GPS EXIF information into latitude and longitude."""
     if not gps_info:
@@ -76,6 +504,301 @@ def extract_gps_coordinates(gps_info):
     return None
 # ----------------------------------------------------------------
 
+# Metadata cache -------------------------------------------------
+class MetadataCache:
+    """SQLite cache of extracted DateTime and GPS coordinates, and of the content hashes used by
+    --dedupe, keyed by path and validated against the file's size, mtime and inode so unchanged files
+    are never opened again. The metadata is indexed by time and location for queries, see query()."""
+
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        import sqlite3
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " path TEXT PRIMARY KEY, directory TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,"
+            " datetime TEXT, lat REAL, lon REAL, timestamp INTEGER, cell INTEGER)"
+        )
+        self._upgrade()
+        self._conn.execute("CREATE INDEX IF NOT EXISTS metadata_directory ON metadata (directory)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS metadata_timestamp ON metadata (timestamp)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS metadata_cell ON metadata (cell)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY, directory TEXT NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,"
+            " partial TEXT, full TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS hashes_directory ON hashes (directory)")
+
+    def _upgrade(self):
+        """Add the timestamp and cell columns used by queries to a cache written by an older version."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(metadata)")}
+        if 'timestamp' in columns:
+            return
+        self._conn.execute("ALTER TABLE metadata ADD COLUMN timestamp INTEGER")
+        self._conn.execute("ALTER TABLE metadata ADD COLUMN cell INTEGER")
+        rows = self._conn.execute("SELECT path, datetime, lat, lon FROM metadata").fetchall()
+        self._conn.executemany("UPDATE metadata SET timestamp = ?, cell = ? WHERE path = ?",
+                               [(*query_keys(exif_datetime, lat, lon), path) for path, exif_datetime, lat, lon in rows])
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def file_key(st):
+        """Return the (size, mtime_ns, inode) tuple identifying a file version."""
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, image_path, st):
+        """Return the cached (exif_datetime, gps_coordinates) for an unchanged file, or None."""
+        path = os.path.abspath(os.fspath(image_path))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, datetime, lat, lon FROM metadata WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None or tuple(row[:3]) != self.file_key(st):
+            return None
+        exif_datetime, lat, lon = row[3:]
+        return exif_datetime, ((lat, lon) if lat is not None else None)
+
+    def put(self, image_path, st, exif_datetime, gps_coordinates):
+        """Store the metadata of a file version."""
+        path = os.path.abspath(os.fspath(image_path))
+        lat, lon = gps_coordinates if gps_coordinates else (None, None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, os.path.dirname(path), *self.file_key(st), exif_datetime, lat, lon,
+                 *query_keys(exif_datetime, lat, lon)),
+            )
+            self._commit_periodically()
+
+    def _commit_periodically(self):
+        self._pending += 1
+        if self._pending >= self.COMMIT_INTERVAL:
+            self._conn.commit()
+            self._pending = 0
+
+    def get_hash(self, image_path, st, kind):
+        """Return the cached 'partial' or 'full' content hash of an unchanged file, or None."""
+        path = os.path.abspath(os.fspath(image_path))
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT size, mtime_ns, inode, {kind} FROM hashes WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None or tuple(row[:3]) != self.file_key(st):
+            return None
+        return row[3]
+
+    def put_hash(self, image_path, st, kind, value):
+        """Store the 'partial' or 'full' content hash of a file version."""
+        path = os.path.abspath(os.fspath(image_path))
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, inode FROM hashes WHERE path = ?", (path,)).fetchone()
+            if row is not None and tuple(row) == self.file_key(st):
+                self._conn.execute(f"UPDATE hashes SET {kind} = ? WHERE path = ?", (value, path))
+            else:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO hashes (path, directory, size, mtime_ns, inode, {kind}) VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, os.path.dirname(path), *self.file_key(st), value),
+                )
+            self._commit_periodically()
+
+    def get_or_extract(self, image_path, st=None):
+        """Return (exif_datetime, gps_coordinates), extracting and caching them on a miss."""
+        if st is None:
+            try:
+                st = stat_image(image_path)
+            except OSError as e:
+                reporter.error(f"Error extracting EXIF data from {os.fspath(image_path)}: {e}")
+                return None, None
+        cached = self.get(image_path, st)
+        # The counters are shared by the extraction threads
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+        with self._lock:
+            self.misses += 1
+        exif_datetime, gps_coordinates = extract_image_metadata(image_path)
+        self.put(image_path, st, exif_datetime, gps_coordinates)
+        return exif_datetime, gps_coordinates
+
+    def evict_missing(self, directory, file_paths):
+        """Drop entries of a scanned directory whose files were not seen in it anymore."""
+        directory = os.path.abspath(directory)
+        seen = {os.path.abspath(p) for p in file_paths}
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM metadata WHERE directory = ?", (directory,)).fetchall()
+            stale = [(path,) for path, in rows if path not in seen]
+            self._conn.executemany("DELETE FROM metadata WHERE path = ?", stale)
+            rows = self._conn.execute("SELECT path FROM hashes WHERE directory = ?", (directory,)).fetchall()
+            self._conn.executemany("DELETE FROM hashes WHERE path = ?", [(path,) for path, in rows if path not in seen])
+            self.evicted += len(stale)
+
+    def compact(self):
+        """Drop entries of files that no longer exist anywhere and reclaim the database space."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM metadata").fetchall()
+            stale = [(path,) for path, in rows if not os.path.exists(path)]
+            self._conn.executemany("DELETE FROM metadata WHERE path = ?", stale)
+            rows = self._conn.execute("SELECT path FROM hashes").fetchall()
+            self._conn.executemany("DELETE FROM hashes WHERE path = ?", [(path,) for path, in rows if not os.path.exists(path)])
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            self.evicted += len(stale)
+
+    def query(self, start=None, end=None, cell_ranges=None, folder=None, batch_size=1000):
+        """Yield the (path, datetime, lat, lon, size, mtime_ns, timestamp) rows of the images taken between
+        the start and end timestamps (inclusive), in one of the inclusive (first, last) cell key ranges and
+        below folder, each if given. Rows are ordered by timestamp (images without one first) and path."""
+        conditions, parameters = [], []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("timestamp <= ?")
+            parameters.append(end)
+        if folder is not None:
+            # Paths below folder are one range of the primary key
+            prefix = os.path.join(os.path.abspath(folder), '')
+            conditions.append("path >= ? AND path < ?")
+            parameters += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        if cell_ranges is not None:
+            conditions.append("cell BETWEEN ? AND ?")
+        sql = ("SELECT path, datetime, lat, lon, size, mtime_ns, timestamp FROM metadata"
+               + (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY timestamp, path")
+
+        def fetch(range_parameters):
+            with self._lock:
+                cursor = self._conn.execute(sql, parameters + list(range_parameters))
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+
+        if cell_ranges is None:
+            yield from fetch(())
+        elif len(cell_ranges) == 1:
+            yield from fetch(cell_ranges[0])
+        else:
+            rows = [row for cell_range in cell_ranges for row in fetch(cell_range)]
+            rows.sort(key=lambda row: (row[6] is not None, row[6] or 0, row[0]))
+            yield from rows
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def summary(self):
+        return f"Cache: {self.hits} hits, {self.misses} misses, {self.evicted} evicted"
+# ----------------------------------------------------------------
+
+# Metadata queries -----------------------------------------------
+# Besides the B-tree on its paths, the metadata cache indexes the EXIF time as seconds since 1970 and
+# the coordinates by the key of a QUERY_CELL_DEGREES grid cell. Cells are numbered row by row, so a
+# bounding box is one key range per row of cells, and exact bounds are checked on the rows found.
+QUERY_CELL_DEGREES = 0.01
+QUERY_LON_CELLS = round(360 / QUERY_CELL_DEGREES) + 1
+
+def cell_row(lat):
+    return math.floor((lat + 90) / QUERY_CELL_DEGREES)
+
+def cell_column(lon):
+    return math.floor((lon + 180) / QUERY_CELL_DEGREES)
+
+def query_keys(exif_datetime, lat, lon):
+    """Return the (timestamp, cell) index keys of an image's metadata, each None if it is missing."""
+    parsed = _parse_exif_datetime(exif_datetime) if exif_datetime else None
+    timestamp = int((parsed - EPOCH).total_seconds()) if parsed else None
+    cell = cell_row(lat) * QUERY_LON_CELLS + cell_column(lon) if lat is not None else None
+    return timestamp, cell
+
+def bbox_cell_ranges(bbox):
+    """Return the inclusive cell key ranges covering a (south, west, north, east) bounding box, with
+    adjacent ranges merged. A box with west > east crosses the antimeridian."""
+    south, west, north, east = bbox
+    if west <= east:
+        columns = [(cell_column(west), cell_column(east))]
+    else:
+        columns = [(cell_column(-180.0), cell_column(east)), (cell_column(west), cell_column(180.0))]
+    ranges = []
+    for row in range(cell_row(south), cell_row(north) + 1):
+        for first, last in columns:
+            first, last = row * QUERY_LON_CELLS + first, row * QUERY_LON_CELLS + last
+            if ranges and ranges[-1][1] + 1 >= first:
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+    return ranges
+
+def in_bbox(coords, bbox):
+    south, west, north, east = bbox
+    lat, lon = coords
+    if not south <= lat <= north:
+        return False
+    return west <= lon <= east if west <= east else (lon >= west or lon <= east)
+
+def radius_bbox(center, radius):
+    """Return a (south, west, north, east) bounding box containing every point within radius meters of center."""
+    lat, lon = center
+    angle = radius / EARTH_RADIUS
+    south, north = lat - math.degrees(angle), lat + math.degrees(angle)
+    if south <= -90 or north >= 90 or angle >= math.pi / 2:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    # Widest longitude difference of the points within the radius, reached north of center's latitude
+    ratio = math.sin(angle) / math.cos(math.radians(lat))
+    if ratio >= 1:
+        return south, -180.0, north, 180.0
+    delta = math.degrees(math.asin(ratio))
+    west, east = lon - delta, lon + delta
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+def parse_query_time(value, end=False):
+    """Parse a date such as '2023', '2023-05', '2023-05-01' or '2023-05-01 12:00' into seconds since 1970
+    of the naive EXIF time. With end, a year, month, day or minute stands for its last second."""
+    periods = (("%Y", lambda t: t.replace(year=t.year + 1)),
+               ("%Y-%m", lambda t: t.replace(year=t.year + t.month // 12, month=t.month % 12 + 1)),
+               ("%Y-%m-%d", lambda t: t + timedelta(days=1)))
+    for date_format, following in periods:
+        try:
+            parsed = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        break
+    else:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid date: {value}") from None
+        if parsed.tzinfo is not None:
+            raise ValueError(f"EXIF times have no time zone, got {value}")
+        following = (lambda t: t + timedelta(minutes=1)) if len(value) <= 16 else (lambda t: t + timedelta(seconds=1))
+    seconds = int((parsed - EPOCH).total_seconds())
+    return int((following(parsed) - EPOCH).total_seconds()) - 1 if end else seconds
+# ----------------------------------------------------------------
+
 # Math helper functions ------------------------------------------
 def calculate_distance(coord1, coord2):
     """Calculate approximate distance (in meters) between two GPS coordinates (lat, lon)."""
@@ -95,8 +818,35 @@ def calculate_distance(coord1, coord2):
 
     return EARTH_RADIUS * c
 
+def haversine_radians(lat1, lon1, lat2, lon2):
+    """Vectorized haversine distance (in meters) between NumPy arrays of radian coordinates."""
+    np = load_numpy()
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def calculate_distances(coord, coords):
+    """Calculate distances (in meters) from one GPS coordinate to each of many coordinates."""
+    np = load_numpy()
+    if np is None:
+        return [calculate_distance(coord, other) for other in coords]
+    lat1, lon1 = np.radians(coord)
+    points = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    return haversine_radians(lat1, lon1, points[:, 0], points[:, 1])
+
+def calculate_pairwise_distances(coords1, coords2=None):
+    """Calculate the matrix of distances (in meters) between two blocks of GPS coordinates,
+    or within one block if coords2 is omitted."""
+    coords2 = coords1 if coords2 is None else coords2
+    np = load_numpy()
+    if np is None:
+        return [[calculate_distance(a, b) for b in coords2] for a in coords1]
+    points1 = np.radians(np.asarray(coords1, dtype=float).reshape(-1, 2))
+    points2 = np.radians(np.asarray(coords2, dtype=float).reshape(-1, 2))
+    return haversine_radians(points1[:, 0, None], points1[:, 1, None], points2[None, :, 0], points2[None, :, 1])
+
 def parse_radius(radius_str):
     """Parse radius with units (e.g., '1000m', '1km', '1mi') and return the value in meters."""
+    import re
     match = re.match(r"(\d+(?:\.\d+)?)([a-zA-Z]*)", radius_str)
     if not match:
         raise ValueError(f"Invalid radius format: {radius_str}")
@@ -109,173 +859,3234 @@ def parse_radius(radius_str):
 
     return value * UNIT_CONVERSIONS[unit]
 
+def parse_duration(duration_str):
+    """Parse a duration with units (e.g., '90s', '30min', '2h', '1d') and return the value in seconds."""
+    import re
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([a-zA-Z]*)", duration_str.strip())
+    if not match:
+        raise ValueError(f"Invalid duration format: {duration_str}")
+
+    value = float(match.group(1))
+    unit = match.group(2).lower() if match.group(2) else 's'  # default to seconds if no unit specified
+
+    if unit not in DURATION_UNITS:
+        raise ValueError(f"Unsupported duration unit: {unit}")
+
+    return value * DURATION_UNITS[unit]
 # ----------------------------------------------------------------
 
-# Filesystem helper functions ------------------------------------
-def is_valid_image(file):
-    """Check if the file has a supported image extension."""
-    _, ext = os.path.splitext(file)
-    return ext.lower() in SUPPORTED_EXTENSIONS
+# Spatial index --------------------------------------------------
+def to_cartesian(coord):
+    """Convert a (lat, lon) coordinate into (x, y, z) meters on the earth sphere."""
+    lat, lon = math.radians(coord[0]), math.radians(coord[1])
+    return (EARTH_RADIUS * math.cos(lat) * math.cos(lon),
+            EARTH_RADIUS * math.cos(lat) * math.sin(lon),
+            EARTH_RADIUS * math.sin(lat))
 
-def preserve_folder_structure(input_folder, output_folder, root, file):
-    """Generate the corresponding path in the output folder, preserving the directory structure."""
-    relative_path = os.path.relpath(root, input_folder)  # Get the relative path from the input folder
-    destination_dir = os.path.join(output_folder, relative_path)
-    os.makedirs(destination_dir, exist_ok=True)  # Create the directories if they don't exist
-    return os.path.join(destination_dir, file)
+class SpatialGrid:
+    """Uniform 3D grid over earth-centered coordinates with cells as wide as the grouping radius.
 
-def group_images_by_location(input_folder, output_folder, recursive=False, radius=None):
-    """Group images into folders based on their GPS coordinates, considering a radius if specified,
-    while keeping the original folder structure."""
-    
-    for root, dirs, files in os.walk(input_folder):
-        gps_groups = []
+    The straight-line distance between two points on the sphere is never longer than their
+    great-circle distance, so every point within the radius lies in the same or an adjacent cell.
+    This works the same at the poles and across the antimeridian. Entries are numbered in insertion
+    order, and the cells only hold their numbers while the coordinates are kept in two arrays."""
 
-        for file in files:
-            if not is_valid_image(file):
-                continue
-            file_path = os.path.join(root, file)
-            exif, gps_info = extract_exif_data(file_path)
-            if gps_info:
-                gps_coordinates = extract_gps_coordinates(gps_info)
-                if gps_coordinates:
-                    # If radius is specified, group within the radius for each folder separately
-                    if radius is not None:
-                        grouped = False
-                        for group in gps_groups:
-                            if calculate_distance(group[0], gps_coordinates) <= radius:
-                                group[1].append(file_path)
-                                grouped = True
-                                break
-                        if not grouped:
-                            gps_groups.append((gps_coordinates, [file_path]))
-                    else:
-                        gps_groups.append((gps_coordinates, [file_path]))
-
-        # Now create folders for each group within the same folder structure
-        if len(gps_groups) == 1:
-            gps_coords, file_list = gps_groups[0]
-            # Create folder for all images if they're in one group
-            relative_path = os.path.relpath(root, input_folder)
-            gps_folder = os.path.join(output_folder, relative_path, f"all_images_{gps_coords[0]:.6f}_{gps_coords[1]:.6f}")
-            os.makedirs(gps_folder, exist_ok=True)
-            for file_path in file_list:
-                shutil.copy(file_path, gps_folder)
-        else:
-            for gps_coords, file_list in gps_groups:
-                # Create a folder for each group based on GPS coordinates, keeping original folder structure
-                relative_path = os.path.relpath(root, input_folder)
-                gps_folder = os.path.join(output_folder, relative_path, f"{gps_coords[0]:.6f}_{gps_coords[1]:.6f}")
-                os.makedirs(gps_folder, exist_ok=True)
-                for file_path in file_list:
-                    shutil.copy(file_path, gps_folder)
-
-        if not recursive:
-            break
+    NEIGHBOURS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+    def __init__(self, radius):
+        self.radius = radius
+        # Slightly enlarged so rounding can never push a point within the radius two cells away
+        self.cell_size = max(radius, 1.0) * (1 + 1e-9)
+        self.cells = {}
+        self.lat = array('d')
+        self.lon = array('d')
+
+    def __len__(self):
+        return len(self.lat)
+
+    def cell(self, coord):
+        return tuple(math.floor(v / self.cell_size) for v in to_cartesian(coord))
 
-def rename_images_by_datetime(input_folder, output_folder, date_format, recursive=False):
-    """Rename images based on their EXIF DateTime metadata, preserving the original folder structure."""
-    for root, dirs, files in os.walk(input_folder):
-        for file in files:
-            if not is_valid_image(file):
+    def add(self, coord):
+        """Insert a coordinate and return its entry number (0 for the first one, then 1, 2, ...)."""
+        entry = len(self.lat)
+        self.lat.append(coord[0])
+        self.lon.append(coord[1])
+        self.cells.setdefault(self.cell(coord), []).append(entry)
+        return entry
+
+    def coordinates(self, entry):
+        return (self.lat[entry], self.lon[entry])
+
+    def find_first(self, coord):
+        """Return the smallest number of the entries within the radius of coord, or None."""
+        cx, cy, cz = self.cell(coord)
+        best = None
+        for dx, dy, dz in self.NEIGHBOURS:
+            for entry in self.cells.get((cx + dx, cy + dy, cz + dz), ()):
+                if (best is None or entry < best) and calculate_distance(self.coordinates(entry), coord) <= self.radius:
+                    best = entry
+        return best
+
+    def neighbours(self, coord):
+        """Return the numbers of all entries within the radius of coord."""
+        cx, cy, cz = self.cell(coord)
+        candidates = [entry for dx, dy, dz in self.NEIGHBOURS for entry in self.cells.get((cx + dx, cy + dy, cz + dz), ())]
+        if not candidates:
+            return []
+        distances = calculate_distances(coord, [self.coordinates(entry) for entry in candidates])
+        return [entry for entry, distance in zip(candidates, distances) if distance <= self.radius]
+# ----------------------------------------------------------------
+
+# GPS grouping ---------------------------------------------------
+# The clustering functions work on points given as indexes into parallel lat/lon arrays, like the
+# columns of an ImageCatalog, and label each point with its group instead of building lists of files,
+# so a grouped image costs a few array slots. group_members orders the points group by group.
+CLUSTER_METHODS = ['greedy', 'dbscan']
+
+class GreedyGroups:
+    """Greedy grouping state that files can be added to one at a time: each file joins the first group
+    whose anchor is within the radius, or starts a new group. Without a radius every file is its own group.
+    groups holds the (anchor, [file_path]) pairs in creation order."""
+
+    def __init__(self, radius=None):
+        self.radius = radius
+        self.groups = []
+        self._index = SpatialGrid(radius) if radius is not None else None
+
+    def add(self, file_path, gps_coordinates):
+        """Add a file and return the index of the group it joined or started."""
+        # If radius is specified, join the first group (in creation order) within the radius,
+        # looking only at groups in neighbouring grid cells; the grid's entries are the groups' anchors
+        if self._index is not None:
+            match = self._index.find_first(gps_coordinates)
+            if match is not None:
+                self.groups[match][1].append(file_path)
+                return match
+            self._index.add(gps_coordinates)
+        self.groups.append((gps_coordinates, [file_path]))
+        return len(self.groups) - 1
+
+def cluster_greedy(lat, lon, indexes, radius=None):
+    """Group the points (lat[i], lon[i]) for i in indexes like GreedyGroups, in that order.
+    Returns (anchor_lat, anchor_lon, labels, None): the anchor of each group in creation order and the
+    group of each point (see cluster_points)."""
+    if radius is None:
+        return (array('d', (lat[i] for i in indexes)), array('d', (lon[i] for i in indexes)),
+                array('q', range(len(indexes))), None)
+    grid = SpatialGrid(radius)
+    labels = array('q')
+    for i in indexes:
+        coords = (lat[i], lon[i])
+        group = grid.find_first(coords)
+        labels.append(grid.add(coords) if group is None else group)
+    return grid.lat, grid.lon, labels, None
+
+def cluster_dbscan(lat, lon, indexes, radius, min_samples=1, tie_key=None):
+    """Cluster the points (lat[i], lon[i]) for i in indexes with DBSCAN, using the radius as epsilon.
+
+    Points are processed in order of their coordinates, and of tie_key(position in indexes) among equal
+    ones (e.g. their paths), so the result does not depend on the order of indexes. Points that belong
+    to no cluster each form a group of their own. Groups are anchored at their centroid and ordered by
+    it. Returns (anchor_lat, anchor_lon, labels, order) as described in cluster_points."""
+    order = array('q', sorted(range(len(indexes)), key=lambda p: (lat[indexes[p]], lon[indexes[p]])))
+    grid = SpatialGrid(radius)
+    for p in order:
+        grid.add((lat[indexes[p]], lon[indexes[p]]))
+    if tie_key is not None:
+        start = 0
+        for end in range(1, len(order) + 1):
+            if end == len(order) or grid.coordinates(end) != grid.coordinates(start):
+                if end - start > 1:
+                    order[start:end] = array('q', sorted(order[start:end], key=tie_key))
+                start = end
+
+    # Labels by entry, i.e. by position in the processing order
+    unvisited, noise = -2, -1
+    labels = array('q', [unvisited]) * len(order)
+    count = 0
+    for k in range(len(order)):
+        if labels[k] != unvisited:
+            continue
+        neighbours = grid.neighbours(grid.coordinates(k))
+        if len(neighbours) < min_samples:
+            labels[k] = noise  # Unless a later cluster reaches it as a border point
+            continue
+        queue = deque(neighbours)
+        while queue:
+            j = queue.popleft()
+            if labels[j] >= 0:
                 continue
-            file_path = os.path.join(root, file)
-            exif, _ = extract_exif_data(file_path)
-            if exif:
-                exif_datetime = exif.get('DateTime')
-                formatted_date = format_exif_datetime(exif_datetime, date_format)
-                if formatted_date:
-                    # Preserve folder structure when renaming
-                    output_path = preserve_folder_structure(input_folder, output_folder, root, formatted_date + os.path.splitext(file)[1])
-                    shutil.copy(file_path, output_path)
-
-        if not recursive:
-            break
+            expand = labels[j] == unvisited
+            labels[j] = count
+            if expand:
+                j_neighbours = grid.neighbours(grid.coordinates(j))
+                if len(j_neighbours) >= min_samples:
+                    queue.extend(j_neighbours)
+        count += 1
+    for k, label in enumerate(labels):
+        if label == noise:
+            labels[k] = count
+            count += 1
+
+    # Centroids are averaged on the sphere, so they are correct across the antimeridian
+    sums = [array('d', [0.0]) * count for _ in range(3)]
+    first = array('q', [-1]) * count
+    sizes = array('q', [0]) * count
+    for k, label in enumerate(labels):
+        for axis, value in zip(sums, to_cartesian(grid.coordinates(k))):
+            axis[label] += value
+        sizes[label] += 1
+        if first[label] < 0:
+            first[label] = k
+    anchors = []
+    for g in range(count):
+        x, y, z = (axis[g] / sizes[g] for axis in sums)
+        anchors.append((math.degrees(math.atan2(z, math.hypot(x, y))), math.degrees(math.atan2(y, x)), first[g]))
+    ranks = array('q', [0]) * count
+    for rank, g in enumerate(sorted(range(count), key=anchors.__getitem__)):
+        ranks[g] = rank
+    for k, label in enumerate(labels):
+        labels[k] = ranks[label]
+    anchors.sort()
+    return array('d', (a[0] for a in anchors)), array('d', (a[1] for a in anchors)), labels, order
+
+def cluster_points(lat, lon, indexes, radius=None, cluster='greedy', min_samples=1, tie_key=None):
+    """Group the points (lat[i], lon[i]) for i in indexes with the given method. Returns (anchor_lat,
+    anchor_lon, labels, order): the anchors of the groups, and for each point in processing order its
+    group; order holds the positions in indexes of the processed points, or is None for input order."""
+    if cluster == 'dbscan':
+        return cluster_dbscan(lat, lon, indexes, radius, min_samples, tie_key)
+    return cluster_greedy(lat, lon, indexes, radius)
+
+def group_members(labels, count, order=None):
+    """Return (members, starts) for the labels of cluster_points: members holds the positions of the
+    points group by group, in processing order within a group, and group g is members[starts[g]:starts[g + 1]]."""
+    starts = array('q', [0]) * (count + 1)
+    for label in labels:
+        starts[label + 1] += 1
+    for g in range(count):
+        starts[g + 1] += starts[g]
+    fill = starts[:-1]
+    members = array('q', [0]) * len(labels)
+    for k, label in enumerate(labels):
+        members[fill[label]] = k if order is None else order[k]
+        fill[label] += 1
+    return members, starts
+
+def group_coordinates(located, radius=None, cluster='greedy', min_samples=1):
+    """Group (file_path, coords) pairs with the given method into (anchor coords, [file_path]) groups."""
+    lat = array('d', (coords[0] for _, coords in located))
+    lon = array('d', (coords[1] for _, coords in located))
+    anchor_lat, anchor_lon, labels, order = cluster_points(lat, lon, range(len(located)), radius, cluster,
+                                                           min_samples, lambda p: located[p][0])
+    members, starts = group_members(labels, len(anchor_lat), order)
+    return [((anchor_lat[g], anchor_lon[g]), [located[members[k]][0] for k in range(starts[g], starts[g + 1])])
+            for g in range(len(anchor_lat))]
+
+def group_coordinates_greedy(located, radius=None):
+    """Group (file_path, coords) pairs in input order like GreedyGroups."""
+    return group_coordinates(located, radius)
+
+def group_coordinates_dbscan(located, radius, min_samples=1):
+    """Cluster (file_path, coords) pairs with DBSCAN (see cluster_dbscan), ordering equal coordinates by path."""
+    return group_coordinates(located, radius, 'dbscan', min_samples)
 # ----------------------------------------------------------------
 
-# Main CLI function ----------------------------------------------
-def main():
-    parser = argparse.ArgumentParser(
-        description=(
-            "A command-line tool to process images using EXIF data.\n\n"
-            "Features:\n"
-            "  1. Rename images based on their EXIF date-time metadata.\n"
-            "  2. Group images into folders by their GPS coordinates from EXIF data.\n"
-            "  Operations are mutually exclusive: use either --rename or --group, not both."
-        ),
-        formatter_class=argparse.RawTextHelpFormatter,
-        epilog=(
-            "Example usage:\n"
-            "  Rename images based on EXIF DateTime:\n"
-            "    python exif_tool.py input_folder output_folder --rename\n\n"
-            "  Group images by GPS location:\n"
-            "    python exif_tool.py input_folder output_folder --group --radius 1000m\n"
-        )
-    )
-    
-    parser.add_argument(
-        'input_folder', 
-        type=str, 
-        help='Path to the input folder containing images.'
-    )
-    parser.add_argument(
-        'output_folder', 
-        type=str, 
-        help='Path to the output folder where processed images will be saved.'
-    )
-    parser.add_argument(
-        '-r', '--recursive', 
-        action='store_true', 
-        help='Process subfolders recursively.'
-    )
-    parser.add_argument(
-        '-n', '--rename', 
-        action='store_true', 
-        help='Rename images based on their EXIF DateTime information.'
-    )
-    parser.add_argument(
-        '-f', '--format', 
-        type=str, 
-        default="%Y-%m-%d_%H-%M-%S", 
-        help='Specify the date format for renaming (default: "%%Y-%%m-%%d_%%H-%%M-%%S").'
-    )
-    parser.add_argument(
-        '-g', '--group', 
-        action='store_true', 
-        help='Group images into folders based on GPS coordinates from EXIF data.'
-    )
-    parser.add_argument(
-        '--radius', 
-        type=str, 
-        help='Specify the radius (e.g., "1000m", "1km", "0.5mi") to group images by location.'
-    )
-    
-    args = parser.parse_args()
+# Time grouping --------------------------------------------------
+# Events are runs of images whose EXIF DateTimes are at most a gap apart. Sorting once and splitting
+# at the large gaps needs no pairwise comparisons, and covers the images without GPS.
+GROUP_BY_MODES = ['location', 'time', 'space-time']
+DEFAULT_EVENT_GAP = 2 * 3600
 
-    if not os.path.exists(args.input_folder):
-        print(f"Error: Input folder '{args.input_folder}' does not exist.")
-        return
-    
-    os.makedirs(args.output_folder, exist_ok=True)
+def group_timestamps(timed, gap=DEFAULT_EVENT_GAP):
+    """Split (item, timestamp) pairs into events: sorted by time, a new event starts wherever the time
+    since the previous item is more than gap seconds. Items with equal timestamps keep their input order.
+    Returns the (start timestamp, [item]) pairs in time order."""
+    events = []
+    previous = None
+    for item, timestamp in sorted(timed, key=lambda pair: pair[1]):
+        if previous is None or timestamp - previous > gap:
+            events.append((timestamp, []))
+        events[-1][1].append(item)
+        previous = timestamp
+    return events
+# ----------------------------------------------------------------
 
-    radius_in_meters = None
-    if args.radius:
+# Reverse geocoding ----------------------------------------------
+# Group folders can be named after the nearest place of a local gazetteer instead of their coordinates.
+# The place list is indexed once into a binary file next to it (PATH.idx): the places' earth-centered
+# coordinates sorted by SpatialGrid-style cell, the sorted cell keys with the start of each cell's places,
+# and the place names. Loading it is a few array reads, and a lookup searches the cells around a point.
+GAZETTEER_MAGIC = b'EXGZ'
+GAZETTEER_VERSION = 1
+GAZETTEER_HEADER = struct.Struct('<4sIqqIIId')
+GAZETTEER_CELL_SIZE = 25000.0
+GEOCODE_MAX_DISTANCE = 50000.0  # Groups farther than this from any place keep their coordinates as name
+
+def read_gazetteer_rows(path):
+    """Yield (label, lat, lon) for each place of a GeoNames dump (tab-separated, e.g. cities1000.txt) or
+    of a CSV file whose header has name, latitude/lat and longitude/lon/lng and optionally country columns.
+    Labels are "name_country" if the country is known."""
+    import csv
+    with open(path, encoding='utf-8', newline='') as f:
+        tab_separated = '\t' in f.readline()
+        f.seek(0)
+        if tab_separated:
+            rows = ((row[1], row[8], row[4], row[5]) for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+                    if len(row) > 8)
+        else:
+            reader = csv.DictReader(f)
+            columns = {column.strip().lower(): column for column in reader.fieldnames or ()}
+            name_column, lat_column, lon_column = (next((columns[c] for c in options if c in columns), None)
+                                                   for options in (('name',), ('latitude', 'lat'), ('longitude', 'lon', 'lng')))
+            if None in (name_column, lat_column, lon_column):
+                raise ValueError(f"{path} needs name, latitude and longitude columns")
+            country_column = next((columns[c] for c in ('country', 'country_code', 'cc') if c in columns), None)
+            rows = ((row[name_column], row[country_column] if country_column else '', row[lat_column], row[lon_column])
+                    for row in reader)
+        for place, country, lat, lon in rows:
+            try:
+                lat, lon = float(lat), float(lon)
+            except (TypeError, ValueError):
+                continue
+            yield (f"{place}_{country}" if country else place), lat, lon
+
+class Gazetteer:
+    """Nearest-place index over a local place list, see Gazetteer.load."""
+
+    def __init__(self, xs, ys, zs, labels, cell_keys, cell_starts, cell_size):
+        self.xs, self.ys, self.zs = xs, ys, zs
+        self.labels = labels
+        self.cell_keys = cell_keys
+        self.cell_starts = cell_starts
+        self.cell_size = cell_size
+        self.path = None
+        self._offset = math.ceil(EARTH_RADIUS / cell_size) + 2
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def cell_key(self, cx, cy, cz):
+        span = 2 * self._offset + 1
+        return ((cx + self._offset) * span + (cy + self._offset)) * span + (cz + self._offset)
+
+    @classmethod
+    def build(cls, rows, cell_size=GAZETTEER_CELL_SIZE):
+        """Index (label, lat, lon) rows."""
+        empty = cls(array('d'), array('d'), array('d'), [], array('q'), array('I', [0]), cell_size)
+        entries = []
+        for label, lat, lon in rows:
+            point = to_cartesian((lat, lon))
+            entries.append((empty.cell_key(*(math.floor(v / cell_size) for v in point)), point, label))
+        entries.sort(key=lambda entry: entry[0])
+        xs, ys, zs = array('d'), array('d'), array('d')
+        cell_keys, cell_starts = array('q'), array('I')
+        for i, (key, (x, y, z), _) in enumerate(entries):
+            if not cell_keys or cell_keys[-1] != key:
+                cell_keys.append(key)
+                cell_starts.append(i)
+            xs.append(x)
+            ys.append(y)
+            zs.append(z)
+        cell_starts.append(len(entries))
+        return cls(xs, ys, zs, [label for _, _, label in entries], cell_keys, cell_starts, cell_size)
+
+    @classmethod
+    def load(cls, path, cell_size=GAZETTEER_CELL_SIZE):
+        """Return the Gazetteer of the place list at path, read from its index file if that is up to date,
+        otherwise built from the place list and saved to the index file for the next time."""
+        st = os.stat(path)
+        index_path = path + '.idx'
         try:
-            radius_in_meters = parse_radius(args.radius)
-        except ValueError as e:
-            print(e)
-            return
+            gazetteer = cls.read_index(index_path, st)
+        except (OSError, ValueError):
+            gazetteer = None
+        if gazetteer is None:
+            gazetteer = cls.build(read_gazetteer_rows(path), cell_size)
+            try:
+                gazetteer.write_index(index_path, st)
+            except OSError as e:
+                reporter.message(f"Could not save the place index {index_path}: {e}")
+        gazetteer.path = os.path.abspath(path)
+        return gazetteer
 
-    if args.rename:
-        print("Renaming images by EXIF date-time...")
-        rename_images_by_datetime(args.input_folder, args.output_folder, args.format, args.recursive)
-    
-    elif args.group:
-        print("Grouping images by location...")
-        group_images_by_location(args.input_folder, args.output_folder, args.recursive, radius_in_meters)
-    
-    else:
-        print("No operation specified. Use --rename or --group.")
+    def write_index(self, index_path, st):
+        names = [label.encode('utf-8') for label in self.labels]
+        offsets = array('I', [0])
+        for name in names:
+            offsets.append(offsets[-1] + len(name))
+        arrays = [self.xs, self.ys, self.zs, offsets, self.cell_keys, self.cell_starts]
+        if sys.byteorder == 'big':
+            arrays = [array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        temporary_path = index_path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(GAZETTEER_HEADER.pack(GAZETTEER_MAGIC, GAZETTEER_VERSION, st.st_size, st.st_mtime_ns,
+                                          len(self.labels), len(self.cell_keys), offsets[-1], self.cell_size))
+            for a in arrays:
+                f.write(a.tobytes())
+            f.write(b''.join(names))
+        os.replace(temporary_path, index_path)
+
+    @classmethod
+    def read_index(cls, index_path, st):
+        """Return the Gazetteer saved in index_path, or None if it was built from another version of the place list."""
+        with open(index_path, 'rb') as f:
+            magic, version, size, mtime_ns, count, cells, names_size, cell_size = GAZETTEER_HEADER.unpack(
+                f.read(GAZETTEER_HEADER.size))
+            if magic != GAZETTEER_MAGIC or version != GAZETTEER_VERSION or (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+                return None
+            arrays = []
+            for typecode, length in (('d', count), ('d', count), ('d', count), ('I', count + 1), ('q', cells), ('I', cells + 1)):
+                a = array(typecode)
+                a.fromfile(f, length)
+                if sys.byteorder == 'big':
+                    a.byteswap()
+                arrays.append(a)
+            names = f.read(names_size)
+        if len(names) != names_size:
+            raise ValueError(f"Truncated place index {index_path}")
+        xs, ys, zs, offsets, cell_keys, cell_starts = arrays
+        labels = [names[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+        return cls(xs, ys, zs, labels, cell_keys, cell_starts, cell_size)
+
+    def _cell_range(self, key):
+        from bisect import bisect_left
+        i = bisect_left(self.cell_keys, key)
+        if i < len(self.cell_keys) and self.cell_keys[i] == key:
+            return self.cell_starts[i], self.cell_starts[i + 1]
+        return 0, 0
+
+    def nearest(self, coord, max_distance=GEOCODE_MAX_DISTANCE):
+        """Return the label of the place nearest to a (lat, lon) coordinate, or None if there is none
+        within max_distance meters. Results are memoized per coordinate."""
+        key = (coord, max_distance)
+        if key not in self._memo:
+            self._memo[key] = self._nearest(coord, max_distance)
+        return self._memo[key]
+
+    def _nearest(self, coord, max_distance):
+        x, y, z = to_cartesian(coord)
+        cx, cy, cz = (math.floor(v / self.cell_size) for v in (x, y, z))
+        # The straight-line distance is never longer than the great-circle one, and every point outside the
+        # cube of cells within k of the point's cell is more than k cells away in a straight line
+        max_chord = 2 * EARTH_RADIUS * math.sin(min(max_distance / (2 * EARTH_RADIUS), math.pi / 2))
+        best, best_chord = None, math.inf
+        xs, ys, zs = self.xs, self.ys, self.zs
+        for k in range(math.ceil(max_chord / self.cell_size) + 1):
+            for dx in range(-k, k + 1):
+                for dy in range(-k, k + 1):
+                    on_edge = k in (abs(dx), abs(dy))
+                    for dz in (range(-k, k + 1) if on_edge else (-k, k)):
+                        start, end = self._cell_range(self.cell_key(cx + dx, cy + dy, cz + dz))
+                        for i in range(start, end):
+                            chord = math.sqrt((xs[i] - x)**2 + (ys[i] - y)**2 + (zs[i] - z)**2)
+                            if chord < best_chord:
+                                best, best_chord = i, chord
+            if best_chord <= k * self.cell_size:
+                break
+        if best is None or best_chord > max_chord:
+            return None
+        return self.labels[best]
+
+def safe_folder_name(name):
+    """Replace the characters that are not allowed in folder names on common filesystems."""
+    cleaned = ''.join('_' if c in '<>:"/\\|?*' or ord(c) < 32 else c for c in name).strip(' .')
+    return cleaned or '_'
+
+class GroupNamer:
+    """Names group folders by the nearest place of a Gazetteer, or by their anchor coordinates without one
+    or where no place is near. Place and event names are made unique within each parent folder with
+    _2, _3, ... and the same (folder, anchor) always gets the same name."""
+
+    def __init__(self, gazetteer=None):
+        self.gazetteer = gazetteer
+        self._names = {}
+        self._used = {}
+
+    def unique(self, folder, name):
+        """Return name, or the first of name_2, name_3, ... not yet used in folder, and mark it as used."""
+        base = name = safe_folder_name(name)
+        used = self._used.setdefault(folder, set())
+        n = 2
+        while name in used:
+            name = f"{base}_{n}"
+            n += 1
+        used.add(name)
+        return name
+
+    def name(self, folder, coords):
+        key = (folder, coords)
+        if key not in self._names:
+            self._names[key] = self.new_name(folder, coords)
+        return self._names[key]
+
+    def new_name(self, folder, coords):
+        """Name an anchor without remembering it, for callers that name every anchor only once."""
+        place = self.gazetteer.nearest(coords) if self.gazetteer is not None else None
+        if place is None:
+            return f"{coords[0]:.6f}_{coords[1]:.6f}"
+        return self.unique(folder, place)
+# ----------------------------------------------------------------
+
+# Global grouping ------------------------------------------------
+# Groups the images of the whole tree at once with memory bounded by a chunk of GLOBAL_SPILL_CHUNK
+# records instead of the tree. Located images are spilled in chunks to bucket files by tile (a cube of
+# GLOBAL_TILE_CELLS grid cells per side), and copied as ghosts into the buckets of other tiles they are
+# within one cell of, so every pair within the radius meets in the bucket of at least one of them. Each
+# bucket is then clustered on its own, a chunk at a time (single linkage, like DBSCAN with min_samples=1),
+# and components reaching into other buckets or chunks are joined in a union-find over the images near
+# their borders only. A dense area can fill a bucket far beyond a chunk, so chunks of the same bucket
+# are compared by streaming the rest of the bucket past each of them. The union-find and the table of
+# groups are kept in an SQLite database next to the bucket files. The groups only depend on the set of
+# images, not on the order in which they were found.
+GLOBAL_BUCKETS = 256
+GLOBAL_TILE_CELLS = 8
+GLOBAL_SPILL_CHUNK = 65536  # Records buffered before they are appended to the bucket files, or clustered at once
+GLOBAL_RECORD = struct.Struct('<qddI')  # Image id, lat, lon and length of the relative path (0 for ghosts)
+
+class SQLiteMap:
+    """The get/[]/[]= subset of a dict of integers, stored in an SQLite table so that it can outgrow memory."""
+
+    def __init__(self, conn, table):
+        conn.execute(f"CREATE TABLE {table} (key INTEGER PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn = conn
+        self._select = f"SELECT value FROM {table} WHERE key = ?"
+        self._insert = f"INSERT OR REPLACE INTO {table} VALUES (?, ?)"
+
+    def get(self, key, default=None):
+        row = self._conn.execute(self._select, (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._conn.execute(self._insert, (key, value))
+
+class UnionFind:
+    """Disjoint sets over integer keys, kept in a dict (or an SQLiteMap) so that only keys that were joined
+    take memory. Each set is represented by its smallest key."""
+
+    def __init__(self, parent=None):
+        self.parent = {} if parent is None else parent
+
+    def find(self, key):
+        parent = self.parent
+        root = key
+        while True:
+            up = parent.get(root, root)
+            if up == root:
+                break
+            root = up
+        while key != root:
+            parent[key], key = root, parent[key]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            a, b = min(a, b), max(a, b)
+            self.parent[b] = a
+        return a
+
+class GlobalGrouper:
+    """Out-of-core grouping of located images across folders, see the section comment. Images are added
+    with add(), then placements() names the groups and yields each image's group folder."""
+
+    def __init__(self, radius, spill_dir=None):
+        import sqlite3
+        import tempfile
+        self.grid = SpatialGrid(radius)
+        self._directory = tempfile.TemporaryDirectory(prefix='exif_tool_groups_', dir=spill_dir)
+        self._db = sqlite3.connect(os.path.join(self._directory.name, 'groups.sqlite'))
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._chunks = {}
+        self._buffered = 0
+        self._count = 0
+        self._sizes = [0] * GLOBAL_BUCKETS
+        self._boundary = UnionFind(SQLiteMap(self._db, 'boundary'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._db.close()
+        self._directory.cleanup()
+
+    def _path(self, bucket, kind='records'):
+        return os.path.join(self._directory.name, f"{bucket}.{kind}")
+
+    def _buckets(self, coords):
+        """Return the bucket of a coordinate's tile and the set of other buckets it is a ghost in."""
+        cells = self.grid.cell(coords)
+        home = hash(tuple(c // GLOBAL_TILE_CELLS for c in cells)) % GLOBAL_BUCKETS
+        axes = [{(c + d) // GLOBAL_TILE_CELLS for d in (-1, 0, 1)} for c in cells]
+        ghosts = {hash((tx, ty, tz)) % GLOBAL_BUCKETS for tx in axes[0] for ty in axes[1] for tz in axes[2]}
+        ghosts.discard(home)
+        return home, ghosts
+
+    def add(self, relative_path, coords):
+        home, ghosts = self._buckets(coords)
+        name = relative_path.encode('utf-8', 'surrogateescape')
+        self._chunks.setdefault(home, []).append(GLOBAL_RECORD.pack(self._count, coords[0], coords[1], len(name)) + name)
+        ghost = GLOBAL_RECORD.pack(self._count, coords[0], coords[1], 0)
+        for bucket in ghosts:
+            self._chunks.setdefault(bucket, []).append(ghost)
+        self._sizes[home] += 1
+        for bucket in ghosts:
+            self._sizes[bucket] += 1
+        self._count += 1
+        self._buffered += 1 + len(ghosts)
+        if self._buffered >= GLOBAL_SPILL_CHUNK:
+            self._spill()
+
+    def _spill(self):
+        for bucket, chunk in self._chunks.items():
+            with open(self._path(bucket), 'ab') as f:
+                f.write(b''.join(chunk))
+        self._chunks = {}
+        self._buffered = 0
+
+    @staticmethod
+    def _records(f):
+        """Yield the (image id, coords, relative path or None for ghosts) records from f's position on."""
+        while True:
+            header = f.read(GLOBAL_RECORD.size)
+            if not header:
+                return
+            image_id, lat, lon, length = GLOBAL_RECORD.unpack(header)
+            name = f.read(length).decode('utf-8', 'surrogateescape') if length else None
+            yield image_id, (lat, lon), name
+
+    def _read(self, bucket, offset=0):
+        """Yield the records of a bucket, starting at a byte offset."""
+        with open(self._path(bucket), 'rb') as f:
+            f.seek(offset)
+            yield from self._records(f)
+
+    def _read_chunks(self, bucket):
+        """Yield the records of a bucket in lists of at most GLOBAL_SPILL_CHUNK, each with the byte offset
+        of the records after it."""
+        import itertools
+        with open(self._path(bucket), 'rb') as f:
+            while True:
+                records = list(itertools.islice(self._records(f), GLOBAL_SPILL_CHUNK))
+                if not records:
+                    return
+                yield records, f.tell()
+
+    def _cluster(self, bucket):
+        """Cluster one bucket a chunk at a time, save the local component id of each of its own images and
+        join the components that continue in other buckets or chunks."""
+        # The images of a bucket that takes several chunks are all linked in the boundary union-find, so
+        # that pairs across chunks can be joined by their image ids
+        split = self._sizes[bucket] > GLOBAL_SPILL_CHUNK
+        with open(self._path(bucket, 'labels'), 'wb') as labels_file:
+            for records, offset in self._read_chunks(bucket):
+                grid = SpatialGrid(self.grid.radius)
+                for _, coords, _ in records:
+                    grid.add(coords)
+                parent = list(range(len(records)))
+
+                def find(i):
+                    while parent[i] != i:
+                        parent[i] = parent[parent[i]]
+                        i = parent[i]
+                    return i
+
+                # Pairs of two ghosts are found in the bucket of either of them
+                for i, (_, coords, name) in enumerate(records):
+                    if name is not None:
+                        for j in grid.neighbours(coords):
+                            a, b = find(i), find(j)
+                            if a != b:
+                                parent[max(a, b)] = min(a, b)
+
+                # A component is represented by its smallest image id; the ids of its ghosts and of its
+                # images that are ghosts elsewhere link it to the components of the other buckets
+                representative = {}
+                for i, (image_id, _, name) in enumerate(records):
+                    if name is not None:
+                        root = find(i)
+                        representative[root] = min(representative.get(root, image_id), image_id)
+                labels = array('q')
+                for i, (image_id, coords, name) in enumerate(records):
+                    root = find(i)
+                    if root not in representative:
+                        continue
+                    if name is None or split or self._buckets(coords)[1]:
+                        self._boundary.union(representative[root], image_id)
+                    if name is not None:
+                        labels.append(representative[root])
+                labels.tofile(labels_file)
+
+                if split:
+                    for image_id, coords, name in self._read(bucket, offset):
+                        for j in grid.neighbours(coords):
+                            if name is not None or records[j][2] is not None:
+                                self._boundary.union(records[j][0], image_id)
+
+    def _labels(self, bucket):
+        """Yield the local component ids saved by _cluster() for the images of a bucket."""
+        with open(self._path(bucket, 'labels'), 'rb') as f:
+            while True:
+                labels = array('q')
+                labels.frombytes(f.read(GLOBAL_SPILL_CHUNK * labels.itemsize))
+                if not labels:
+                    return
+                yield from labels
+
+    def _images(self, bucket):
+        """Yield (relative path, coords, group id) for the images of a bucket after clustering."""
+        own = (record for record in self._read(bucket) if record[2] is not None)
+        groups = {}
+        for (_, coords, name), label in zip(own, self._labels(bucket)):
+            group_id = groups.get(label)
+            if group_id is None:
+                if len(groups) >= GLOBAL_SPILL_CHUNK:
+                    groups.clear()
+                group_id = groups[label] = self._boundary.find(label)
+            yield name, coords, group_id
+
+    def placements(self, namer=None):
+        """Yield (relative path, group folder name) for every added image. Groups are named by namer
+        (a GroupNamer) after their centroid, in the order of their centroids and smallest paths."""
+        self._spill()
+        buckets = [bucket for bucket in range(GLOBAL_BUCKETS) if os.path.exists(self._path(bucket))]
+        for bucket in buckets:
+            self._cluster(bucket)
+
+        # Centroids are summed in whole millimeters, which is exact and so independent of the order. The
+        # sums of up to a chunk of groups are kept in memory and added to the table of groups when full.
+        db = self._db
+        db.execute("CREATE TABLE groups (id INTEGER PRIMARY KEY, x INTEGER, y INTEGER, z INTEGER, first BLOB)")
+        sums = {}
+
+        def flush():
+            db.executemany("INSERT INTO groups VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET"
+                           " x = x + excluded.x, y = y + excluded.y, z = z + excluded.z,"
+                           " first = min(first, excluded.first)",
+                           ((group_id, *group) for group_id, group in sums.items()))
+            sums.clear()
+
+        for bucket in buckets:
+            for name, coords, group_id in self._images(bucket):
+                group = sums.get(group_id)
+                if group is None:
+                    if len(sums) >= GLOBAL_SPILL_CHUNK:
+                        flush()
+                    group = sums[group_id] = [0, 0, 0, name.encode('utf-8', 'surrogateescape')]
+                for axis, value in enumerate(to_cartesian(coords)):
+                    group[axis] += round(value * 1000)
+                group[3] = min(group[3], name.encode('utf-8', 'surrogateescape'))
+        flush()
+
+        namer = GroupNamer() if namer is None else namer
+        prefix = "all_images_" if db.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 1 else ""
+        db.create_function('latitude', 3, lambda x, y, z: math.degrees(math.atan2(z, math.hypot(x, y))), deterministic=True)
+        db.create_function('longitude', 2, lambda x, y: math.degrees(math.atan2(y, x)), deterministic=True)
+        anchors = db.execute("SELECT id, latitude(x, y, z) AS lat, longitude(x, y) AS lon FROM groups"
+                             " ORDER BY lat, lon, first")
+
+        def folder_names():
+            # Groups with the same anchor are next to each other and share a folder
+            anchor = folder = None
+            for group_id, lat, lon in anchors:
+                if (lat, lon) != anchor:
+                    anchor = (lat, lon)
+                    folder = prefix + namer.new_name(None, anchor)
+                yield group_id, folder
+
+        db.execute("CREATE TABLE folders (id INTEGER PRIMARY KEY, folder TEXT NOT NULL)")
+        db.executemany("INSERT INTO folders VALUES (?, ?)", folder_names())
+
+        for bucket in buckets:
+            for name, _, group_id in self._images(bucket):
+                yield name, db.execute("SELECT folder FROM folders WHERE id = ?", (group_id,)).fetchone()[0]
+# ----------------------------------------------------------------
+
+# File placement -------------------------------------------------
+PLACEMENT_MODES = ['copy', 'hardlink', 'reflink', 'symlink', 'move']
+FICLONE = 0x40049409  # Linux ioctl that clones a file's extents on copy-on-write filesystems
+
+def reflink_file(src, dst):
+    """Clone src to dst sharing its data blocks. Raises OSError where cloning is not supported."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+    import shutil
+    shutil.copymode(src, dst)
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+def kernel_copy(src_fd, dst_fd, size):
+    """Copy size bytes between file descriptors inside the kernel, using copy_file_range (which can
+    also copy server-side on NFS 4.2 and clone on CoW filesystems) or sendfile. Returns the bytes copied,
+    which is less than size if neither is available."""
+    copied = 0
+    for func in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+        if func is None:
+            continue
+        try:
+            if func is os.sendfile:
+                # sendfile writes at the destination's file position, which copy_file_range did not move
+                os.lseek(dst_fd, copied, os.SEEK_SET)
+            while copied < size:
+                if func is os.sendfile:
+                    n = func(dst_fd, src_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+                else:
+                    n = func(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - copied), copied, copied)
+                if n == 0:
+                    break
+                copied += n
+            return copied
+        except OSError:
+            # Not supported between these files (e.g. across filesystems on older kernels): try the next
+            # method from where this one stopped
+            continue
+    return copied
+
+def is_same_file(a, b):
+    """Whether two paths name the same file: the same path, or links to the same data."""
+    if os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b)):
+        return True
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+def copy_file(src, dst):
+    """Copy a file's data and permission bits, using kernel-side copying where available.
+    A symbolic link or hard link at dst is replaced rather than written through, so copying over an
+    earlier symlink or hardlink placement never truncates the source. Returns the number of bytes copied."""
+    import shutil
+    if os.path.lexists(dst):
+        if os.path.normcase(os.path.abspath(src)) == os.path.normcase(os.path.abspath(dst)):
+            raise shutil.SameFileError(f"{src} and {dst} are the same file")
+        if os.path.islink(dst) or os.path.samefile(src, dst):
+            os.remove(dst)
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        size = os.fstat(src_file.fileno()).st_size
+        copied = kernel_copy(src_file.fileno(), dst_file.fileno(), size)
+        if copied < size:
+            src_file.seek(copied)
+            dst_file.seek(copied)
+            shutil.copyfileobj(src_file, dst_file, COPY_CHUNK_SIZE)
+            copied = dst_file.tell()
+    shutil.copymode(src, dst)
+    return copied
+
+def place_file(src, dst, mode='copy'):
+    """Place src at dst (a file path or an existing directory) using the given mode.
+
+    hardlink, reflink and symlink fall back to a copy when the filesystem cannot create them, for example
+    across devices. Returns the path written, the mode that was actually used and the bytes copied.
+    A dst that holds src's own data is never removed: src placed onto itself is left in place, as is a
+    hard link of src for hardlink (move just drops the name src), and src being a symlink to dst is
+    an error, like copying a file onto itself (see copy_file)."""
+    import shutil
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if mode != 'copy' and os.path.lexists(dst) and not os.path.islink(dst) and is_same_file(src, dst):
+        if os.path.normcase(os.path.abspath(src)) == os.path.normcase(os.path.abspath(dst)):
+            return dst, mode, 0
+        if os.path.islink(src):
+            raise shutil.SameFileError(f"{src} is a link to {dst}")
+        if mode == 'move':
+            # Renaming a file onto another of its hard links leaves both names
+            os.remove(src)
+            return dst, mode, 0
+        if mode == 'hardlink':
+            return dst, mode, 0
+    if mode == 'move':
+        shutil.move(src, dst, copy_function=copy_file)
+        return dst, mode, 0
+    if mode != 'copy':
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            if mode == 'hardlink':
+                os.link(src, dst)
+            elif mode == 'reflink':
+                reflink_file(src, dst)
+            elif mode == 'symlink':
+                os.symlink(os.path.abspath(src), dst)
+            else:
+                raise ValueError(f"Unsupported placement mode: {mode}")
+            return dst, mode, 0
+        except OSError:
+            pass
+    return dst, 'copy', copy_file(src, dst)
+
+def fsync_path(path, directory=False):
+    """Flush a file or directory entry to stable storage."""
+    fd = os.open(path, os.O_RDONLY | (getattr(os, 'O_DIRECTORY', 0) if directory else 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class PlacementEngine:
+    """Places files into the output tree with a bounded number of placements in flight.
+
+    Placements to the same destination run in submission order, so the result matches a serial run.
+    A destination that is the source of another placement of the run is refused, unless that source
+    was moved away already. With fsync enabled, written files and their directories are flushed in batches per directory
+    rather than after every file."""
+
+    FSYNC_BATCH = 1000
+
+    def __init__(self, mode='copy', workers=1, fsync=False):
+        self.mode = mode
+        self.fsync = fsync
+        self.files_placed = 0
+        self.bytes_copied = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self._executor = new_thread_pool(workers) if workers > 1 else None
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._pending_sync = {}
+        self._created_dirs = set()
+        self._sources = set()
+        self._start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, src, dst, on_done=None, mode=None):
+        """Queue src to be placed at dst (a file path or an existing directory), creating the destination
+        folder if needed. on_done is called without arguments once the placement has succeeded. mode
+        overrides the engine's placement mode for this file, and a source that is the destination of an
+        earlier placement is only placed once that one has finished."""
+        target = os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst
+        with self._lock:
+            self._sources.add(os.path.normcase(os.path.abspath(src)))
+        destination_dir = os.path.dirname(target)
+        if destination_dir not in self._created_dirs:
+            os.makedirs(destination_dir, exist_ok=True)
+            self._created_dirs.add(destination_dir)
+        if self._executor is None:
+            self._place(src, dst, on_done, mode)
+            return
+        for previous in (self._in_flight.get(target), self._in_flight.get(src)):
+            if previous is not None:
+                previous.result()
+        self._slots.acquire()
+        future = self._executor.submit(self._place, src, dst, on_done, mode)
+        self._in_flight[target] = future
+        future.add_done_callback(lambda f, target=target: self._done(target, f))
+
+    def _done(self, target, future):
+        with self._lock:
+            if self._in_flight.get(target) is future:
+                del self._in_flight[target]
+        self._slots.release()
+
+    def _place(self, src, dst, on_done=None, mode=None):
+        start = time.perf_counter()
+        source = os.path.normcase(os.path.abspath(src))
+        target = os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst
+        try:
+            target = os.path.normcase(os.path.abspath(target))
+            with self._lock:
+                replaces_source = target != source and target in self._sources
+            if replaces_source:
+                raise OSError(f"{dst} is the source of another placement and would be lost")
+            written, used_mode, copied = place_file(src, dst, mode or self.mode)
+        except Exception as e:
+            reporter.error(f"Error placing {src} at {dst}: {e}")
+            with self._lock:
+                self.errors += 1
+                self.busy_seconds += time.perf_counter() - start
+            return
+        with self._lock:
+            if used_mode == 'move':
+                self._sources.discard(source)
+            self.busy_seconds += time.perf_counter() - start
+            self.files_placed += 1
+            self.bytes_copied += copied
+            if self.fsync:
+                self._pending_sync.setdefault(os.path.dirname(written), []).append(written)
+                flush = sum(map(len, self._pending_sync.values())) >= self.FSYNC_BATCH
+            else:
+                flush = False
+        if flush:
+            self.flush()
+        if on_done:
+            on_done()
+
+    def flush(self):
+        """fsync the files written since the last flush, then each of their directories once."""
+        with self._lock:
+            pending, self._pending_sync = self._pending_sync, {}
+        for directory, written in pending.items():
+            for path in written:
+                if not os.path.islink(path):
+                    fsync_path(path)
+            fsync_path(directory, directory=True)
+
+    def close(self):
+        """Wait for all placements to finish and flush them if fsync is enabled."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self.fsync:
+            self.flush()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._start
+        rate = self.bytes_copied / elapsed if elapsed > 0 else 0.0
+        return (f"Placed {self.files_placed} files, copied {self.bytes_copied} bytes in {elapsed:.2f}s "
+                f"({rate:,.0f} bytes/s), {self.errors} errors")
+# ----------------------------------------------------------------
+
+# Deduplication --------------------------------------------------
+DEDUPE_ACTIONS = ['skip', 'link']
+PARTIAL_HASH_SIZE = 64 * 1024
+
+def hash_file(file_path, size, partial=False):
+    """Return the BLAKE2b hex digest of a file's content, or with partial=True of only its first and
+    last PARTIAL_HASH_SIZE bytes (the whole file if it is not larger than both)."""
+    import hashlib
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        if partial and size > 2 * PARTIAL_HASH_SIZE:
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+            f.seek(size - PARTIAL_HASH_SIZE)
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+        else:
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+class Deduplicator:
+    """Dedupe stage between planning and execution that finds placements of identical files.
+
+    Files are compared by size first, then by a hash of their first and last bytes, and only then by a
+    hash of their full content, so most files are never read. Hashes are computed in parallel on the
+    executor and kept in the cache, if one is given, for later runs. The first placement of each content
+    is kept; later ones are skipped, or with action 'link' become hard links to the first one's
+    destination. This stage waits for the whole plan before passing it on."""
+
+    def __init__(self, action='skip', executor=None, cache=None):
+        self.action = action
+        self.executor = executor
+        self.cache = cache
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.files_hashed = 0
+        self.hashes_reused = 0
+        self._lock = threading.Lock()
+
+    def _map(self, func, items):
+        return list(self.executor.map(func, items) if self.executor else map(func, items))
+
+    def _stat(self, file_path):
+        try:
+            return os.stat(file_path)
+        except OSError:
+            return None
+
+    def _hash(self, file_path, st, kind, group_key=None):
+        # A file small enough to be read whole for its partial hash needs no second read
+        if kind == 'full' and st.st_size <= 2 * PARTIAL_HASH_SIZE:
+            return group_key[1]
+        if self.cache:
+            cached = self.cache.get_hash(file_path, st, kind)
+            if cached is not None:
+                with self._lock:
+                    self.hashes_reused += 1
+                return cached
+        try:
+            value = hash_file(file_path, st.st_size, partial=(kind == 'partial'))
+        except OSError as e:
+            reporter.error(f"Error hashing {file_path}: {e}")
+            return None
+        with self._lock:
+            self.files_hashed += 1
+        if self.cache:
+            self.cache.put_hash(file_path, st, kind, value)
+        return value
+
+    def _refine(self, groups, actions, stats, kind):
+        """Split each group of action indices by the given hash kind, keeping groups of two or more.
+        Group keys are the file size, then (size, partial hash)."""
+        candidates = [(key, i) for key, group in groups.items() for i in group]
+        hashes = self._map(lambda candidate: self._hash(actions[candidate[1]][0], stats[candidate[1]], kind, candidate[0]),
+                           candidates)
+        refined = {}
+        for (key, i), value in zip(candidates, hashes):
+            if value is not None:
+                refined.setdefault((key, value), []).append(i)
+        return {key: group for key, group in refined.items() if len(group) > 1}
+
+    def filter(self, actions):
+        """Yield the (src, dst) placements to execute, and (dst_of_first, dst, 'hardlink') for duplicates
+        with action 'link'."""
+        actions = list(actions)
+        stats = self._map(self._stat, [src for src, _ in actions])
+        by_size = {}
+        for i, st in enumerate(stats):
+            if st is not None:
+                by_size.setdefault(st.st_size, []).append(i)
+        groups = {size: group for size, group in by_size.items() if len(group) > 1}
+        groups = self._refine(groups, actions, stats, 'partial')
+        groups = self._refine(groups, actions, stats, 'full')
+
+        first_of = {}
+        for group in groups.values():
+            for i in group[1:]:
+                first_of[i] = group[0]
+        for i, (src, dst) in enumerate(actions):
+            first = first_of.get(i)
+            if first is None:
+                yield src, dst
+                continue
+            self.duplicates += 1
+            self.bytes_saved += stats[i].st_size
+            if self.action == 'link':
+                yield actions[first][1], dst, 'hardlink'
+
+    def summary(self):
+        verb = "Linked" if self.action == 'link' else "Skipped"
+        return (f"{verb} {self.duplicates} duplicate files, saving {self.bytes_saved} bytes "
+                f"({self.files_hashed} files hashed, {self.hashes_reused} hashes reused)")
+# ----------------------------------------------------------------
+
+# Filesystem helper functions ------------------------------------
+def is_valid_image(file):
+    """Check if the file has a supported image extension."""
+    dot = file.rfind('.')
+    return dot > 0 and file[dot:].lower() in SUPPORTED_EXTENSION_SET
+
+def preserve_folder_structure(input_folder, output_folder, root, file, create_dirs=True):
+    """Generate the corresponding path in the output folder, preserving the directory structure."""
+    relative_path = os.path.relpath(root, input_folder)  # Get the relative path from the input folder
+    destination_dir = os.path.join(output_folder, relative_path)
+    if create_dirs:
+        os.makedirs(destination_dir, exist_ok=True)  # Create the directories if they don't exist
+    return os.path.join(destination_dir, file)
+# ----------------------------------------------------------------
+
+# Image catalog --------------------------------------------------
+EPOCH = datetime(1970, 1, 1)
+NO_TIMESTAMP = -2**63  # Timestamp column value of images without a (valid) EXIF DateTime
+
+class ImageCatalog:
+    """Compact columnar store of image metadata.
+
+    Each field is a typed array (timestamps as seconds since 1970 of the naive EXIF time, NaN coordinates
+    for images without GPS) and paths are stored as a folder id plus the file name in one shared byte
+    buffer, so an image costs tens of bytes instead of the several hundred of a tuple of Python objects.
+    The plan stages group images by their index in the catalog, reading the lat and lon columns, and
+    only build an image's path when placing it."""
+
+    def __init__(self):
+        self.folders = []
+        self._folder_ids = {}
+        self.folder = array('I')
+        self.timestamp = array('q')
+        self.lat = array('d')
+        self.lon = array('d')
+        self._names = bytearray()
+        self._name_ends = array('Q')
+
+    def __len__(self):
+        return len(self.folder)
+
+    def append(self, file_path, exif_datetime, gps_coordinates):
+        """Add an image from the extract stage; the DateTime string is parsed on the way in."""
+        folder, name = os.path.split(file_path)
+        folder_id = self._folder_ids.get(folder)
+        if folder_id is None:
+            folder_id = self._folder_ids[folder] = len(self.folders)
+            self.folders.append(folder)
+        parsed = parse_exif_datetime(exif_datetime)
+        self.folder.append(folder_id)
+        self.timestamp.append(int((parsed - EPOCH).total_seconds()) if parsed else NO_TIMESTAMP)
+        lat, lon = gps_coordinates if gps_coordinates else (math.nan, math.nan)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self._names += name.encode('utf-8', 'surrogateescape')
+        self._name_ends.append(len(self._names))
+
+    def name(self, i):
+        start = self._name_ends[i - 1] if i else 0
+        return self._names[start:self._name_ends[i]].decode('utf-8', 'surrogateescape')
+
+    def path(self, i):
+        return os.path.join(self.folders[self.folder[i]], self.name(i))
+
+    def datetime(self, i):
+        """Return the EXIF DateTime of an image as a datetime, or None."""
+        ts = self.timestamp[i]
+        return EPOCH + timedelta(seconds=ts) if ts != NO_TIMESTAMP else None
+
+    def coordinates(self, i):
+        """Return the (lat, lon) of an image, or None if it has no GPS position."""
+        lat = self.lat[i]
+        return None if lat != lat else (lat, self.lon[i])
+
+    def located(self):
+        """Return an array of the indexes of the images with a GPS position."""
+        return array('q', (i for i, lat in enumerate(self.lat) if lat == lat))
+
+    def dated(self):
+        """Return an array of the indexes of the images with an EXIF DateTime."""
+        return array('q', (i for i, ts in enumerate(self.timestamp) if ts != NO_TIMESTAMP))
+
+def catalog_by_folder(extracted, max_rows=None):
+    """Fill an ImageCatalog from the extract stage, yielding (folder, catalog) per folder of consecutive
+    images, or per max_rows images if a folder is larger than that."""
+    current_root, catalog = None, ImageCatalog()
+    for file_path, exif_datetime, gps_coordinates, _, _ in extracted:
+        root = os.path.dirname(file_path)
+        if len(catalog) and (root != current_root or (max_rows and len(catalog) >= max_rows)):
+            yield current_root, catalog
+            catalog = ImageCatalog()
+        current_root = root
+        catalog.append(file_path, exif_datetime, gps_coordinates)
+    if len(catalog):
+        yield current_root, catalog
+# ----------------------------------------------------------------
+
+# Pipeline -------------------------------------------------------
+# Operations run as a chain of generator stages: scan -> extract -> plan -> execute. Scanning and
+# extraction run ahead on a background thread through a bounded queue, so output I/O overlaps with
+# reading EXIF data while memory stays bounded by the queue sizes.
+_END_OF_STAGE = object()
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+def prefetch(iterable, maxsize=PIPELINE_QUEUE_SIZE):
+    """Run an iterable on a background thread and yield its items through a bounded queue."""
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_END_OF_STAGE)
+        except BaseException as e:
+            put(_StageError(e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END_OF_STAGE:
+                break
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+def until_cancelled(iterable, cancel=None):
+    """Yield items of iterable until the cancel event is set."""
+    for item in iterable:
+        if cancel is not None and cancel.is_set():
+            return
+        yield item
+
+def list_directory(path):
+    """List a folder with os.scandir, returning its (files, subfolders) as os.DirEntry lists."""
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                (dirs if is_dir else files).append(entry)
+    except OSError as e:
+        reporter.error(f"Error scanning {path}: {e}")
+    return files, dirs
+
+def matches_globs(entry, relative_path, patterns):
+    """Check if a file or folder matches any of the glob patterns, by name or by path relative to the input folder."""
+    import fnmatch
+    return any(fnmatch.fnmatch(entry.name, p) or fnmatch.fnmatch(relative_path, p) for p in patterns)
+
+def scan_images(input_folder, recursive=False, cache=None, jobs=1, include=None, exclude=None, max_depth=None):
+    """Scan stage: yield an os.DirEntry for every supported image, folder by folder in the same
+    top-down order as os.walk. With jobs > 1 upcoming folders are listed concurrently.
+
+    include and exclude are glob patterns matched against names and paths relative to the input
+    folder; excluded folders are not descended into. max_depth limits recursion (0 is the input folder
+    only). Cache entries of images that disappeared from a scanned folder are evicted, whether or not
+    the filters select them."""
+    with create_executor(jobs) as executor:
+        prefetch_limit = jobs * 4
+        outstanding = 0
+
+        def submit(path):
+            nonlocal outstanding
+            if executor is None or outstanding >= prefetch_limit:
+                return None
+            outstanding += 1
+            return executor.submit(list_directory, path)
+
+        stack = [(input_folder, 0, submit(input_folder))]
+        while stack:
+            path, depth, listing = stack.pop()
+            if listing is not None:
+                outstanding -= 1
+                files, dirs = listing.result()
+            else:
+                files, dirs = list_directory(path)
+
+            listed = [entry for entry in files if is_valid_image(entry.name)]
+            if cache:
+                # Evict against every image in the folder, not only the ones this run's filters select
+                cache.evict_missing(path, [entry.path for entry in listed])
+            for entry in listed:
+                relative_path = os.path.relpath(entry.path, input_folder)
+                if include and not matches_globs(entry, relative_path, include):
+                    continue
+                if exclude and matches_globs(entry, relative_path, exclude):
+                    continue
+                yield entry
+
+            if recursive and (max_depth is None or depth < max_depth):
+                children = []
+                for entry in dirs:
+                    # Like os.walk, symbolic links to folders are not followed
+                    if entry.is_symlink():
+                        continue
+                    if exclude and matches_globs(entry, os.path.relpath(entry.path, input_folder), exclude):
+                        continue
+                    children.append((entry.path, depth + 1, submit(entry.path)))
+                stack.extend(reversed(children))
+
+def plan_location_groups(catalog, indexes, target_folder, namer, folder_key, radius=None, cluster='greedy', min_samples=1):
+    """Yield (src, dst) placements of the catalog's images at indexes (an array of images with GPS),
+    grouped by location into subfolders of target_folder, named by namer within folder_key."""
+    anchor_lat, anchor_lon, labels, order = cluster_points(catalog.lat, catalog.lon, indexes, radius, cluster, min_samples,
+                                                           lambda p: catalog.name(indexes[p]))
+    members, starts = group_members(labels, len(anchor_lat), order)
+    del labels, order
+
+    # Create a folder for each group based on GPS coordinates, or one folder for all images if they're in one group
+    prefix = "all_images_" if len(anchor_lat) == 1 else ""
+    for g in range(len(anchor_lat)):
+        gps_folder = os.path.join(target_folder, prefix + namer.name(folder_key, (anchor_lat[g], anchor_lon[g])))
+        for k in range(starts[g], starts[g + 1]):
+            i = indexes[members[k]]
+            yield catalog.path(i), os.path.join(gps_folder, catalog.name(i))
+
+def plan_group(extracted, input_folder, output_folder, radius=None, cluster='greedy', min_samples=1, gazetteer=None,
+               group_by='location', gap=DEFAULT_EVENT_GAP, date_format="%Y-%m-%d_%H-%M-%S"):
+    """Plan stage for grouping: yield (src, dst) placements, one folder of images at a time.
+    group_by 'location' groups the images with GPS within the radius. 'time' splits the images with a
+    DateTime into events at gaps of more than gap seconds, in folders named by the DateTime of their
+    first image in date_format, and 'space-time' also groups each event's images with GPS by location.
+    Group folders are named by GroupNamer, after the nearest place of gazetteer if one is given."""
+    namer = GroupNamer(gazetteer)
+    format_date = compile_date_format(date_format)
+    for root, catalog in catalog_by_folder(extracted):
+        # Group each folder separately, keeping the original folder structure
+        target_folder = os.path.join(output_folder, os.path.relpath(root, input_folder))
+        if group_by == 'location':
+            yield from plan_location_groups(catalog, catalog.located(), target_folder, namer, root, radius, cluster,
+                                            min_samples)
+            continue
+
+        for start, indexes in group_timestamps(((i, catalog.timestamp[i]) for i in catalog.dated()), gap):
+            event_name = namer.unique(root, format_date(EPOCH + timedelta(seconds=start)))
+            event_folder = os.path.join(target_folder, event_name)
+            located = array('q')
+            for i in indexes:
+                if group_by == 'space-time' and catalog.lat[i] == catalog.lat[i]:
+                    located.append(i)
+                else:
+                    # Images of a space-time event without GPS stay in the event folder itself
+                    yield catalog.path(i), os.path.join(event_folder, catalog.name(i))
+            if located:
+                yield from plan_location_groups(catalog, located, event_folder, namer, os.path.join(root, event_name),
+                                                radius, cluster, min_samples)
+
+def plan_group_global(extracted, input_folder, output_folder, radius, gazetteer=None):
+    """Plan stage for grouping across folders: the images with GPS of the whole tree are clustered
+    together by a GlobalGrouper, and each group folder at the top of output_folder holds its images
+    under their original relative paths. This is a barrier stage, as groups are only known at the end."""
+    with GlobalGrouper(radius) as grouper:
+        for file_path, _, gps_coordinates, _, _ in extracted:
+            if gps_coordinates:
+                grouper.add(os.path.relpath(file_path, input_folder), gps_coordinates)
+        for relative_path, group_folder in grouper.placements(GroupNamer(gazetteer)):
+            yield os.path.join(input_folder, relative_path), os.path.join(output_folder, group_folder, relative_path)
+
+def plan_group_incremental(extracted, input_folder, output_folder, radius=None, groupings=None, namer=None):
+    """Plan stage for grouping in watch mode: like plan_group with greedy grouping, but new images join
+    the groups of the same folder kept in groupings (a dict of GreedyGroups by folder) from earlier
+    batches, and namer is the GroupNamer of every batch. Group folders never get the all_images_ prefix,
+    as the final number of groups is not known."""
+    groupings = {} if groupings is None else groupings
+    namer = GroupNamer() if namer is None else namer
+    for root, catalog in catalog_by_folder(extracted):
+        grouping = groupings.setdefault(root, GreedyGroups(radius))
+        relative_path = os.path.relpath(root, input_folder)
+        for i in catalog.located():
+            file_path = catalog.path(i)
+            gps_coords = grouping.groups[grouping.add(file_path, catalog.coordinates(i))][0]
+            gps_folder = os.path.join(output_folder, relative_path, namer.name(root, gps_coords))
+            yield file_path, os.path.join(gps_folder, os.path.basename(file_path))
+
+COLLISION_MODES = ['suffix', 'subsec', 'overwrite']
+
+class NameIndex:
+    """Index of the file names taken per output folder, so that no placement overwrites another file.
+
+    Each output folder is listed once, the first time a name is assigned in it, instead of probing the
+    disk for every file. A name is free if no other image got it during the run and no file of that name
+    was listed, or the listed file is the image itself or an earlier placement of it (a link to it, or a
+    copy with the same content), so rerunning into the same folder gives the same result. Files below
+    sources_root are never reused for another image, as they may be sources still to be placed.
+    Colliding names get a deterministic suffix: "_1", "_2", ... in scan order, or first the
+    SubSecTimeOriginal of the later image (".25" for 0.25s) if one is provided. With track_sources, a
+    source that is assigned a name again, as when watch mode sees a changed file, gets its earlier name back."""
+
+    def __init__(self, track_sources=False, sources_root=None):
+        self.sources_root = os.path.abspath(sources_root) if sources_root else None
+        self._taken = {}
+        self._listed = {}
+        self._next_suffix = {}
+        self._by_source = {} if track_sources else None
+
+    def _listing(self, folder):
+        listed = self._listed.get(folder)
+        if listed is None:
+            listed = self._listed[folder] = {}
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        listed[os.path.normcase(entry.name)] = entry.name
+            except OSError:
+                pass
+        return listed
+
+    def is_pending_source(self, path):
+        """Whether path may be a source of this run that is still to be placed."""
+        if self.sources_root is None:
+            return False
+        path = os.path.abspath(path)
+        return os.path.commonpath([path, self.sources_root]) == self.sources_root
+
+    def overwrites_source(self, folder, name, source):
+        """Whether placing source at folder/name would replace another listed file that may be a pending source."""
+        listed = self._listing(folder).get(os.path.normcase(name))
+        if listed is None:
+            return False
+        path = os.path.join(folder, listed)
+        return self.is_pending_source(path) and not is_same_file(path, source)
+
+    def _free(self, folder, name, source):
+        key = os.path.normcase(name)
+        if key in self._taken.setdefault(folder, set()):
+            return False
+        listed = self._listing(folder).get(key)
+        if listed is None:
+            return True
+        path = os.path.join(folder, listed)
+        if is_same_file(path, source):
+            return True
+        if self.is_pending_source(path) or os.path.islink(path):
+            return False
+        import filecmp
+        try:
+            return os.path.isfile(path) and filecmp.cmp(path, source, shallow=False)
+        except OSError:
+            return False
+
+    def assign(self, folder, stem, ext, source, alternative_stem=None):
+        """Return a file name for stem + ext that is free in folder. source is the path of the file being
+        named, and alternative_stem is a callable returning a stem to try first on a collision, or None."""
+        if self._by_source is not None:
+            earlier = self._by_source.get((folder, source))
+            if earlier is not None and earlier[0] == stem:
+                return earlier[1]
+        taken = self._taken.setdefault(folder, set())
+        name = stem + ext
+        if not self._free(folder, name, source) and alternative_stem:
+            alternative = alternative_stem()
+            if alternative:
+                name = alternative + ext
+        if not self._free(folder, name, source):
+            # The names below the remembered suffix were all given to other images of this run
+            n = self._next_suffix.get((folder, stem), 1)
+            while os.path.normcase(f"{stem}_{n}{ext}") in taken:
+                n += 1
+            self._next_suffix[(folder, stem)] = n
+            while not self._free(folder, f"{stem}_{n}{ext}", source):
+                n += 1
+            name = f"{stem}_{n}{ext}"
+        taken.add(os.path.normcase(name))
+        if self._by_source is not None:
+            self._by_source[(folder, source)] = (stem, name)
+        return name
+
+def read_subsec_stem(file_path, stem):
+    """Return stem extended with the image's SubSecTimeOriginal, or None if it has none."""
+    exif, _ = extract_exif_data(file_path, tags=('SubSecTimeOriginal',), gps=False)
+    subsec = str(exif.get('SubSecTimeOriginal', '')).strip() if exif else ''
+    return f"{stem}.{subsec}" if subsec.isdigit() else None
+
+def plan_rename(extracted, input_folder, output_folder, date_format, on_collision='suffix', names=None):
+    """Plan stage for renaming: yield (src, dst) placements named after the EXIF DateTime.
+    Names that collide within an output folder or with its files are made unique as described in
+    NameIndex. With on_collision 'overwrite' they are not, but an image that may still be a source
+    of the run is never overwritten. Watch mode passes the same NameIndex as names for every batch."""
+    format_datetime = compile_date_format(date_format)
+    names = NameIndex(sources_root=input_folder) if names is None else names
+    for root, catalog in catalog_by_folder(extracted, PIPELINE_QUEUE_SIZE):
+        # Preserve folder structure when renaming
+        destination_dir = os.path.join(output_folder, os.path.relpath(root, input_folder))
+        for i in range(len(catalog)):
+            taken = catalog.datetime(i)
+            if taken:
+                file = catalog.name(i)
+                file_path = os.path.join(root, file)
+                # The date format may itself contain folders
+                destination = os.path.join(destination_dir, format_datetime(taken) + os.path.splitext(file)[1])
+                folder, name = os.path.split(destination)
+                if on_collision != 'overwrite':
+                    stem, ext = os.path.splitext(name)
+                    alternative = partial(read_subsec_stem, file_path, stem) if on_collision == 'subsec' else None
+                    destination = os.path.join(folder, names.assign(folder, stem, ext, file_path, alternative))
+                elif names.overwrites_source(folder, name, file_path):
+                    reporter.error(f"Not renaming {file_path} to {destination}, which may be an image still to be renamed")
+                    continue
+                yield file_path, destination
+
+def execute_plan(actions, placement, stats=None, cancel=None):
+    """Execute stage: hand each (src, dst) or (src, dst, mode) placement to the PlacementEngine or PlanWriter.
+    Stops early, leaving the remaining placements undone, once the cancel event is set."""
+    for src, dst, *mode in actions:
+        if cancel is not None and cancel.is_set():
+            break
+        start = time.perf_counter()
+        placement.submit(src, dst, mode=mode[0] if mode else None)
+        if stats:
+            stats.add_time('execute', time.perf_counter() - start)
+    return placement
+
+def create_placement(mode='copy', copy_workers=1, fsync=False, plan_path=None, plan_header=None, shard=None):
+    """Return the execute stage sink: a PartialWriter for a shard, a PlanWriter for dry runs, otherwise
+    a PlacementEngine."""
+    if shard:
+        if not plan_path:
+            raise ValueError("A shard of a run needs a plan path for its partial manifest")
+        return PartialWriter(plan_path, {'mode': mode, **(plan_header or {})}, shard)
+    if plan_path:
+        return PlanWriter(plan_path, {'mode': mode, **(plan_header or {})})
+    return PlacementEngine(mode, copy_workers, fsync)
+
+def run_pipeline(scan_stage, plan_stage, placement, jobs=1, cache=None, stats=None, cancel=None, dedupe=None):
+    """Run scan_stage -> extract -> plan_stage -> [dedupe] -> execute into placement, recording timings in stats.
+    scan_stage returns the images to process, and plan_stage maps the (file_path, exif_datetime,
+    gps_coordinates) stream to (src, dst) placements. dedupe is None or one of DEDUPE_ACTIONS.
+    Setting the optional cancel event stops the run after the placements already handed out."""
+    stats = stats or RunStats()
+    stats.attach(placement, cache)
+    with create_executor(jobs) as executor:
+        scanned = stats.timed(scan_stage(), 'scan', 'files_scanned')
+        extracted = prefetch(stats.timed(extract_metadata_batch(scanned, executor, cache), 'extract', 'files_extracted'))
+        extracted = until_cancelled(stats.timed(extracted, 'extract_queue'), cancel)
+        actions = stats.timed(plan_stage(extracted), 'plan')
+        if dedupe:
+            stats.deduplicator = Deduplicator(dedupe, executor, cache)
+            actions = stats.timed(stats.deduplicator.filter(actions), 'dedupe')
+        execute_plan(actions, placement, stats, cancel)
+    if cancel is not None and cancel.is_set():
+        reporter.message("Cancelled.")
+    if dedupe:
+        reporter.message(stats.deduplicator.summary())
+    return placement
+
+def group_images_by_location(input_folder, output_folder, recursive=False, radius=None, jobs=1, cache=None,
+                             cluster='greedy', min_samples=1, mode='copy', copy_workers=1, fsync=False, plan_path=None,
+                             stats=None, cancel=None, include=None, exclude=None, max_depth=None, dedupe=None, placement=None,
+                             gazetteer=None, group_by='location', gap=DEFAULT_EVENT_GAP, date_format="%Y-%m-%d_%H-%M-%S",
+                             across_folders=False, shard=None):
+    """Group images into folders based on their GPS coordinates, considering a radius if specified,
+    while keeping the original folder structure. group_by 'time' or 'space-time' groups them into events
+    by their DateTime instead, see plan_group. With across_folders the images of all folders are
+    grouped together within the radius, see plan_group_global. If plan_path is given, the placements are written to
+    that plan manifest instead of being executed. Identical images are skipped or linked if dedupe is
+    'skip' or 'link'. placement replaces the PlacementEngine or PlanWriter otherwise created as the execute
+    stage sink. gazetteer, a Gazetteer or the path of a place list, names the group folders after the
+    nearest place. shard (K, N) processes only the K-th of N shards into a partial manifest at plan_path,
+    see PartialWriter. Returns the sink with the output statistics."""
+    if isinstance(gazetteer, (str, os.PathLike)):
+        gazetteer = Gazetteer.load(gazetteer)
+    options = {'radius': radius, 'cluster': cluster, 'min_samples': min_samples, 'group_by': group_by, 'gap': gap,
+               'date_format': date_format, 'across_folders': across_folders,
+               'gazetteer': gazetteer.path if gazetteer is not None else None}
+    header = {'operation': 'group', 'input_folder': os.path.abspath(input_folder), 'output_folder': os.path.abspath(output_folder)}
+    if shard:
+        if gazetteer is not None and gazetteer.path is None:
+            raise ValueError("A shard of a run can only name groups with a gazetteer loaded from a place list")
+        header['options'] = options
+    scan_stage = partial(scan_images, input_folder, recursive, cache, jobs, include, exclude, max_depth)
+    plan_stage = group_plan_stage(input_folder, output_folder, **dict(options, gazetteer=gazetteer))
+    with placement or create_placement(mode, copy_workers, fsync, plan_path, header, shard) as placement:
+        if shard:
+            scan_stage, plan_stage = placement.stages(scan_stage, plan_stage)
+        return run_pipeline(scan_stage, plan_stage, placement, jobs, cache, stats, cancel, dedupe)
+
+def group_plan_stage(input_folder, output_folder, radius=None, cluster='greedy', min_samples=1, gazetteer=None,
+                     group_by='location', gap=DEFAULT_EVENT_GAP, date_format="%Y-%m-%d_%H-%M-%S", across_folders=False):
+    """Return the plan stage grouping images with these options, see plan_group and plan_group_global."""
+    if across_folders:
+        if radius is None or group_by != 'location':
+            raise ValueError("Grouping across folders requires a radius and grouping by location")
+        if min_samples != 1:
+            raise ValueError("Grouping across folders always clusters with min_samples 1")
+        return partial(plan_group_global, input_folder=input_folder, output_folder=output_folder, radius=radius,
+                       gazetteer=gazetteer)
+    return partial(plan_group, input_folder=input_folder, output_folder=output_folder, radius=radius,
+                   cluster=cluster, min_samples=min_samples, gazetteer=gazetteer, group_by=group_by, gap=gap,
+                   date_format=date_format)
+
+def rename_images_by_datetime(input_folder, output_folder, date_format, recursive=False, jobs=1, cache=None, mode='copy',
+                              copy_workers=1, fsync=False, plan_path=None, stats=None, cancel=None, include=None, exclude=None,
+                              max_depth=None, on_collision='suffix', dedupe=None, placement=None, shard=None):
+    """Rename images based on their EXIF DateTime metadata, preserving the original folder structure.
+    Images whose names collide are given unique names according to on_collision (see plan_rename).
+    If plan_path is given, the placements are written to that plan manifest instead of being executed.
+    Identical images are skipped or linked if dedupe is 'skip' or 'link'. placement replaces the
+    PlacementEngine or PlanWriter otherwise created as the execute stage sink. shard (K, N) processes
+    only the K-th of N shards into a partial manifest at plan_path, see PartialWriter.
+    Returns the sink with the output statistics."""
+    header = {'operation': 'rename', 'input_folder': os.path.abspath(input_folder), 'output_folder': os.path.abspath(output_folder)}
+    if shard:
+        header['options'] = {'date_format': date_format, 'on_collision': on_collision}
+    scan_stage = partial(scan_images, input_folder, recursive, cache, jobs, include, exclude, max_depth)
+    plan_stage = partial(plan_rename, input_folder=input_folder, output_folder=output_folder, date_format=date_format,
+                         on_collision=on_collision)
+    with placement or create_placement(mode, copy_workers, fsync, plan_path, header, shard) as placement:
+        if shard:
+            scan_stage, plan_stage = placement.stages(scan_stage, plan_stage)
+        return run_pipeline(scan_stage, plan_stage, placement, jobs, cache, stats, cancel, dedupe)
+# ----------------------------------------------------------------
+
+# Plan manifests -------------------------------------------------
+# A plan is a JSON Lines file: a header object describing the run, followed by one {"src", "dst"}
+# object per placement, with a "mode" if it differs from the header's. Applying a plan appends the line number of every finished placement to a
+# journal next to it, so an interrupted apply resumes where it stopped without rescanning. The journal starts
+# with the identity of its plan, and writing a plan removes any old journal, so a journal is never
+# applied to another plan of the same name.
+PLAN_VERSION = 1
+
+class PlanWriter:
+    """Execute stage sink for dry runs: records placements in a plan manifest without touching the output tree."""
+
+    def __init__(self, plan_path, header):
+        import json
+        self._dumps = json.dumps
+        self.plan_path = plan_path
+        self.files_planned = 0
+        try:
+            os.remove(plan_path + '.journal')
+        except FileNotFoundError:
+            pass
+        self._file = open(plan_path, 'w', encoding='utf-8')
+        self._file.write(self._dumps({'version': PLAN_VERSION, **header}) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, src, dst, mode=None):
+        entry = {'src': os.path.abspath(src), 'dst': os.path.abspath(dst)}
+        if mode:
+            entry['mode'] = mode
+        self._file.write(self._dumps(entry) + '\n')
+        self.files_planned += 1
+
+    def close(self):
+        self._file.close()
+
+    def summary(self):
+        return f"Planned {self.files_planned} placements in {self.plan_path}"
+
+class PlanList:
+    """Execute stage sink for dry runs through the library API: collects the placements in memory."""
+
+    def __init__(self):
+        self.placements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def files_planned(self):
+        return len(self.placements)
+
+    def submit(self, src, dst, mode=None):
+        self.placements.append((src, dst) if mode is None else (src, dst, mode))
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return f"Planned {self.files_planned} placements"
+
+def read_plan(plan_path):
+    """Return the header of a plan manifest and an iterator of its (index, src, dst, mode) placements,
+    where mode is None for placements using the header's mode."""
+    import json
+    plan_file = open(plan_path, encoding='utf-8')
+    header = json.loads(plan_file.readline())
+    if header.get('version') != PLAN_VERSION:
+        plan_file.close()
+        raise ValueError(f"Unsupported plan version in {plan_path}: {header.get('version')}")
+    if 'shard' in header:
+        plan_file.close()
+        raise ValueError(f"{plan_path} is the partial manifest of shard {header['shard'][0]}/{header['shard'][1]}; "
+                         f"combine all shards with exif_tool.py merge")
+
+    def entries():
+        with plan_file:
+            for index, line in enumerate(plan_file):
+                entry = json.loads(line)
+                yield index, entry['src'], entry['dst'], entry.get('mode')
+    return header, entries()
+
+def plan_identity(plan_path):
+    """Return a digest identifying a plan manifest by its header line, size and modification time."""
+    import hashlib
+    st = os.stat(plan_path)
+    with open(plan_path, 'rb') as f:
+        header = f.readline()
+    return hashlib.blake2b(header + f"{st.st_size}:{st.st_mtime_ns}".encode(), digest_size=16).hexdigest()
+
+def apply_plan(plan_path, copy_workers=1, fsync=False):
+    """Execute a plan manifest, skipping the placements its journal records as done. A journal written
+    for another plan is ignored and started over.
+    Returns the PlacementEngine with the output statistics and the number of skipped placements."""
+    header, entries = read_plan(plan_path)
+    journal_path = plan_path + '.journal'
+    identity = f"plan {plan_identity(plan_path)}\n"
+    done = set()
+    if os.path.exists(journal_path):
+        with open(journal_path, encoding='utf-8') as journal:
+            if journal.readline() == identity:
+                # A torn last line from a crash is ignored; that placement is simply redone
+                done = {int(line) for line in journal if line.strip().isdigit() and line.endswith('\n')}
+            else:
+                reporter.message(f"Ignoring {journal_path}, which was written for another plan.")
+    if not done:
+        with open(journal_path, 'w', encoding='utf-8') as journal:
+            journal.write(identity)
+
+    mode = header.get('mode', 'copy')
+    skipped = 0
+    lock = threading.Lock()
+    with open(journal_path, 'a', encoding='utf-8') as journal, PlacementEngine(mode, copy_workers, fsync) as placement:
+        def record(index):
+            with lock:
+                journal.write(f"{index}\n")
+                journal.flush()
+
+        for index, src, dst, entry_mode in entries:
+            if index in done:
+                skipped += 1
+                continue
+            if (entry_mode or mode) == 'move' and not os.path.lexists(src) and os.path.lexists(dst):
+                # Moved before the journal entry was written
+                record(index)
+                skipped += 1
+                continue
+            placement.submit(src, dst, partial(record, index), entry_mode)
+    return placement, skipped
+# ----------------------------------------------------------------
+
+# Sharding -------------------------------------------------------
+# A run can be split into N shards, e.g. over several processes or hosts. Every shard scans the whole
+# input tree but only extracts the images whose relative path hashes to it, and writes their metadata
+# together with its own placements to a partial manifest: a plan manifest whose header names the shard
+# and the run's options, with a {"index", "src", "datetime", "lat", "lon", "size", "mtime_ns"} line per
+# image, index being its position in the scan. A trailer with the number and a digest of all scanned
+# paths is written once the shard finished, followed by a fixed-size footer line with the trailer's size
+# in bytes, so read_partial finds the trailer from the end of the file. merge_partials checks that all shards are complete and saw
+# the same scan, then plans the whole run from their metadata in scan order, which resolves the rename
+# collisions and groups across shards exactly like a single run.
+
+def parse_shard(shard_str):
+    """Parse a shard given as 'K/N' (1 <= K <= N) and return (K, N)."""
+    try:
+        k, n = (int(part) for part in shard_str.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard format: {shard_str} (expected K/N, e.g. 1/4)") from None
+    if not 1 <= k <= n:
+        raise ValueError(f"Invalid shard {shard_str}: K must be between 1 and N")
+    return k, n
+
+def shard_of(relative_path, shards):
+    """Return the shard (1 to shards) of an image, from a stable hash of its path relative to the input folder."""
+    import hashlib
+    key = relative_path.replace(os.sep, '/').encode('utf-8', 'surrogateescape')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big') % shards + 1
+
+PARTIAL_FOOTER = '{{"trailer_bytes": "{:020d}"}}\n'
+PARTIAL_FOOTER_SIZE = len(PARTIAL_FOOTER.format(0))
+PARTIAL_FOOTER_PREFIX = PARTIAL_FOOTER.split('{:')[0].replace('{{', '{').encode()
+
+class PartialWriter(PlanWriter):
+    """Execute stage sink for one shard of a run: records the placements like PlanWriter, and the
+    extracted metadata of the shard's images through the stages wrapped by stages()."""
+
+    def __init__(self, plan_path, header, shard):
+        import hashlib
+        super().__init__(plan_path, {**header, 'shard': list(shard)})
+        self.shard = shard
+        self.input_folder = header['input_folder']
+        self.scanned = 0
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._indexes = deque()
+        self._scan_done = False
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None and self._scan_done and not self._indexes:
+            start = self._file.tell()
+            self._file.write(self._dumps({'scanned': self.scanned, 'digest': self._digest.hexdigest()}) + '\n')
+            self._file.write(PARTIAL_FOOTER.format(self._file.tell() - start))
+        self.close()
+
+    def stages(self, scan_stage, plan_stage):
+        """Return the scan and plan stages restricted to this shard."""
+        return (lambda: self.scan(scan_stage())), (lambda extracted: plan_stage(self.record(extracted)))
+
+    def scan(self, entries):
+        """Yield the scanned images of this shard, counting and digesting all of them."""
+        for entry in entries:
+            relative_path = os.path.relpath(entry.path, self.input_folder)
+            self._digest.update(relative_path.encode('utf-8', 'surrogateescape') + b'\0')
+            index = self.scanned
+            self.scanned += 1
+            if shard_of(relative_path, self.shard[1]) == self.shard[0]:
+                # The extract stage keeps the scan order, so record() takes the indexes in the same order
+                self._indexes.append(index)
+                yield entry
+        self._scan_done = True
+
+    def record(self, extracted):
+        """Write the metadata line of each extracted image while passing it on to the plan stage."""
+        for file_path, exif_datetime, gps_coordinates, size, mtime_ns in extracted:
+            lat, lon = gps_coordinates if gps_coordinates else (None, None)
+            self._file.write(self._dumps({'index': self._indexes.popleft(), 'src': os.path.abspath(file_path),
+                                          'datetime': exif_datetime, 'lat': lat, 'lon': lon, 'size': size,
+                                          'mtime_ns': mtime_ns}) + '\n')
+            yield file_path, exif_datetime, gps_coordinates, size, mtime_ns
+
+def read_partial(partial_path):
+    """Return the header and trailer of a partial manifest (the trailer is None if the shard did not finish)."""
+    import json
+    with open(partial_path, 'rb') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != PLAN_VERSION or 'shard' not in header:
+            raise ValueError(f"{partial_path} is not a partial manifest of a shard")
+        # The footer line has a fixed size, plus one byte for a '\r' if the line ends were translated
+        end = f.seek(0, os.SEEK_END)
+        f.seek(max(end - PARTIAL_FOOTER_SIZE - 1, 0))
+        tail = f.read()
+        footer = tail.rstrip(b'\r\n')[-(PARTIAL_FOOTER_SIZE - 1):]
+        if not (footer.startswith(PARTIAL_FOOTER_PREFIX) and footer[len(PARTIAL_FOOTER_PREFIX):-2].isdigit()):
+            return header, None
+        trailer_size = int(footer[len(PARTIAL_FOOTER_PREFIX):-2])
+        f.seek(end - len(tail) + tail.rindex(footer) - trailer_size)
+        trailer = json.loads(f.read(trailer_size))
+    return header, trailer
+
+def partial_records(partial_path):
+    """Yield the (index, (file_path, exif_datetime, gps_coordinates, size, mtime_ns)) metadata lines of a partial manifest."""
+    import json
+    with open(partial_path, encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            entry = json.loads(line)
+            if 'index' in entry:
+                coordinates = (entry['lat'], entry['lon']) if entry['lat'] is not None else None
+                yield entry['index'], (entry['src'], entry['datetime'], coordinates, entry['size'], entry['mtime_ns'])
+
+def merge_partials(partial_paths):
+    """Check that the partial manifests are the complete shards of one run and return its header and the
+    merged (file_path, exif_datetime, gps_coordinates, size, mtime_ns) stream in the run's scan order."""
+    import heapq
+    partials = [(path, *read_partial(path)) for path in partial_paths]
+    if not partials:
+        raise ValueError("No partial manifests given")
+    _, first, _ = partials[0]
+    shards = first['shard'][1]
+    run_keys = ('operation', 'input_folder', 'output_folder', 'options')
+    seen = {}
+    for path, header, trailer in partials:
+        if any(header.get(key) != first.get(key) for key in run_keys) or header['shard'][1] != shards:
+            raise ValueError(f"{path} belongs to another run than {partials[0][0]}")
+        if trailer is None:
+            raise ValueError(f"Shard {header['shard'][0]}/{shards} in {path} did not finish")
+        if seen and trailer != next(iter(seen.values()))[1]:
+            raise ValueError(f"Shard {header['shard'][0]}/{shards} in {path} scanned other files than the other shards")
+        if header['shard'][0] in seen:
+            raise ValueError(f"Shard {header['shard'][0]}/{shards} is given twice")
+        seen[header['shard'][0]] = (path, trailer)
+    missing = sorted(set(range(1, shards + 1)) - set(seen))
+    if missing:
+        raise ValueError(f"Missing shards: {', '.join(f'{k}/{shards}' for k in missing)}")
+
+    merged = heapq.merge(*(partial_records(path) for path, _, _ in partials), key=lambda item: item[0])
+    return first, (record for _, record in merged)
+
+def merge_run(partial_paths, mode='copy', copy_workers=1, fsync=False, plan_path=None, stats=None, cancel=None):
+    """Plan the run whose shards wrote the partial manifests from their metadata, and execute it into its
+    output folder, or write it to a plan manifest at plan_path. Returns the sink with the output statistics."""
+    header, extracted = merge_partials(partial_paths)
+    input_folder, output_folder, options = header['input_folder'], header['output_folder'], header['options']
+    if header['operation'] == 'rename':
+        plan_stage = partial(plan_rename, input_folder=input_folder, output_folder=output_folder, **options)
+    else:
+        gazetteer = Gazetteer.load(options['gazetteer']) if options['gazetteer'] else None
+        plan_stage = group_plan_stage(input_folder, output_folder, **dict(options, gazetteer=gazetteer))
+    stats = stats or RunStats()
+    plan_header = {'operation': header['operation'], 'input_folder': input_folder, 'output_folder': output_folder}
+    with create_placement(mode, copy_workers, fsync, plan_path, plan_header) as placement:
+        stats.attach(placement, None)
+        execute_plan(stats.timed(plan_stage(until_cancelled(extracted, cancel)), 'plan'), placement, stats, cancel)
+    return placement
+# ----------------------------------------------------------------
+
+# Watch mode -----------------------------------------------------
+WATCH_SETTLE_SECONDS = 2.0
+WATCH_POLL_INTERVAL = 2.0
+
+def walk_files(folder, recursive=False, max_depth=None, skip=None, depth=0, on_folder=None):
+    """Yield the os.DirEntry of every file under folder, calling on_folder(path, depth) for each folder
+    visited. Folders whose absolute path is in skip are left out."""
+    if on_folder:
+        on_folder(folder, depth)
+    files, dirs = list_directory(folder)
+    yield from files
+    if recursive and (max_depth is None or depth < max_depth):
+        for entry in dirs:
+            if not entry.is_symlink() and os.path.abspath(entry.path) not in (skip or ()):
+                yield from walk_files(entry.path, recursive, max_depth, skip, depth + 1, on_folder)
+
+class InotifyWatcher:
+    """Reports the files created, written or moved into a folder tree through Linux inotify, adding
+    watches for new subfolders as they appear. Raises OSError where inotify is not available."""
+
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x2, 0x8, 0x80, 0x100
+    IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, folder, recursive=False, max_depth=None, skip=None):
+        import ctypes
+        import ctypes.util
+        self._get_errno = ctypes.get_errno
+        self.folder, self.recursive, self.max_depth, self.skip = folder, recursive, max_depth, skip
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise OSError(f"inotify is not available: {e}")
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+        self.initial = [entry.path for entry in self._add_tree(folder, 0)]
+
+    def _add_watch(self, path, depth):
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            reporter.error(f"Error watching {path}: {os.strerror(self._get_errno())}")
+            return
+        self._watches[wd] = (path, depth)
+
+    def _add_tree(self, folder, depth):
+        return list(walk_files(folder, self.recursive, self.max_depth, self.skip, depth, self._add_watch))
+
+    def changes(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for events and return the changed file paths."""
+        import select
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b'\0'))
+            offset += self.EVENT.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost: report everything again and let the caller skip unchanged files
+                changed.extend(entry.path for entry in walk_files(self.folder, self.recursive, self.max_depth, self.skip))
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if wd not in self._watches:
+                continue
+            folder, depth = self._watches[wd]
+            path = os.path.join(folder, name)
+            if not mask & self.IN_ISDIR:
+                changed.append(path)
+            elif (mask & (self.IN_CREATE | self.IN_MOVED_TO) and self.recursive
+                  and (self.max_depth is None or depth < self.max_depth) and os.path.abspath(path) not in (self.skip or ())):
+                # Files may have been written into a new folder before its watch was added
+                changed.extend(entry.path for entry in self._add_tree(path, depth + 1))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher:
+    """Fallback watcher that rescans the folder tree every interval seconds and reports the files
+    whose size or mtime changed."""
+
+    def __init__(self, folder, recursive=False, max_depth=None, skip=None, interval=WATCH_POLL_INTERVAL):
+        self.folder, self.recursive, self.max_depth, self.skip = folder, recursive, max_depth, skip
+        self.interval = interval
+        self._known = self._snapshot()
+        self._next_poll = time.monotonic() + interval
+        self.initial = list(self._known)
+
+    def _snapshot(self):
+        snapshot = {}
+        for entry in walk_files(self.folder, self.recursive, self.max_depth, self.skip):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def changes(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for the next poll and return the changed file paths."""
+        wait = self._next_poll - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(max(timeout, 0))
+            return []
+        time.sleep(max(wait, 0))
+        self._next_poll = time.monotonic() + self.interval
+        snapshot = self._snapshot()
+        changed = [path for path, key in snapshot.items() if self._known.get(path) != key]
+        self._known = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+def create_watcher(folder, recursive=False, max_depth=None, skip=None, poll_interval=WATCH_POLL_INTERVAL, polling=False):
+    """Return an InotifyWatcher, or a PollingWatcher if polling is requested or inotify is not available."""
+    if not polling:
+        try:
+            return InotifyWatcher(folder, recursive, max_depth, skip)
+        except OSError as e:
+            reporter.message(f"{e}; polling every {poll_interval:g}s instead.")
+    return PollingWatcher(folder, recursive, max_depth, skip, poll_interval)
+
+def is_watched_image(file_path, input_folder, include=None, exclude=None):
+    """Apply the scan_images filters to a path reported by a watcher."""
+    import fnmatch
+    name = os.path.basename(file_path)
+    if not is_valid_image(name):
+        return False
+    relative_path = os.path.relpath(file_path, input_folder)
+    if include and not any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relative_path, p) for p in include):
+        return False
+    if exclude:
+        # Excluded folders are left out together with everything below them
+        parts = relative_path.split(os.sep)
+        for i in range(len(parts)):
+            if any(fnmatch.fnmatch(parts[i], p) or fnmatch.fnmatch(os.path.join(*parts[:i + 1]), p) for p in exclude):
+                return False
+    return True
+
+def watch_folder(input_folder, output_folder, plan_stage, recursive=False, jobs=1, cache=None, mode='copy',
+                 copy_workers=1, fsync=False, stats=None, cancel=None, include=None, exclude=None, max_depth=None,
+                 settle=WATCH_SETTLE_SECONDS, poll_interval=WATCH_POLL_INTERVAL, polling=False):
+    """Process the images in input_folder, then keep watching it and run new or changed images through
+    the pipeline in small batches until the cancel event is set or the process is interrupted.
+
+    A file is processed once its size and mtime have not changed for settle seconds, so partially
+    written files are not picked up. plan_stage is called once per batch and must keep any state that
+    later batches depend on, e.g. plan_rename with a NameIndex or plan_group_incremental.
+    Returns the PlacementEngine with the output statistics."""
+    stats = stats or RunStats()
+    skip = {os.path.abspath(output_folder)}
+    watcher = create_watcher(input_folder, recursive, max_depth, skip, poll_interval, polling)
+    pending = {}
+    processed = {}
+
+    def add_candidates(paths):
+        for path in paths:
+            if is_watched_image(path, input_folder, include, exclude):
+                pending[path] = None
+
+    def ready_files():
+        """Return the pending files that have settled, dropping those that disappeared or are unchanged."""
+        ready = []
+        now = time.time()
+        for path, last in list(pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del pending[path]
+                continue
+            key = (st.st_size, st.st_mtime_ns)
+            if processed.get(path) == key:
+                del pending[path]
+            elif key == last and now - st.st_mtime >= settle:
+                del pending[path]
+                ready.append((path, key))
+            else:
+                pending[path] = key
+        return sorted(ready)
+
+    add_candidates(watcher.initial)
+    reporter.message(f"Watching {input_folder} for new images (press Ctrl+C to stop)...")
+    with PlacementEngine(mode, copy_workers, fsync) as placement:
+        try:
+            while cancel is None or not cancel.is_set():
+                ready = ready_files()
+                if ready:
+                    batch = [path for path, _ in ready]
+                    run_pipeline(lambda: iter(batch), plan_stage, placement, jobs, cache, stats, cancel)
+                    if mode != 'move':
+                        processed.update(ready)
+                    if fsync:
+                        placement.flush()
+                    reporter.message(f"Processed {len(batch)} new or changed images.")
+                    continue
+                # Block until something happens; with files pending, wake up again when they may have settled.
+                # A cancel event is checked at least once a second.
+                timeout = settle / 2 if pending else None
+                if cancel is not None:
+                    timeout = min(timeout or 1.0, 1.0)
+                add_candidates(watcher.changes(timeout))
+        finally:
+            watcher.close()
+    return placement
+# ----------------------------------------------------------------
+
+# Library API ----------------------------------------------------
+# Keyword-friendly entry points for using the tool from other Python code without going through main().
+# A cache can be given as a MetadataCache or as the path of one, which is then opened for the call.
+ImageInfo = namedtuple('ImageInfo', ['path', 'datetime', 'coordinates', 'size', 'mtime_ns'])
+RunResult = namedtuple('RunResult', ['summary', 'stats', 'placements'])
+
+@contextmanager
+def opened_cache(cache):
+    """Yield cache, opening (and afterwards closing) it if it is the path of a MetadataCache."""
+    if isinstance(cache, (str, os.PathLike)):
+        with MetadataCache(cache) as opened:
+            yield opened
+    else:
+        yield cache
+
+def scan(input_folder, recursive=False, include=None, exclude=None, max_depth=None):
+    """Yield the paths of the supported images in input_folder, in scan order."""
+    for entry in scan_images(input_folder, recursive, None, 1, include, exclude, max_depth):
+        yield entry.path
+
+def extract(paths, jobs=1, cache=None):
+    """Yield an ImageInfo for each image path, in input order. datetime is the EXIF DateTime as a
+    datetime object and coordinates the (lat, lon) pair, each None if the image has none."""
+    with opened_cache(cache) as cache, create_executor(jobs) as executor:
+        for path, exif_datetime, coordinates, size, mtime_ns in extract_metadata_batch(paths, executor, cache):
+            taken = parse_exif_datetime(exif_datetime) if exif_datetime else None
+            yield ImageInfo(path, taken, coordinates, size, mtime_ns)
+
+def query(cache, start=None, end=None, bbox=None, near=None, radius=None, folder=None):
+    """Yield an ImageInfo for each image in the metadata cache matching all of the given conditions,
+    using its time and location indexes instead of reading the images. start and end are datetimes or
+    strings for parse_query_time, bbox is (south, west, north, east) and near a (lat, lon) point with the
+    radius in meters or a string such as "1km". folder limits the images to those below it. Images are
+    ordered by time and path."""
+    if isinstance(start, str):
+        start = parse_query_time(start)
+    elif isinstance(start, datetime):
+        start = int((start - EPOCH).total_seconds())
+    if isinstance(end, str):
+        end = parse_query_time(end, end=True)
+    elif isinstance(end, datetime):
+        end = int((end - EPOCH).total_seconds())
+    if isinstance(radius, str):
+        radius = parse_radius(radius)
+    if near is not None and radius is None:
+        raise ValueError("A query near a point needs a radius")
+
+    # The index is searched with the smaller box; both conditions are checked exactly on the rows found
+    boxes = [box for box in (bbox, radius_bbox(near, radius) if near is not None else None) if box is not None]
+    cell_ranges = min((bbox_cell_ranges(box) for box in boxes), key=len) if boxes else None
+    with opened_cache(cache) as cache:
+        for path, exif_datetime, lat, lon, size, mtime_ns, _ in cache.query(start, end, cell_ranges, folder):
+            coordinates = (lat, lon) if lat is not None else None
+            if bbox is not None and not in_bbox(coordinates, bbox):
+                continue
+            if near is not None and calculate_distance(near, coordinates) > radius:
+                continue
+            taken = parse_exif_datetime(exif_datetime) if exif_datetime else None
+            yield ImageInfo(path, taken, coordinates, size, mtime_ns)
+
+def run_operation(operation, dry_run, cache, *args, **kwargs):
+    """Run group_images_by_location or rename_images_by_datetime and return its RunResult."""
+    stats = RunStats()
+    with opened_cache(cache) as cache:
+        placement = operation(*args, cache=cache, stats=stats, placement=PlanList() if dry_run else None, **kwargs)
+    return RunResult(placement.summary(), stats.summary(), placement.placements if dry_run else None)
+
+def group(input_folder, output_folder, radius=None, recursive=False, cluster='greedy', min_samples=1, jobs=1,
+          cache=None, mode='copy', dry_run=False, **options):
+    """Group the images of input_folder into output_folder by location, as --group does. radius is in
+    meters or a string such as "1km", and a gap option for time grouping is in seconds or a string such
+    as "2h". With dry_run the output folder is not touched and the result lists
+    the planned (src, dst) placements. Other options are passed on to group_images_by_location.
+    Returns a RunResult."""
+    if isinstance(radius, str):
+        radius = parse_radius(radius)
+    if isinstance(options.get('gap'), str):
+        options['gap'] = parse_duration(options['gap'])
+    return run_operation(group_images_by_location, dry_run, cache, input_folder, output_folder, recursive=recursive,
+                         radius=radius, jobs=jobs, cluster=cluster, min_samples=min_samples, mode=mode, **options)
+
+def rename(input_folder, output_folder, date_format="%Y-%m-%d_%H-%M-%S", recursive=False, jobs=1, cache=None,
+           mode='copy', dry_run=False, **options):
+    """Rename the images of input_folder into output_folder by their EXIF DateTime, as --rename does.
+    With dry_run the output folder is not touched and the result lists the planned (src, dst) placements.
+    Other options are passed on to rename_images_by_datetime. Returns a RunResult."""
+    return run_operation(rename_images_by_datetime, dry_run, cache, input_folder, output_folder, date_format,
+                         recursive=recursive, jobs=jobs, mode=mode, **options)
+# ----------------------------------------------------------------
+
+# Job server -----------------------------------------------------
+# A long-lived process that runs rename and group jobs for thin clients (exif_tool.py --server, the GUI)
+# with a warm thread pool and an in-memory metadata cache shared by all jobs. It speaks JSON-RPC 2.0,
+# one JSON object per line, over a Unix socket or a localhost TCP port. Methods:
+#   submit(operation, input_folder, output_folder, options)  queue a 'rename' or 'group' job
+#   status(job, since=0)   state, statistics and the messages of a job from index since on
+#   wait(job, timeout, since=0)   like status, after waiting up to timeout seconds for the job to finish
+#   cancel(job)   cancel a queued or running job
+#   jobs()   status of every job; shutdown()   stop the server
+# Jobs run one at a time in submission order, so jobs writing to the same output folder cannot interfere.
+SERVER_OPTIONS = {
+    'rename': {'date_format', 'recursive', 'jobs', 'mode', 'copy_workers', 'fsync', 'plan_path', 'include', 'exclude',
+               'max_depth', 'on_collision', 'dedupe'},
+    'group': {'recursive', 'radius', 'jobs', 'cluster', 'min_samples', 'mode', 'copy_workers', 'fsync', 'plan_path',
+              'include', 'exclude', 'max_depth', 'dedupe', 'gazetteer', 'group_by', 'gap', 'date_format',
+              'across_folders'},
+}
+SERVER_MAX_MESSAGES = 10000
+
+class ServerError(Exception):
+    """An error reported by the job server, or a failure to reach it."""
+
+def parse_address(address):
+    """Return (family, address) for a "[host:]port" TCP address (host defaults to localhost) or a Unix socket path."""
+    import socket
+    host, sep, port = address.rpartition(':')
+    if port.isdigit() and (sep or not host) and os.sep not in host:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+def serve_address(address):
+    """Return (family, address) to bind the job server to. TCP addresses must be on the loopback
+    interface: the server is not authenticated and runs file operations with its user's permissions."""
+    import ipaddress
+    import socket
+    family, bind_address = parse_address(address)
+    if family == socket.AF_INET:
+        host = bind_address[0]
+        try:
+            loopback = host == 'localhost' or ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            loopback = False
+        if not loopback:
+            raise ServerError(f"Refusing to serve on {host}, which is not a loopback address; "
+                              f"use a Unix socket or 127.0.0.1")
+    return family, bind_address
+
+class Job:
+    """A job queued on the server, with its state, statistics and messages."""
+
+    def __init__(self, job_id, operation, input_folder, output_folder, options):
+        self.id = job_id
+        self.operation = operation
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+        self.options = options
+        self.state = 'queued'
+        self.stats = None
+        self.final_stats = None
+        self.summary = None
+        self.error = None
+        self.messages = []
+        self.messages_dropped = 0
+        self.cancel_event = threading.Event()
+        self.finished = threading.Event()
+
+    def add_message(self, kind, text):
+        self.messages.append([kind, text])
+        if len(self.messages) > SERVER_MAX_MESSAGES:
+            del self.messages[:len(self.messages) - SERVER_MAX_MESSAGES]
+            self.messages_dropped = self.message_count - len(self.messages)
+
+    @property
+    def message_count(self):
+        return self.messages_dropped + len(self.messages)
+
+    def status(self, since=0):
+        """Return the job's status with the messages from index since on."""
+        stats = self.final_stats or (self.stats.snapshot() if self.stats else None)
+        return {
+            'job': self.id, 'operation': self.operation, 'state': self.state,
+            'input_folder': self.input_folder, 'output_folder': self.output_folder,
+            'stats': stats, 'summary': self.summary, 'error': self.error,
+            'messages': self.messages[max(since - self.messages_dropped, 0):], 'message_count': self.message_count,
+        }
+
+class JobReporter(Reporter):
+    """Reporter of the job server: messages, errors and progress of a run go to the job being executed."""
+
+    def __init__(self):
+        super().__init__()
+        self.job = None
+
+    def emit(self, event, **fields):
+        pass
+
+    def message(self, text):
+        if self.job is not None:
+            self.job.add_message('message', text)
+
+    def error(self, text):
+        with self._lock:
+            self.errors += 1
+        if self.job is not None:
+            self.job.add_message('error', text)
+
+class JobServer:
+    """Queues jobs and runs them one at a time with a shared thread pool and metadata cache."""
+
+    def __init__(self, jobs=4, cache_path=None):
+        global shared_executor
+        self.cache = MetadataCache(cache_path or ':memory:')
+        self.gazetteers = {}
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._server = None
+        if jobs > 1:
+            shared_executor = new_thread_pool(jobs)
+        self.reporter = JobReporter()
+        set_reporter(self.reporter)
+        self._runner = threading.Thread(target=self._run_jobs, daemon=True)
+        self._runner.start()
+
+    def _run_jobs(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if job.cancel_event.is_set():
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        operation = rename_images_by_datetime if job.operation == 'rename' else group_images_by_location
+        options = dict(job.options)
+        if job.operation == 'rename':
+            options.setdefault('date_format', "%Y-%m-%d_%H-%M-%S")
+        job.stats = RunStats()
+        job.state = 'running'
+        self.reporter.job = job
+        try:
+            if isinstance(options.get('radius'), str):
+                options['radius'] = parse_radius(options['radius'])
+            if isinstance(options.get('gap'), str):
+                options['gap'] = parse_duration(options['gap'])
+            if options.get('gazetteer'):
+                # Place indexes stay loaded for later jobs
+                path = os.path.abspath(options['gazetteer'])
+                if path not in self.gazetteers:
+                    self.gazetteers[path] = Gazetteer.load(path)
+                options['gazetteer'] = self.gazetteers[path]
+            placement = operation(job.input_folder, job.output_folder, cache=self.cache, stats=job.stats,
+                                  cancel=job.cancel_event, **options)
+            job.summary = placement.summary()
+            job.add_message('message', job.summary)
+            job.state = 'cancelled' if job.cancel_event.is_set() else 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            self.reporter.job = None
+            job.final_stats = job.stats.summary()
+            job.finished.set()
+
+    def submit(self, operation, input_folder, output_folder, options=None):
+        options = options or {}
+        if operation not in SERVER_OPTIONS:
+            raise ValueError(f"Unsupported operation: {operation}")
+        unknown = set(options) - SERVER_OPTIONS[operation]
+        if unknown:
+            raise ValueError(f"Unsupported options for {operation}: {', '.join(sorted(unknown))}")
+        if not os.path.isdir(input_folder):
+            raise ValueError(f"Input folder '{input_folder}' does not exist.")
+        with self._lock:
+            job = Job(self._next_id, operation, os.path.abspath(input_folder), os.path.abspath(output_folder), options)
+            self.jobs[job.id] = job
+            self._next_id += 1
+        self._queue.put(job)
+        return job.status()
+
+    def _job(self, job):
+        if job not in self.jobs:
+            raise ValueError(f"Unknown job: {job}")
+        return self.jobs[job]
+
+    def status(self, job, since=0):
+        return self._job(job).status(since)
+
+    def wait(self, job, timeout=None, since=0):
+        found = self._job(job)
+        found.finished.wait(timeout)
+        return found.status(since)
+
+    def cancel(self, job):
+        found = self._job(job)
+        found.cancel_event.set()
+        if found.state == 'queued':
+            found.state = 'cancelled'
+            found.finished.set()
+        return found.status()
+
+    def list_jobs(self):
+        return [job.status(len(job.messages) + job.messages_dropped) for job in self.jobs.values()]
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            self.cancel(job.id)
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+        return True
+
+    def handle(self, request):
+        """Answer one JSON-RPC request object."""
+        methods = {'submit': self.submit, 'status': self.status, 'wait': self.wait, 'cancel': self.cancel,
+                   'jobs': self.list_jobs, 'shutdown': self.shutdown}
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        method = methods.get(request.get('method'))
+        if method is None:
+            response['error'] = {'code': -32601, 'message': f"Unknown method: {request.get('method')}"}
+            return response
+        params = request.get('params') or {}
+        try:
+            response['result'] = method(*params) if isinstance(params, list) else method(**params)
+        except (TypeError, ValueError) as e:
+            response['error'] = {'code': -32602, 'message': str(e)}
+        except Exception as e:
+            # Any other failure is answered too, so the client is not left without a reply
+            import traceback
+            traceback.print_exc()
+            response['error'] = {'code': -32603, 'message': f"{type(e).__name__}: {e}"}
+        return response
+
+    def serve(self, address):
+        """Listen on address until shutdown() is called."""
+        import json
+        import socket
+        import socketserver
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                    except ValueError as e:
+                        response = {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': str(e)}}
+                    else:
+                        response = server.handle(request)
+                    self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+
+        family, bind_address = serve_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(bind_address):
+                # A socket file left behind by a server that is no longer running
+                try:
+                    with ServerClient(address) as client:
+                        client.call('jobs')
+                    raise ServerError(f"A server is already listening on {address}")
+                except OSError:
+                    os.remove(bind_address)
+            server_class = type('Server', (socketserver.ThreadingMixIn, socketserver.UnixStreamServer), {'daemon_threads': True})
+        else:
+            server_class = type('Server', (socketserver.ThreadingMixIn, socketserver.TCPServer),
+                                {'daemon_threads': True, 'allow_reuse_address': True})
+        # The Unix socket is created accessible to its owner only, without a window of default permissions
+        umask = os.umask(0o177) if family == socket.AF_UNIX else None
+        try:
+            self._server = server_class(bind_address, Handler)
+        finally:
+            if umask is not None:
+                os.umask(umask)
+        with self._server:
+            print(f"Serving on {address}", flush=True)
+            try:
+                self._server.serve_forever()
+            finally:
+                if family == socket.AF_UNIX and os.path.exists(bind_address):
+                    os.remove(bind_address)
+                for job in self.jobs.values():
+                    job.cancel_event.set()
+                self._queue.put(None)
+                self._runner.join()
+                self.cache.close()
+
+class ServerClient:
+    """Thin client of a JobServer."""
+
+    def __init__(self, address, timeout=None):
+        import socket
+        family, connect_address = parse_address(address)
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(connect_address)
+        self._file = self._socket.makefile('rwb')
+        self._next_id = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def call(self, method, **params):
+        """Call a server method and return its result. Raises ServerError if the server reports an error."""
+        import json
+        self._file.write(json.dumps({'jsonrpc': '2.0', 'id': self._next_id, 'method': method, 'params': params}).encode('utf-8') + b'\n')
+        self._file.flush()
+        self._next_id += 1
+        line = self._file.readline()
+        if not line:
+            raise ServerError("The server closed the connection")
+        response = json.loads(line)
+        if 'error' in response:
+            raise ServerError(response['error']['message'])
+        return response['result']
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+def run_remote(address, operation, input_folder, output_folder, options=None, cancel=None):
+    """Run a job on the server at address and follow it, passing its messages and progress on to the
+    current reporter. Setting the cancel event cancels the job. Returns the job's final status."""
+    with ServerClient(address) as client:
+        status = client.call('submit', operation=operation, input_folder=os.path.abspath(input_folder),
+                             output_folder=os.path.abspath(output_folder), options=options or {})
+        job, since, cancelled = status['job'], 0, False
+        while True:
+            try:
+                status = client.call('wait', job=job, timeout=PROGRESS_INTERVAL, since=since)
+            except KeyboardInterrupt:
+                # Cancel the job on the server and follow it until it has stopped
+                if cancelled:
+                    raise
+                client.call('cancel', job=job)
+                cancelled = True
+                continue
+            for kind, text in status['messages']:
+                (reporter.error if kind == 'error' else reporter.message)(text)
+            since = status['message_count']
+            if status['state'] in ('done', 'failed', 'cancelled'):
+                return status
+            if status['stats']:
+                reporter.emit('progress', **status['stats'])
+            if cancel is not None and cancel.is_set() and not cancelled:
+                client.call('cancel', job=job)
+                cancelled = True
+# ----------------------------------------------------------------
+
+# Main CLI function ----------------------------------------------
+def parse_coordinates(value, count):
+    """Parse count comma-separated numbers, e.g. "47.37,8.54"."""
+    parts = value.split(',')
+    if len(parts) != count:
+        raise ValueError(f"Expected {count} comma-separated numbers, got '{value}'")
+    try:
+        return tuple(float(part) for part in parts)
+    except ValueError:
+        raise ValueError(f"Invalid number in '{value}'") from None
+
+def query_main(argv):
+    """The query subcommand: print the images in a metadata cache that match a time range and area."""
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(
+        prog='exif_tool.py query',
+        description=(
+            "Find images by time and location in a metadata cache written with --cache, without reading them.\n"
+            "Conditions are combined; images are printed in order of their EXIF DateTime."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=(
+            "Example usage:\n"
+            "  Photos of one day:\n"
+            "    python exif_tool.py query cache.db --from 2023-05-01 --to 2023-05-01\n\n"
+            "  Photos within 2 km of a point, as JSON, after adding new images of a folder to the cache:\n"
+            "    python exif_tool.py query cache.db photos -r --update --near 47.3769,8.5417 --radius 2km --json\n"
+        )
+    )
+    parser.add_argument(
+        'cache', 
+        type=str, 
+        help='Path to the SQLite metadata cache.'
+    )
+    parser.add_argument(
+        'folder', 
+        type=str, 
+        nargs='?', 
+        help='Only return images below this folder.'
+    )
+    parser.add_argument(
+        '--update', 
+        action='store_true', 
+        help='Scan the folder first and add new or changed images to the cache.'
+    )
+    parser.add_argument(
+        '-r', '--recursive', 
+        action='store_true', 
+        help='With --update, scan subfolders recursively.'
+    )
+    parser.add_argument(
+        '-j', '--jobs', 
+        type=int, 
+        default=1, 
+        help='With --update, number of files to read EXIF data from in parallel (default: 1).'
+    )
+    parser.add_argument(
+        '--from', 
+        dest='start', 
+        metavar='DATE', 
+        help='Only images taken at or after DATE (e.g., "2023", "2023-05", "2023-05-01", "2023-05-01 12:00").'
+    )
+    parser.add_argument(
+        '--to', 
+        dest='end', 
+        metavar='DATE', 
+        help='Only images taken at or before DATE; a year, month or day includes all of it.'
+    )
+    parser.add_argument(
+        '--bbox', 
+        metavar='SOUTH,WEST,NORTH,EAST', 
+        help='Only images within this bounding box in degrees (WEST > EAST crosses the antimeridian).'
+    )
+    parser.add_argument(
+        '--near', 
+        metavar='LAT,LON', 
+        help='Only images within --radius of this point.'
+    )
+    parser.add_argument(
+        '--radius', 
+        type=str, 
+        help='Radius for --near (e.g., "500m", "2km", "1mi").'
+    )
+    parser.add_argument(
+        '--json', 
+        action='store_true', 
+        help='Print one JSON object per image (path, datetime, lat, lon, size) instead of paths.'
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        start = parse_query_time(args.start) if args.start else None
+        end = parse_query_time(args.end, end=True) if args.end else None
+        bbox = parse_coordinates(args.bbox, 4) if args.bbox else None
+        near = parse_coordinates(args.near, 2) if args.near else None
+        radius = parse_radius(args.radius) if args.radius else None
+    except ValueError as e:
+        parser.error(str(e))
+    if near is not None and radius is None:
+        parser.error("--near requires --radius.")
+    if args.update and not args.folder:
+        parser.error("--update requires a folder.")
+    if args.folder and not os.path.isdir(args.folder):
+        parser.error(f"Folder '{args.folder}' does not exist.")
+    if not args.update and not os.path.isfile(args.cache):
+        parser.error(f"Cache '{args.cache}' does not exist; create it with --cache or --update.")
+
+    with MetadataCache(args.cache) as cache:
+        if args.update:
+            with create_executor(args.jobs) as executor:
+                for _ in extract_metadata_batch(scan_images(args.folder, args.recursive, cache, args.jobs), executor, cache):
+                    pass
+        for info in query(cache, start, end, bbox, near, radius, args.folder):
+            if args.json:
+                lat, lon = info.coordinates or (None, None)
+                print(json.dumps({'path': info.path, 'datetime': info.datetime.isoformat() if info.datetime else None,
+                                  'lat': lat, 'lon': lon, 'size': info.size}))
+            else:
+                print(info.path)
+
+def merge_main(argv):
+    """The merge subcommand: combine the partial manifests of all shards of a run and execute or plan it."""
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='exif_tool.py merge',
+        description=(
+            "Combine the partial manifests written by the --shard K/N runs of one --rename or --group run.\n"
+            "The placements are planned again from all shards' metadata, resolving rename collisions and\n"
+            "groups across shards like a single run, and then executed into the run's output folder."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=(
+            "Example usage:\n"
+            "  Extract in two shards, then merge and execute:\n"
+            "    python exif_tool.py input_folder output_folder --group --radius 1km --shard 1/2 --plan part1.jsonl\n"
+            "    python exif_tool.py input_folder output_folder --group --radius 1km --shard 2/2 --plan part2.jsonl\n"
+            "    python exif_tool.py merge part1.jsonl part2.jsonl\n"
+        )
+    )
+    parser.add_argument(
+        'partials', 
+        nargs='+', 
+        metavar='PARTIAL', 
+        help='Partial manifests of all shards.'
+    )
+    parser.add_argument(
+        '--plan', 
+        type=str, 
+        metavar='PLAN', 
+        help='Write the merged placements to a plan manifest for --apply instead of executing them.'
+    )
+    parser.add_argument(
+        '-m', '--mode', 
+        choices=PLACEMENT_MODES, 
+        default='copy', 
+        help='How images are placed in the output folder (default: copy).'
+    )
+    parser.add_argument(
+        '--copy-workers', 
+        type=int, 
+        default=1, 
+        help='Number of files to place in the output folder concurrently (default: 1).'
+    )
+    parser.add_argument(
+        '--fsync', 
+        action='store_true', 
+        help='Flush written files and folders to disk, batched per folder.'
+    )
+    parser.add_argument(
+        '--stats', 
+        action='store_true', 
+        help='Print timing and throughput statistics after the run.'
+    )
+    args = parser.parse_args(argv)
+
+    for path in args.partials:
+        if not os.path.isfile(path):
+            parser.error(f"Partial manifest '{path}' does not exist.")
+    if args.copy_workers < 1:
+        parser.error(f"--copy-workers must be at least 1, got {args.copy_workers}.")
+
+    stats = RunStats()
+    try:
+        placement = merge_run(args.partials, args.mode, args.copy_workers, args.fsync, args.plan, stats)
+    except (OSError, ValueError) as e:
+        reporter.error(f"Error: {e}")
+        return
+    reporter.message(placement.summary())
+    if args.stats:
+        for line in stats.summary_lines():
+            reporter.message(line)
+
+def main():
+    if sys.argv[1:2] == ['query']:
+        return query_main(sys.argv[2:])
+    if sys.argv[1:2] == ['merge']:
+        return merge_main(sys.argv[2:])
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description=(
+            "A command-line tool to process images using EXIF data.\n\n"
+            "Features:\n"
+            "  1. Rename images based on their EXIF date-time metadata.\n"
+            "  2. Group images into folders by their GPS coordinates from EXIF data.\n"
+            "  Operations are mutually exclusive: use either --rename or --group, not both."
+        ),
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=(
+            "Example usage:\n"
+            "  Rename images based on EXIF DateTime:\n"
+            "    python exif_tool.py input_folder output_folder --rename\n\n"
+            "  Group images by GPS location:\n"
+            "    python exif_tool.py input_folder output_folder --group --radius 1000m\n\n"
+            "  Cluster images by GPS location independently of file order:\n"
+            "    python exif_tool.py input_folder output_folder --group --radius 1000m --cluster dbscan\n\n"
+            "  Group images into events separated by more than two hours:\n"
+            "    python exif_tool.py input_folder output_folder --group --group-by time --gap 2h\n\n"
+            "  Plan a run without touching the output folder, then execute the plan:\n"
+            "    python exif_tool.py input_folder output_folder --rename --plan plan.jsonl\n"
+            "    python exif_tool.py --apply plan.jsonl\n\n"
+            "  Find images in a metadata cache by time and location (see exif_tool.py query --help):\n"
+            "    python exif_tool.py query cache.db --from 2023-05-01 --to 2023-05-31 --near 47.37,8.54 --radius 2km\n"
+        )
+    )
+    
+    parser.add_argument(
+        'input_folder', 
+        type=str, 
+        nargs='?', 
+        help='Path to the input folder containing images (not used with --apply).'
+    )
+    parser.add_argument(
+        'output_folder', 
+        type=str, 
+        nargs='?', 
+        help='Path to the output folder where processed images will be saved (not used with --apply).'
+    )
+    parser.add_argument(
+        '-r', '--recursive', 
+        action='store_true', 
+        help='Process subfolders recursively.'
+    )
+    parser.add_argument(
+        '--max-depth', 
+        type=int, 
+        help='Maximum folder depth to recurse into with --recursive (0 is the input folder only).'
+    )
+    parser.add_argument(
+        '--include', 
+        action='append', 
+        metavar='GLOB', 
+        help='Only process images whose name or relative path matches this glob (can be repeated).'
+    )
+    parser.add_argument(
+        '--exclude', 
+        action='append', 
+        metavar='GLOB', 
+        help='Skip images and folders whose name or relative path matches this glob (can be repeated).'
+    )
+    parser.add_argument(
+        '-n', '--rename', 
+        action='store_true', 
+        help='Rename images based on their EXIF DateTime information.'
+    )
+    parser.add_argument(
+        '-f', '--format', 
+        type=str, 
+        default="%Y-%m-%d_%H-%M-%S", 
+        help='Specify the date format for renaming and for event folders (default: "%%Y-%%m-%%d_%%H-%%M-%%S").'
+    )
+    parser.add_argument(
+        '--on-collision', 
+        choices=COLLISION_MODES, 
+        default='suffix', 
+        help=('What to do when renamed images get the same name (default: suffix).\n'
+              '  suffix: append _1, _2, ... in scan order.\n'
+              '  subsec: append the SubSecTimeOriginal of the later image (e.g. .25), then _1, _2, ...\n'
+              '  overwrite: the later image replaces the earlier one.')
+    )
+    parser.add_argument(
+        '-g', '--group', 
+        action='store_true', 
+        help='Group images into folders based on GPS coordinates from EXIF data.'
+    )
+    parser.add_argument(
+        '--radius', 
+        type=str, 
+        help='Specify the radius (e.g., "1000m", "1km", "0.5mi") to group images by location.'
+    )
+    parser.add_argument(
+        '--group-by', 
+        choices=GROUP_BY_MODES, 
+        default='location', 
+        help=('What to group images by with --group (default: location).\n'
+              '  location: images with GPS coordinates, within the radius.\n'
+              '  time: images with an EXIF DateTime, into events split at gaps longer than --gap.\n'
+              '  space-time: events by time, each grouped by location within the radius.')
+    )
+    parser.add_argument(
+        '--gap', 
+        type=str, 
+        default='2h', 
+        help='Time between two images (e.g., "30min", "2h", "1d") that starts a new event (default: 2h).'
+    )
+    parser.add_argument(
+        '--cluster', 
+        choices=CLUSTER_METHODS, 
+        help=('Grouping method (default: greedy).\n'
+              '  greedy: each image joins the first group within the radius, in file order.\n'
+              '  dbscan: density-based clustering with the radius as epsilon, independent of file order.')
+    )
+    parser.add_argument(
+        '--min-samples', 
+        type=int, 
+        default=1, 
+        help='Minimum number of images within the radius to form a DBSCAN cluster (default: 1).'
+    )
+    parser.add_argument(
+        '--global', 
+        dest='across_folders', 
+        action='store_true', 
+        help=('Group the images of all folders together instead of each folder separately (requires --radius).\n'
+              'Groups are found like --cluster dbscan --min-samples 1, spilled to temporary files so memory\n'
+              'stays bounded, and each group folder holds its images under their original relative paths.')
+    )
+    parser.add_argument(
+        '--places', 
+        type=str, 
+        metavar='FILE', 
+        help=('Name group folders after the nearest place in FILE, a GeoNames dump (e.g. cities1000.txt) or a CSV\n'
+              'with name, latitude and longitude columns. Works offline; the place index is saved as FILE.idx.')
+    )
+    parser.add_argument(
+        '-m', '--mode', 
+        choices=PLACEMENT_MODES, 
+        default='copy', 
+        help=('How images are placed in the output folder (default: copy).\n'
+              '  hardlink, reflink and symlink fall back to copy where the filesystem does not support them.\n'
+              '  move removes the images from the input folder.')
+    )
+    parser.add_argument(
+        '--dedupe', 
+        choices=DEDUPE_ACTIONS, 
+        help=('Find images with identical content and place only the first of each.\n'
+              '  skip: leave the duplicates out of the output folder.\n'
+              '  link: hard link the duplicates to the first copy in the output folder.\n'
+              '  Hashes are kept in the --cache for later runs.')
+    )
+    parser.add_argument(
+        '--copy-workers', 
+        type=int, 
+        default=1, 
+        help='Number of files to place in the output folder concurrently (default: 1).'
+    )
+    parser.add_argument(
+        '--fsync', 
+        action='store_true', 
+        help='Flush written files and folders to disk, batched per folder.'
+    )
+    parser.add_argument(
+        '-j', '--jobs', 
+        type=int, 
+        default=1, 
+        help='Number of files to read EXIF data from in parallel (default: 1).'
+    )
+    parser.add_argument(
+        '--cache', 
+        type=str, 
+        help='Path to a SQLite metadata cache reused across runs to skip unchanged files.'
+    )
+    parser.add_argument(
+        '--cache-compact', 
+        action='store_true', 
+        help='Remove cache entries of deleted files and shrink the cache after the run.'
+    )
+    parser.add_argument(
+        '--plan', 
+        type=str, 
+        metavar='PLAN', 
+        help='Dry run: write the planned placements to a JSON Lines manifest instead of touching the output folder.'
+    )
+    parser.add_argument(
+        '--apply', 
+        type=str, 
+        metavar='PLAN', 
+        help='Execute a plan written with --plan. Interrupted runs resume from the journal next to the plan.'
+    )
+    parser.add_argument(
+        '--shard', 
+        type=str, 
+        metavar='K/N', 
+        help=('Only process the K-th of N shards of the input images, chosen by a hash of their relative path,\n'
+              'and write their metadata and placements to the partial manifest given with --plan. Combine the\n'
+              'partial manifests of all N shards with: exif_tool.py merge PARTIAL...')
+    )
+    parser.add_argument(
+        '--watch', 
+        action='store_true', 
+        help=('Keep running after processing the input folder and process new or changed images as they\n'
+              'appear, using inotify where available. Stop with Ctrl+C.')
+    )
+    parser.add_argument(
+        '--settle', 
+        type=float, 
+        default=WATCH_SETTLE_SECONDS, 
+        help=f'With --watch, seconds an image must stay unchanged before it is processed (default: {WATCH_SETTLE_SECONDS:g}).'
+    )
+    parser.add_argument(
+        '--poll', 
+        type=float, 
+        metavar='SECONDS', 
+        help=f'With --watch, rescan the input folder every SECONDS instead of using inotify\n'
+             f'(inotify falls back to polling every {WATCH_POLL_INTERVAL:g}s where it is not available).'
+    )
+    parser.add_argument(
+        '--serve', 
+        type=str, 
+        metavar='ADDRESS', 
+        help=('Run a job server on a Unix socket path or a [host:]port on localhost, keeping a warm thread pool\n'
+              '(-j threads) and metadata cache (in memory, or --cache) for the jobs it runs.')
+    )
+    parser.add_argument(
+        '--server', 
+        type=str, 
+        metavar='ADDRESS', 
+        help='Run the --rename or --group job on the job server at ADDRESS instead of in this process.'
+    )
+    parser.add_argument(
+        '--stats', 
+        action='store_true', 
+        help='Print per-stage timing, throughput, cache and error statistics after the run.'
+    )
+    parser.add_argument(
+        '--progress', 
+        choices=['text', 'json'], 
+        help=('Report progress while running.\n'
+              '  text: periodic progress lines.\n'
+              '  json: one JSON event per line on stdout (start, progress, message, error, done),\n'
+              '        with the run statistics in the done event.')
+    )
+    
+    args = parser.parse_args()
+    set_reporter(Reporter(args.progress))
+    if args.across_folders and (args.cluster == 'greedy' or args.min_samples != 1):
+        parser.error("--global always groups like --cluster dbscan --min-samples 1, "
+                     "so it cannot be combined with --cluster greedy or another --min-samples.")
+    args.cluster = args.cluster or 'greedy'
+
+    if args.apply:
+        if not os.path.exists(args.apply):
+            reporter.error(f"Error: Plan '{args.apply}' does not exist.")
+            return
+        reporter.message(f"Applying plan {args.apply}...")
+        try:
+            placement, skipped = apply_plan(args.apply, args.copy_workers, args.fsync)
+        except ValueError as e:
+            reporter.error(str(e))
+            return
+        reporter.message(f"Skipped {skipped} placements already done.")
+        reporter.message(placement.summary())
+        return
+
+    if args.serve:
+        server = JobServer(args.jobs if args.jobs > 1 else (os.cpu_count() or 4), args.cache)
+        try:
+            server.serve(args.serve)
+        except (OSError, ServerError) as e:
+            print(f"Error: {e}")
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if not args.input_folder or not args.output_folder:
+        parser.error("input_folder and output_folder are required unless --apply or --serve is used.")
+
+    if not os.path.exists(args.input_folder):
+        reporter.error(f"Error: Input folder '{args.input_folder}' does not exist.")
+        return
+    
+    if args.jobs < 1:
+        reporter.error(f"Error: --jobs must be at least 1, got {args.jobs}.")
+        return
+
+    if args.copy_workers < 1:
+        reporter.error(f"Error: --copy-workers must be at least 1, got {args.copy_workers}.")
+        return
+
+    if not args.plan:
+        os.makedirs(args.output_folder, exist_ok=True)
+
+    radius_in_meters = None
+    if args.radius:
+        try:
+            radius_in_meters = parse_radius(args.radius)
+        except ValueError as e:
+            reporter.error(str(e))
+            return
+
+    try:
+        gap_in_seconds = parse_duration(args.gap)
+    except ValueError as e:
+        reporter.error(str(e))
+        return
+
+    if args.cluster == 'dbscan' and radius_in_meters is None:
+        reporter.error("Error: --cluster dbscan requires --radius.")
+        return
+
+    if not (args.rename or args.group):
+        reporter.error("No operation specified. Use --rename or --group.")
+        return
+
+    if args.watch and (args.plan or args.dedupe or args.cluster != 'greedy' or args.group_by != 'location'
+                       or args.across_folders):
+        reporter.error("Error: --watch cannot be combined with --plan, --dedupe, --cluster dbscan, --global "
+                       "or --group-by time/space-time.")
+        return
+
+    if args.across_folders and (radius_in_meters is None or args.group_by != 'location'):
+        reporter.error("Error: --global requires --radius and cannot be combined with --group-by time/space-time.")
+        return
+
+    if args.places and not os.path.isfile(args.places):
+        reporter.error(f"Error: Place list '{args.places}' does not exist.")
+        return
+
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            reporter.error(str(e))
+            return
+        if not args.plan or args.dedupe or args.server:
+            reporter.error("Error: --shard requires --plan and cannot be combined with --dedupe or --server.")
+            return
+
+    if args.server:
+        if args.watch:
+            reporter.error("Error: --watch cannot be combined with --server.")
+            return
+        options = {'recursive': args.recursive, 'jobs': args.jobs, 'mode': args.mode, 'copy_workers': args.copy_workers,
+                   'fsync': args.fsync, 'plan_path': os.path.abspath(args.plan) if args.plan else None,
+                   'include': args.include, 'exclude': args.exclude, 'max_depth': args.max_depth, 'dedupe': args.dedupe}
+        if args.rename:
+            options.update(date_format=args.format, on_collision=args.on_collision)
+        else:
+            options.update(radius=radius_in_meters, cluster=args.cluster, min_samples=args.min_samples,
+                           gazetteer=os.path.abspath(args.places) if args.places else None, group_by=args.group_by,
+                           gap=gap_in_seconds, date_format=args.format, across_folders=args.across_folders)
+        reporter.emit('start', operation='rename' if args.rename else 'group',
+                      input_folder=os.path.abspath(args.input_folder), output_folder=os.path.abspath(args.output_folder))
+        try:
+            status = run_remote(args.server, 'rename' if args.rename else 'group', args.input_folder,
+                                args.output_folder, options)
+        except (OSError, ServerError) as e:
+            reporter.error(f"Error: {e}")
+            return
+        if status['state'] == 'failed':
+            reporter.error(f"Error running the job: {status['error']}")
+        elif status['state'] == 'cancelled':
+            reporter.message("Cancelled.")
+        if args.stats and status['stats'] and args.progress != 'json':
+            for line in stats_lines(status['stats']):
+                reporter.message(line)
+        reporter.emit('done', **(status['stats'] or {}))
+        return
+
+    gazetteer = None
+    if args.places and args.group:
+        try:
+            gazetteer = Gazetteer.load(args.places)
+        except (OSError, ValueError) as e:
+            reporter.error(f"Error loading place list '{args.places}': {e}")
+            return
+
+    stats = RunStats()
+    reporter.emit('start', operation='rename' if args.rename else 'group',
+                  input_folder=os.path.abspath(args.input_folder), output_folder=os.path.abspath(args.output_folder))
+    cache = MetadataCache(args.cache) if args.cache else None
+    try:
+        if args.watch:
+            if args.rename:
+                plan_stage = partial(plan_rename, input_folder=args.input_folder, output_folder=args.output_folder,
+                                     date_format=args.format, on_collision=args.on_collision,
+                                     names=NameIndex(track_sources=True, sources_root=args.input_folder))
+            else:
+                plan_stage = partial(plan_group_incremental, input_folder=args.input_folder,
+                                     output_folder=args.output_folder, radius=radius_in_meters, groupings={},
+                                     namer=GroupNamer(gazetteer))
+            try:
+                placement = watch_folder(args.input_folder, args.output_folder, plan_stage, args.recursive, args.jobs, cache,
+                                         args.mode, args.copy_workers, args.fsync, stats, None, args.include,
+                                         args.exclude, args.max_depth, args.settle, args.poll or WATCH_POLL_INTERVAL,
+                                         polling=args.poll is not None)
+            except KeyboardInterrupt:
+                placement = stats.placement
+            if placement is not None:
+                reporter.message(placement.summary())
+
+        elif args.rename:
+            reporter.message("Renaming images by EXIF date-time...")
+            placement = rename_images_by_datetime(args.input_folder, args.output_folder, args.format, args.recursive, args.jobs,
+                                                  cache, args.mode, args.copy_workers, args.fsync, args.plan, stats,
+                                                  include=args.include, exclude=args.exclude, max_depth=args.max_depth,
+                                                  on_collision=args.on_collision, dedupe=args.dedupe, shard=shard)
+            reporter.message(placement.summary())
+        
+        else:
+            grouped_by = {'location': "location", 'time': "time", 'space-time': "time and location"}[args.group_by]
+            reporter.message(f"Grouping images by {grouped_by}...")
+            placement = group_images_by_location(args.input_folder, args.output_folder, args.recursive, radius_in_meters,
+                                                 args.jobs, cache, args.cluster, args.min_samples, args.mode,
+                                                 args.copy_workers, args.fsync, args.plan, stats,
+                                                 include=args.include, exclude=args.exclude, max_depth=args.max_depth,
+                                                 dedupe=args.dedupe, gazetteer=gazetteer, group_by=args.group_by,
+                                                 gap=gap_in_seconds, date_format=args.format,
+                                                 across_folders=args.across_folders, shard=shard)
+            reporter.message(placement.summary())
+    finally:
+        if cache:
+            if args.cache_compact:
+                cache.compact()
+            reporter.message(cache.summary())
+            cache.close()
+
+    if args.stats and args.progress != 'json':
+        for line in stats.summary_lines():
+            reporter.message(line)
+    reporter.emit('done', **stats.summary())
 
 # ----------------------------------------------------------------
 
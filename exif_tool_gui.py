@@ -1,8 +1,13 @@
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import filedialog
-import subprocess
+import os
+import threading
+import queue
 import datetime
+from collections import deque
+
+import exif_tool
 
 class ExifToolGUI:
     def __init__(self, root):
@@ -38,10 +43,14 @@ class ExifToolGUI:
         # Group Tab Widgets
         self.create_group_widgets()
 
+        # Progress
+        self.create_progress_widgets()
+
         # Log Console
         self.console_output = ctk.CTkTextbox(self.root, wrap="word", height=15, state='disabled')
         self.console_output.grid(row=5, column=0, columnspan=3, padx=10, pady=5, sticky='nsew')
         self.console_output.bind("<Button-3>", self.show_context_menu)
+        self.console_log = ConsoleLog(self.root, self.console_output)
 
         # Grid configuration
         self.root.grid_rowconfigure(5, weight=1)
@@ -49,6 +58,13 @@ class ExifToolGUI:
         self.root.grid_columnconfigure(1, weight=1)
         self.root.grid_columnconfigure(2, weight=1)
 
+        self.events = queue.Queue()
+        self.worker = None
+        self.cancel_event = None
+        # Jobs are sent to the job server at this address (see exif_tool.py --serve) instead of running in-process
+        self.server_address = os.environ.get('EXIF_TOOL_SERVER')
+        self.poll_events()
+
     def create_folder_widgets(self):
         self.input_folder_var = ctk.StringVar()
         self.input_folder_entry = ctk.CTkEntry(self.root, textvariable=self.input_folder_var, width=300)
@@ -65,6 +81,21 @@ class ExifToolGUI:
         ctk.CTkLabel(self.root, text="Input Folder:").grid(row=0, column=0, sticky="w", padx=10, pady=5)
         ctk.CTkLabel(self.root, text="Output Folder:").grid(row=1, column=0, sticky="w", padx=10, pady=5)
 
+    def create_progress_widgets(self):
+        self.progress_frame = ctk.CTkFrame(self.root, fg_color="transparent")
+        self.progress_frame.grid(row=4, column=0, columnspan=3, padx=10, pady=5, sticky='ew')
+        self.progress_frame.grid_columnconfigure(0, weight=1)
+
+        self.progress_bar = ctk.CTkProgressBar(self.progress_frame, mode="indeterminate")
+        self.progress_bar.grid(row=0, column=0, padx=(0, 10), sticky='ew')
+        self.progress_bar.set(0)
+
+        self.progress_label = ctk.CTkLabel(self.progress_frame, text="Idle")
+        self.progress_label.grid(row=0, column=1, padx=10)
+
+        self.cancel_button = ctk.CTkButton(self.progress_frame, text="Cancel", command=self.cancel_job, state='disabled', width=80)
+        self.cancel_button.grid(row=0, column=2)
+
     def create_rename_widgets(self):
         self.recursive_var = ctk.BooleanVar()
         self.recursive_checkbox = ctk.CTkCheckBox(self.rename_tab, text="Process recursively (-r)", variable=self.recursive_var)
@@ -75,8 +106,18 @@ class ExifToolGUI:
         self.date_format_entry = ctk.CTkEntry(self.rename_tab, textvariable=self.date_format_var, width=300)
         self.date_format_entry.grid(row=1, column=1, padx=10, pady=5)
 
+        ctk.CTkLabel(self.rename_tab, text="Parallel Jobs (-j):").grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        self.jobs_var = ctk.StringVar(value="1")
+        self.jobs_entry = ctk.CTkEntry(self.rename_tab, textvariable=self.jobs_var, width=300)
+        self.jobs_entry.grid(row=2, column=1, padx=10, pady=5)
+
+        ctk.CTkLabel(self.rename_tab, text="Placement Mode:").grid(row=3, column=0, sticky="w", padx=10, pady=5)
+        self.mode_var = ctk.StringVar(value="copy")
+        self.mode_menu = ctk.CTkOptionMenu(self.rename_tab, variable=self.mode_var, values=exif_tool.PLACEMENT_MODES)
+        self.mode_menu.grid(row=3, column=1, sticky="w", padx=10, pady=5)
+
         self.run_rename_button = ctk.CTkButton(self.rename_tab, text="Run Rename", command=self.run_rename_tool)
-        self.run_rename_button.grid(row=2, column=0, columnspan=2, pady=10)
+        self.run_rename_button.grid(row=4, column=0, columnspan=2, pady=10)
 
     def create_group_widgets(self):
         self.recursive_var_group = ctk.BooleanVar()
@@ -88,8 +129,23 @@ class ExifToolGUI:
         self.radius_entry = ctk.CTkEntry(self.group_tab, textvariable=self.radius_var, width=300)
         self.radius_entry.grid(row=1, column=1, padx=10, pady=5)
 
+        ctk.CTkLabel(self.group_tab, text="Parallel Jobs (-j):").grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        self.jobs_var_group = ctk.StringVar(value="1")
+        self.jobs_entry_group = ctk.CTkEntry(self.group_tab, textvariable=self.jobs_var_group, width=300)
+        self.jobs_entry_group.grid(row=2, column=1, padx=10, pady=5)
+
+        ctk.CTkLabel(self.group_tab, text="Clustering Method:").grid(row=3, column=0, sticky="w", padx=10, pady=5)
+        self.cluster_var = ctk.StringVar(value="greedy")
+        self.cluster_menu = ctk.CTkOptionMenu(self.group_tab, variable=self.cluster_var, values=exif_tool.CLUSTER_METHODS)
+        self.cluster_menu.grid(row=3, column=1, sticky="w", padx=10, pady=5)
+
+        ctk.CTkLabel(self.group_tab, text="Placement Mode:").grid(row=4, column=0, sticky="w", padx=10, pady=5)
+        self.mode_var_group = ctk.StringVar(value="copy")
+        self.mode_menu_group = ctk.CTkOptionMenu(self.group_tab, variable=self.mode_var_group, values=exif_tool.PLACEMENT_MODES)
+        self.mode_menu_group.grid(row=4, column=1, sticky="w", padx=10, pady=5)
+
         self.run_group_button = ctk.CTkButton(self.group_tab, text="Run Group", command=self.run_group_tool)
-        self.run_group_button.grid(row=2, column=0, columnspan=2, pady=10)
+        self.run_group_button.grid(row=5, column=0, columnspan=2, pady=10)
 
     def browse_input_folder(self):
         folder_selected = filedialog.askdirectory()
@@ -106,74 +162,274 @@ class ExifToolGUI:
         output_folder = self.output_folder_var.get()
         date_format = self.date_format_var.get()
         recursive = self.recursive_var.get()
+        jobs = self.parse_jobs(self.jobs_var.get())
+        mode = self.mode_var.get()
 
         if not input_folder or not output_folder:
             self.log_console("Error: Please select both input and output folders.\n", error=True)
             return
+        if jobs is None:
+            return
 
-        command = ["python", "./exif_tool.py", input_folder, output_folder, "--rename"]
-        if recursive:
-            command.append("--recursive")
-        if date_format:
-            command.extend(["--format", date_format])
-
-        self.execute_command(command)
+        self.start_job("Renaming images by EXIF date-time", exif_tool.rename_images_by_datetime,
+                       input_folder, output_folder, date_format=date_format or "%Y-%m-%d_%H-%M-%S",
+                       recursive=recursive, jobs=jobs, mode=mode)
 
     def run_group_tool(self):
         input_folder = self.input_folder_var.get()
         output_folder = self.output_folder_var.get()
         radius = self.radius_var.get()
         recursive = self.recursive_var_group.get()
+        jobs = self.parse_jobs(self.jobs_var_group.get())
+        cluster = self.cluster_var.get()
+        mode = self.mode_var_group.get()
 
         if not input_folder or not output_folder:
             self.log_console("Error: Please select both input and output folders.\n", error=True)
             return
+        if jobs is None:
+            return
 
-        command = ["python", "./exif_tool.py", input_folder, output_folder, "--group"]
-        if recursive:
-            command.append("--recursive")
+        radius_in_meters = None
         if radius:
-            command.extend(["--radius", radius])
+            try:
+                radius_in_meters = exif_tool.parse_radius(radius)
+            except ValueError as e:
+                self.log_console(f"Error: {e}\n", error=True)
+                return
+        if cluster == "dbscan" and radius_in_meters is None:
+            self.log_console("Error: DBSCAN clustering requires a GPS radius.\n", error=True)
+            return
 
-        self.execute_command(command)
+        self.start_job("Grouping images by location", exif_tool.group_images_by_location,
+                       input_folder, output_folder, recursive=recursive, radius=radius_in_meters,
+                       jobs=jobs, cluster=cluster, mode=mode)
 
-    def execute_command(self, command):
-        self.log_console(f"Running command: {' '.join(command)}\n")
+    def parse_jobs(self, jobs):
+        try:
+            jobs = int(jobs or 1)
+        except ValueError:
+            jobs = 0
+        if jobs < 1:
+            self.log_console("Error: Parallel jobs must be a whole number of at least 1.\n", error=True)
+            return None
+        return jobs
+
+    def start_job(self, description, operation, input_folder, output_folder, **kwargs):
+        """Run an exif_tool operation on a background thread, or on the job server if one is configured;
+        its messages and progress events are posted to self.events and picked up by poll_events on the
+        Tk main thread."""
+        if self.worker is not None and self.worker.is_alive():
+            self.log_console("Error: A job is already running.\n", error=True)
+            return
+
+        where = f" on the job server at {self.server_address}" if self.server_address else ""
+        self.log_console(f"{self.current_time()} - {description}{where}...\n")
+        os.makedirs(output_folder, exist_ok=True)
+        self.cancel_event = threading.Event()
+        self.set_running(True)
+
+        def work():
+            stats = exif_tool.RunStats()
+            try:
+                if self.server_address:
+                    status = exif_tool.run_remote(self.server_address, REMOTE_OPERATIONS[operation], input_folder,
+                                                  output_folder, kwargs, self.cancel_event)
+                    if status['state'] == 'failed':
+                        self.events.put(('failed', status['error']))
+                    else:
+                        self.events.put((status['state'], status['stats']))
+                    return
+                operation(input_folder, output_folder, stats=stats, cancel=self.cancel_event, **kwargs)
+                self.events.put(('cancelled' if self.cancel_event.is_set() else 'done', stats.summary()))
+            except Exception as e:
+                self.events.put(('failed', str(e)))
+
+        exif_tool.set_reporter(QueueReporter(self.events, self.console_log))
+        self.worker = threading.Thread(target=work, daemon=True)
+        self.worker.start()
+
+    def cancel_job(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.progress_label.configure(text="Cancelling...")
+
+    def set_running(self, running):
+        state = 'disabled' if running else 'normal'
+        self.run_rename_button.configure(state=state)
+        self.run_group_button.configure(state=state)
+        self.cancel_button.configure(state='normal' if running else 'disabled')
+        if running:
+            self.progress_bar.configure(mode="indeterminate")
+            self.progress_bar.start()
+            self.progress_label.configure(text="Starting...")
+        else:
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate")
+            self.progress_bar.set(1)
+
+    def poll_events(self):
+        """Handle the events posted by the worker thread, then check again shortly."""
         try:
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
             while True:
-                output = process.stdout.readline()
-                if output:
-                    self.log_console(f"{self.current_time()} - {output.strip()}\n")
-                error = process.stderr.readline()
-                if error:
-                    self.log_console(f"{self.current_time()} - ERROR: {error.strip()}\n", error=True)
-                if process.poll() is not None:
-                    break
-            self.log_console(f"{self.current_time()} - Process completed.\n")
-        except Exception as e:
-            self.log_console(f"{self.current_time()} - Error running the tool: {e}\n", error=True)
+                event, payload = self.events.get_nowait()
+                if event == 'progress':
+                    self.show_progress(payload)
+                elif event == 'done':
+                    if payload:
+                        self.show_progress(payload)
+                    self.set_running(False)
+                    self.log_console(f"{self.current_time()} - Process completed.\n")
+                elif event == 'cancelled':
+                    if payload:
+                        self.show_progress(payload)
+                    self.set_running(False)
+                    self.progress_label.configure(text="Cancelled")
+                    placed = payload['files_placed'] if payload else 0
+                    self.log_console(f"{self.current_time()} - Process cancelled after placing {placed} files; "
+                                     f"the output folder is incomplete.\n", error=True)
+                elif event == 'failed':
+                    self.set_running(False)
+                    self.progress_label.configure(text="Failed")
+                    self.log_console(f"{self.current_time()} - Error running the tool: {payload}\n", error=True)
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_events)
+
+    def show_progress(self, stats):
+        elapsed = stats['elapsed']
+        rate = stats['files_extracted'] / elapsed if elapsed > 0 else 0.0
+        self.progress_label.configure(text=f"{stats['files_extracted']} files, {stats['files_placed']} placed, {rate:.0f} files/s")
 
     def log_console(self, message, error=False):
-        self.console_output.configure(state='normal')
-        self.console_output.insert(tk.END, message)
-        self.console_output.configure(state='disabled')
-        self.console_output.yview(tk.END)
-        if error:
-            self.root.bell()
+        self.console_log.write(message, error)
 
     def show_context_menu(self, event):
         context_menu = tk.Menu(self.root, tearoff=0)
         context_menu.add_command(label="Clear Console", command=self.clear_console)
+        if self.console_log.log_path:
+            context_menu.add_command(label="Stop Logging to File", command=self.console_log.close_log_file)
+        else:
+            context_menu.add_command(label="Log to File...", command=self.choose_log_file)
         context_menu.post(event.x_root, event.y_root)
 
+    def choose_log_file(self):
+        log_path = filedialog.asksaveasfilename(defaultextension=".log", filetypes=[("Log files", "*.log"), ("All files", "*.*")])
+        if log_path:
+            self.console_log.open_log_file(log_path)
+            self.log_console(f"{self.current_time()} - Logging to {log_path}\n")
+
     def clear_console(self):
-        self.console_output.configure(state='normal')
-        self.console_output.delete(1.0, tk.END)
-        self.console_output.configure(state='disabled')
+        self.console_log.clear()
 
     def current_time(self):
-        return datetime.datetime.now().strftime("%H:%M:%S")
+        return current_time()
+
+class ConsoleLog:
+    """Log sink for the console textbox that can be written to from any thread.
+
+    Lines are buffered and flushed to the widget at a fixed frame rate in a single insert. The widget keeps
+    only the most recent max_lines lines, and lines that pile up faster than they can be shown are dropped
+    from the buffer with a note. If a log file is open, every line is also written there in full."""
+
+    FLUSH_INTERVAL_MS = 100
+    MAX_LINES = 5000
+
+    def __init__(self, root, textbox, max_lines=MAX_LINES):
+        self.root = root
+        self.textbox = textbox
+        self.max_lines = max_lines
+        self.log_path = None
+        self._log_file = None
+        self._pending = deque(maxlen=max_lines - 1)  # Leaves room for the dropped lines note
+        self._dropped = 0
+        self._bell = False
+        self._lock = threading.Lock()
+        self.root.after(self.FLUSH_INTERVAL_MS, self.flush)
+
+    def write(self, message, error=False):
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(message)
+            self._bell = self._bell or error
+            if self._log_file:
+                self._log_file.write(message)
+
+    def flush(self):
+        """Move the buffered lines into the widget, then schedule the next flush."""
+        with self._lock:
+            pending, self._pending = self._pending, deque(maxlen=self.max_lines - 1)
+            dropped, self._dropped = self._dropped, 0
+            bell, self._bell = self._bell, False
+            if self._log_file:
+                self._log_file.flush()
+        if pending:
+            text = ''.join(pending)
+            if dropped:
+                text = f"... {dropped} lines not shown ...\n" + text
+            self.textbox.configure(state='normal')
+            self.textbox.insert(tk.END, text)
+            line_count = int(self.textbox.index('end-1c').split('.')[0])
+            if line_count > self.max_lines:
+                self.textbox.delete('1.0', f"{line_count - self.max_lines + 1}.0")
+            self.textbox.configure(state='disabled')
+            self.textbox.yview(tk.END)
+        if bell:
+            self.root.bell()
+        self.root.after(self.FLUSH_INTERVAL_MS, self.flush)
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._dropped = 0
+        self.textbox.configure(state='normal')
+        self.textbox.delete(1.0, tk.END)
+        self.textbox.configure(state='disabled')
+
+    def open_log_file(self, log_path):
+        with self._lock:
+            if self._log_file:
+                self._log_file.close()
+            self._log_file = open(log_path, 'a', encoding='utf-8')
+            self.log_path = log_path
+
+    def close_log_file(self):
+        with self._lock:
+            if self._log_file:
+                self._log_file.close()
+            self._log_file = None
+            self.log_path = None
+
+# Names of the operations on the job server
+REMOTE_OPERATIONS = {
+    exif_tool.rename_images_by_datetime: 'rename',
+    exif_tool.group_images_by_location: 'group',
+}
+
+class QueueReporter(exif_tool.Reporter):
+    """Reporter for jobs run by the GUI: messages and errors go straight to the console log, progress
+    events are handed to the Tk main thread through a queue."""
+
+    def __init__(self, events, console_log):
+        super().__init__()
+        self.events = events
+        self.console_log = console_log
+
+    def emit(self, event, **fields):
+        if event == 'progress':
+            self.events.put(('progress', fields))
+
+    def message(self, text):
+        self.console_log.write(f"{current_time()} - {text}\n")
+
+    def error(self, text):
+        with self._lock:
+            self.errors += 1
+        self.console_log.write(f"{current_time()} - ERROR: {text}\n", error=True)
+
+def current_time():
+    return datetime.datetime.now().strftime("%H:%M:%S")
 
 if __name__ == "__main__":
     root = ctk.CTk()
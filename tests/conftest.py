@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """A small reproducible corpus of JPEGs with DateTime and GPS tags in nested folders."""
+    root = tmp_path / 'corpus'
+    benchmark.generate_corpus(str(root), files=60, depth=1, fanout=2, spread=2000.0, seed=1)
+    return root
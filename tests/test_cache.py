@@ -0,0 +1,38 @@
+import os
+import sqlite3
+
+import exif_tool
+
+
+def cached_paths(cache_path):
+    with sqlite3.connect(cache_path) as conn:
+        return {path for path, in conn.execute("SELECT path FROM metadata")}
+
+
+def test_filtered_scan_keeps_cache_entries_of_other_images(corpus, tmp_path):
+    cache_path = str(tmp_path / 'cache.db')
+    with exif_tool.MetadataCache(cache_path) as cache:
+        exif_tool.rename_images_by_datetime(str(corpus), str(tmp_path / 'all'), "%Y-%m-%d_%H-%M-%S", recursive=True,
+                                            cache=cache, plan_path=str(tmp_path / 'all.jsonl'))
+    everything = cached_paths(cache_path)
+    assert len(everything) == 60
+
+    with exif_tool.MetadataCache(cache_path) as cache:
+        exif_tool.rename_images_by_datetime(str(corpus), str(tmp_path / 'some'), "%Y-%m-%d_%H-%M-%S", recursive=True,
+                                            cache=cache, plan_path=str(tmp_path / 'some.jsonl'),
+                                            include=['img000000*'], exclude=['img0000001*'])
+        assert cache.evicted == 0
+    assert cached_paths(cache_path) == everything
+
+
+def test_scan_evicts_deleted_images(corpus, tmp_path):
+    cache_path = str(tmp_path / 'cache.db')
+    with exif_tool.MetadataCache(cache_path) as cache:
+        list(exif_tool.extract(exif_tool.scan(str(corpus), recursive=True), cache=cache))
+    removed = next(corpus.rglob('*.jpg'))
+    os.remove(removed)
+
+    with exif_tool.MetadataCache(cache_path) as cache:
+        list(exif_tool.scan_images(str(corpus), recursive=True, cache=cache, include=['nothing*']))
+        assert cache.evicted == 1
+    assert str(removed) not in cached_paths(cache_path)
@@ -0,0 +1,43 @@
+import os
+from datetime import datetime
+
+import exif_tool
+
+
+RECORDS = [
+    (os.path.join('a', 'IMG_1.jpg'), '2021:06:01 10:00:00', (47.5, 8.25), 100, 1),
+    (os.path.join('a', 'café.jpg'), None, (-33.9, 151.2), 200, 2),
+    (os.path.join('a', 'bad\udcff.jpg'), '1969:12:31 23:59:59', None, 300, 3),
+    (os.path.join('b', 'IMG_2.jpg'), '', None, -1, -1),
+    (os.path.join('b', 'IMG_3.jpg'), '2038:01:19 03:14:08', (0.0, -180.0), 400, 4),
+]
+
+
+def test_catalog_returns_what_was_appended():
+    catalog = exif_tool.ImageCatalog()
+    for record in RECORDS:
+        catalog.append(*record[:3])
+    assert len(catalog) == len(RECORDS)
+    for i, (file_path, exif_datetime, gps_coordinates, _, _) in enumerate(RECORDS):
+        assert catalog.path(i) == file_path
+        assert catalog.name(i) == os.path.basename(file_path)
+        assert catalog.datetime(i) == exif_tool.parse_exif_datetime(exif_datetime)
+        assert catalog.coordinates(i) == gps_coordinates
+    assert list(catalog.located()) == [0, 1, 4]
+    assert list(catalog.dated()) == [0, 2, 4]
+    assert catalog.datetime(2) == datetime(1969, 12, 31, 23, 59, 59)
+
+
+def test_catalog_by_folder_keeps_order_and_splits_folders():
+    chunks = list(exif_tool.catalog_by_folder(RECORDS, max_rows=2))
+    assert [(root, len(catalog)) for root, catalog in chunks] == [('a', 2), ('a', 1), ('b', 2)]
+    assert [catalog.path(i) for _, catalog in chunks for i in range(len(catalog))] == [r[0] for r in RECORDS]
+
+
+def test_group_plan_matches_grouping_the_records(tmp_path):
+    records = [(os.path.join(str(tmp_path), 'in', f'img{i}.jpg'), None, (47.0 + i * 0.001, 8.0), 1, 1)
+               for i in range(20)]
+    plan = list(exif_tool.plan_group(iter(records), str(tmp_path / 'in'), str(tmp_path / 'out'), radius=250.0))
+    groups = exif_tool.group_coordinates_greedy([(r[0], r[2]) for r in records], 250.0)
+    assert len({os.path.dirname(dst) for _, dst in plan}) == len(groups) > 1
+    assert [src for src, _ in plan] == [file_path for _, files in groups for file_path in files]
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+import exif_tool
+
+
+def points(n=1200, seed=5):
+    """Images in a few dense clusters and scattered around them, in 20 folders."""
+    rng = random.Random(seed)
+    centres = [(47.0, 8.0), (47.001, 8.002), (-33.9, 151.2), (0.0, 179.9999)]
+    located = []
+    for i in range(n):
+        lat, lon = centres[i % len(centres)]
+        spread = 0.0005 if i % 3 else 0.02
+        coords = (lat + rng.uniform(-spread, spread), ((lon + rng.uniform(-spread, spread) + 180) % 360) - 180)
+        located.append((f"folder{i % 20}/img{i}.jpg", coords))
+    return located
+
+
+def global_groups(located, radius):
+    with exif_tool.GlobalGrouper(radius) as grouper:
+        for relative_path, coords in located:
+            grouper.add(relative_path, coords)
+        groups = {}
+        for relative_path, folder in grouper.placements():
+            groups.setdefault(folder, []).append(relative_path)
+    return {folder: sorted(paths) for folder, paths in groups.items()}
+
+
+@pytest.mark.parametrize('buckets, chunk', [(256, 65536), (3, 200), (1, 300)])
+def test_global_grouping_matches_dbscan(monkeypatch, buckets, chunk):
+    monkeypatch.setattr(exif_tool, 'GLOBAL_BUCKETS', buckets)
+    monkeypatch.setattr(exif_tool, 'GLOBAL_SPILL_CHUNK', chunk)
+    located = points()
+    expected = sorted(sorted(paths) for _, paths in exif_tool.group_coordinates_dbscan(located, 30.0, 1))
+    assert sorted(global_groups(located, 30.0).values()) == expected
+
+
+def test_global_grouping_does_not_depend_on_order(monkeypatch):
+    monkeypatch.setattr(exif_tool, 'GLOBAL_SPILL_CHUNK', 150)
+    located = points()
+    shuffled = located[:]
+    random.Random(1).shuffle(shuffled)
+    assert global_groups(shuffled, 30.0) == global_groups(located, 30.0)
+
+
+def test_global_grouping_refuses_other_min_samples(tmp_path):
+    with pytest.raises(ValueError):
+        exif_tool.group_plan_stage(str(tmp_path), str(tmp_path / 'out'), radius=30.0, min_samples=2, across_folders=True)
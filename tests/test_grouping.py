@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+import exif_tool
+
+RADIUS = 500.0
+
+
+def points():
+    """Points around the north pole, the south pole and the antimeridian, and scattered elsewhere."""
+    rng = random.Random(7)
+    located = []
+    for i in range(400):
+        kind = i % 4
+        if kind == 0:
+            coords = (90.0 - rng.uniform(0, 0.01), rng.uniform(-180, 180))
+        elif kind == 1:
+            coords = (-90.0 + rng.uniform(0, 0.01), rng.uniform(-180, 180))
+        elif kind == 2:
+            coords = (rng.uniform(-0.01, 0.01), rng.choice((-1, 1)) * (180.0 - rng.uniform(0, 0.01)))
+        else:
+            coords = (rng.uniform(45, 45.05), rng.uniform(7, 7.05))
+        located.append((f"img{i}.jpg", coords))
+    return located
+
+
+def linear_greedy(located, radius):
+    groups = []
+    for file_path, coords in located:
+        for anchor, files in groups:
+            if exif_tool.calculate_distance(anchor, coords) <= radius:
+                files.append(file_path)
+                break
+        else:
+            groups.append((coords, [file_path]))
+    return groups
+
+
+def test_greedy_grid_matches_linear_scan():
+    located = points()
+    assert exif_tool.group_coordinates_greedy(located, RADIUS) == linear_greedy(located, RADIUS)
+
+
+def test_groups_join_across_pole_and_antimeridian():
+    located = [('north_a.jpg', (89.9999, 0.0)), ('north_b.jpg', (89.9999, 180.0)),
+               ('east.jpg', (0.0, 179.9999)), ('west.jpg', (0.0, -179.9999))]
+    groups = exif_tool.group_coordinates_greedy(located, RADIUS)
+    assert [files for _, files in groups] == [['north_a.jpg', 'north_b.jpg'], ['east.jpg', 'west.jpg']]
+
+
+@pytest.mark.parametrize('index', [0, 1, 2, 3, 57, 398])
+def test_grid_neighbours_match_linear_scan(index):
+    located = points()
+    grid = exif_tool.SpatialGrid(RADIUS)
+    for i, (_, coords) in enumerate(located):
+        assert grid.add(coords) == i
+    coords = located[index][1]
+    expected = [i for i, (_, other) in enumerate(located) if exif_tool.calculate_distance(other, coords) <= RADIUS]
+    assert sorted(grid.neighbours(coords)) == expected
+    assert grid.find_first(coords) == expected[0]
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import exif_tool
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return path
+
+
+@pytest.mark.parametrize('link', [os.symlink, os.link])
+def test_copy_over_link_to_source_keeps_source(tmp_path, link):
+    src = write(tmp_path / 'src.jpg', b'image data' * 100)
+    dst = tmp_path / 'dst.jpg'
+    link(src, dst)
+
+    assert exif_tool.copy_file(str(src), str(dst)) == 1000
+    assert src.read_bytes() == b'image data' * 100
+    assert dst.read_bytes() == b'image data' * 100
+    assert not dst.is_symlink()
+    assert not os.path.samefile(src, dst)
+
+
+def test_copy_onto_itself_raises(tmp_path):
+    src = write(tmp_path / 'src.jpg', b'image data')
+    with pytest.raises(OSError):
+        exif_tool.copy_file(str(src), str(src))
+    assert src.read_bytes() == b'image data'
+
+
+@pytest.mark.parametrize('first_mode', ['symlink', 'hardlink'])
+def test_copy_run_over_linked_output_keeps_sources(corpus, tmp_path, first_mode):
+    sources = {path: path.read_bytes() for path in corpus.rglob('*.jpg')}
+    output = tmp_path / 'output'
+    for mode in (first_mode, 'copy'):
+        exif_tool.rename_images_by_datetime(str(corpus), str(output), "%Y-%m-%d_%H-%M-%S", recursive=True, mode=mode)
+
+    assert {path: path.read_bytes() for path in sources} == sources
+    placed = [path for path in output.rglob('*.jpg')]
+    assert placed and not any(path.is_symlink() for path in placed)
+
+
+def test_kernel_copy_resumes_at_offset_after_failure(tmp_path, monkeypatch):
+    if not hasattr(os, 'copy_file_range') or not hasattr(os, 'sendfile'):
+        pytest.skip("needs copy_file_range and sendfile")
+    data = bytes(range(256)) * 64
+    src = write(tmp_path / 'src.bin', data)
+    dst = tmp_path / 'dst.bin'
+    real_copy_file_range = os.copy_file_range
+    calls = []
+
+    def failing_copy_file_range(*args):
+        calls.append(args)
+        if len(calls) > 1:
+            raise OSError("not supported")
+        return real_copy_file_range(*args)
+
+    monkeypatch.setattr(exif_tool, 'COPY_CHUNK_SIZE', 4096)
+    monkeypatch.setattr(os, 'copy_file_range', failing_copy_file_range)
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        assert exif_tool.kernel_copy(src_file.fileno(), dst_file.fileno(), len(data)) == len(data)
+    assert dst.read_bytes() == data
+
+
+@pytest.mark.parametrize('mode', ['move', 'hardlink', 'symlink', 'reflink'])
+def test_place_onto_itself_keeps_file(tmp_path, mode):
+    src = write(tmp_path / 'src.jpg', b'image data')
+    assert exif_tool.place_file(str(src), str(src), mode)[0] == str(src)
+    assert src.read_bytes() == b'image data' and not src.is_symlink()
+
+
+@pytest.mark.parametrize('mode', ['move', 'hardlink', 'symlink'])
+def test_place_onto_hard_link_of_source_keeps_data(tmp_path, mode):
+    src = write(tmp_path / 'src.jpg', b'image data')
+    dst = tmp_path / 'dst.jpg'
+    os.link(src, dst)
+    exif_tool.place_file(str(src), str(dst), mode)
+    assert dst.read_bytes() == b'image data'
+    assert src.exists() != (mode == 'move')
+
+
+@pytest.mark.parametrize('mode', ['move', 'hardlink', 'symlink', 'copy'])
+def test_engine_refuses_to_replace_a_source(tmp_path, mode):
+    a = write(tmp_path / 'a.jpg', b'first')
+    b = write(tmp_path / 'b.jpg', b'second')
+    with exif_tool.PlacementEngine(mode) as engine:
+        engine.submit(str(a), str(tmp_path / 'out.jpg'))
+        engine.submit(str(b), str(a))
+    assert engine.errors == (0 if mode == 'move' else 1)
+    assert (tmp_path / 'out.jpg').read_bytes() == b'first'
+    assert a.read_bytes() == (b'second' if mode == 'move' else b'first')
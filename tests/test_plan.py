@@ -0,0 +1,38 @@
+import exif_tool
+
+
+def plan_and_apply(corpus, output, plan):
+    exif_tool.rename_images_by_datetime(str(corpus), str(output), "%Y-%m-%d_%H-%M-%S", recursive=True,
+                                        plan_path=str(plan))
+    return exif_tool.apply_plan(str(plan))
+
+
+def test_apply_resumes_from_journal(corpus, tmp_path):
+    plan = tmp_path / 'plan.jsonl'
+    placement, skipped = plan_and_apply(corpus, tmp_path / 'out', plan)
+    assert skipped == 0 and placement.files_placed > 0
+
+    placement, skipped = exif_tool.apply_plan(str(plan))
+    assert skipped > 0 and placement.files_placed == 0
+
+
+def test_new_plan_does_not_reuse_old_journal(corpus, tmp_path):
+    plan = tmp_path / 'plan.jsonl'
+    first, _ = plan_and_apply(corpus, tmp_path / 'first', plan)
+
+    second, skipped = plan_and_apply(corpus, tmp_path / 'second', plan)
+    assert skipped == 0
+    assert second.files_placed == first.files_placed
+    assert len(list((tmp_path / 'second').rglob('*.jpg'))) == first.files_placed
+
+
+def test_journal_of_another_plan_is_ignored(corpus, tmp_path):
+    plan = tmp_path / 'plan.jsonl'
+    other = tmp_path / 'other.jsonl'
+    first, _ = plan_and_apply(corpus, tmp_path / 'first', other)
+    exif_tool.rename_images_by_datetime(str(corpus), str(tmp_path / 'second'), "%Y-%m-%d_%H-%M-%S", recursive=True,
+                                        plan_path=str(plan))
+    (tmp_path / 'plan.jsonl.journal').write_bytes((tmp_path / 'other.jsonl.journal').read_bytes())
+
+    placement, skipped = exif_tool.apply_plan(str(plan))
+    assert skipped == 0 and placement.files_placed == first.files_placed
@@ -0,0 +1,54 @@
+import benchmark
+import exif_tool
+
+TAKEN = '2021:06:01 10:00:00'
+NAME = '2021-06-01_10-00-00'
+
+
+def photo(path, tag, exif_datetime=TAKEN):
+    """Write a JPEG with a DateTime, made distinct by trailing bytes after its end marker."""
+    base = benchmark.base_jpeg()
+    path.write_bytes(base[:2] + benchmark.exif_segment(exif_datetime, None) + base[2:] + tag.encode())
+    return path
+
+
+def rename(input_folder, output_folder, mode):
+    return exif_tool.rename_images_by_datetime(str(input_folder), str(output_folder), "%Y-%m-%d_%H-%M-%S", mode=mode)
+
+
+def contents(folder):
+    return sorted(path.read_bytes()[-7:].decode() for path in folder.iterdir())
+
+
+def test_rerun_with_move_in_place_keeps_every_image(tmp_path):
+    folder = tmp_path / 'photos'
+    folder.mkdir()
+    photo(folder / 'a.jpg', 'burst-1')
+    photo(folder / 'b.jpg', 'burst-2')
+    rename(folder, folder, 'move')
+    assert sorted(p.name for p in folder.iterdir()) == [f'{NAME}.jpg', f'{NAME}_1.jpg']
+
+    photo(folder / 'c.jpg', 'burst-3')
+    rename(folder, folder, 'move')
+    assert sorted(p.name for p in folder.iterdir()) == [f'{NAME}.jpg', f'{NAME}_1.jpg', f'{NAME}_2.jpg']
+    assert contents(folder) == ['burst-1', 'burst-2', 'burst-3']
+
+
+def test_rerun_with_move_keeps_earlier_output(tmp_path):
+    source, output = tmp_path / 'in', tmp_path / 'out'
+    source.mkdir()
+    photo(source / 'a.jpg', 'night-1')
+    rename(source, output, 'move')
+    photo(source / 'b.jpg', 'night-2')
+    rename(source, output, 'move')
+    assert contents(output) == ['night-1', 'night-2']
+
+
+def test_rerun_with_copy_reuses_its_own_output(tmp_path):
+    source, output = tmp_path / 'in', tmp_path / 'out'
+    source.mkdir()
+    photo(source / 'a.jpg', 'frame-1')
+    photo(source / 'b.jpg', 'frame-2')
+    rename(source, output, 'copy')
+    rename(source, output, 'copy')
+    assert sorted(p.name for p in output.iterdir()) == [f'{NAME}.jpg', f'{NAME}_1.jpg']
@@ -0,0 +1,57 @@
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+import exif_tool
+
+
+@pytest.mark.parametrize('address', ['0.0.0.0:9000', '192.168.1.20:9000', 'example.com:9000'])
+def test_non_loopback_hosts_are_refused(address):
+    with pytest.raises(exif_tool.ServerError):
+        exif_tool.serve_address(address)
+
+
+@pytest.mark.parametrize('address', ['9000', 'localhost:9000', '127.0.0.1:9000', '127.0.0.2:9000'])
+def test_loopback_hosts_are_accepted(address):
+    assert exif_tool.serve_address(address)[0] == socket.AF_INET
+
+
+def test_unix_socket_is_private(tmp_path, monkeypatch):
+    monkeypatch.setattr(exif_tool, 'reporter', exif_tool.reporter)
+    monkeypatch.setattr(exif_tool, 'shared_executor', exif_tool.shared_executor)
+    address = str(tmp_path / 'server.sock')
+    server = exif_tool.JobServer(jobs=1)
+    thread = threading.Thread(target=server.serve, args=(address,), daemon=True)
+    thread.start()
+    for _ in range(100):
+        if server._server is not None:
+            break
+        time.sleep(0.05)
+    try:
+        assert stat.S_IMODE(os.stat(address).st_mode) == 0o600
+        with exif_tool.ServerClient(address) as client:
+            assert client.call('jobs') == []
+    finally:
+        server.shutdown()
+        thread.join(5)
+
+
+def test_unexpected_errors_are_answered(monkeypatch, capsys):
+    monkeypatch.setattr(exif_tool, 'reporter', exif_tool.reporter)
+    monkeypatch.setattr(exif_tool, 'shared_executor', exif_tool.shared_executor)
+    server = exif_tool.JobServer(jobs=1)
+
+    def fail():
+        raise OSError("disk on fire")
+
+    monkeypatch.setattr(server, 'list_jobs', fail)
+    response = server.handle({'jsonrpc': '2.0', 'id': 7, 'method': 'jobs'})
+    assert response['id'] == 7
+    assert response['error']['code'] == -32603
+    assert 'disk on fire' in response['error']['message']
+    assert 'Traceback' in capsys.readouterr().err
+    server.shutdown()
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import exif_tool
+
+
+def plan_lines(path):
+    with open(path) as f:
+        return f.read().splitlines()[1:]
+
+
+RUNS = {
+    'rename': lambda corpus, output, **kwargs: exif_tool.rename_images_by_datetime(
+        corpus, output, "%Y-%m", recursive=True, **kwargs),
+    'group': lambda corpus, output, **kwargs: exif_tool.group_images_by_location(
+        corpus, output, recursive=True, radius=500.0, **kwargs),
+    'global': lambda corpus, output, **kwargs: exif_tool.group_images_by_location(
+        corpus, output, recursive=True, radius=500.0, across_folders=True, **kwargs),
+}
+
+
+@pytest.mark.parametrize('operation', sorted(RUNS))
+@pytest.mark.parametrize('shards', [2, 3])
+def test_merged_shards_plan_like_a_single_run(corpus, tmp_path, operation, shards):
+    run = RUNS[operation]
+    output = str(tmp_path / 'out')
+    run(str(corpus), output, plan_path=str(tmp_path / 'single.jsonl'))
+    partials = []
+    for k in range(1, shards + 1):
+        partials.append(str(tmp_path / f'part{k}.jsonl'))
+        run(str(corpus), output, plan_path=partials[-1], shard=exif_tool.parse_shard(f"{k}/{shards}"))
+    exif_tool.merge_run(partials, plan_path=str(tmp_path / 'merged.jsonl'))
+    single = plan_lines(tmp_path / 'single.jsonl')
+    assert len(single) > 1
+    assert plan_lines(tmp_path / 'merged.jsonl') == single
+
+
+def test_merge_refuses_missing_shard(corpus, tmp_path):
+    partial = str(tmp_path / 'part1.jsonl')
+    RUNS['rename'](str(corpus), str(tmp_path / 'out'), plan_path=partial, shard=exif_tool.parse_shard("1/2"))
+    with pytest.raises(ValueError, match="Missing shards: 2/2"):
+        exif_tool.merge_run([partial], plan_path=str(tmp_path / 'merged.jsonl'))
+
+
+def test_partial_trailer_is_found_through_the_footer(corpus, tmp_path):
+    partial = str(tmp_path / 'part1.jsonl')
+    RUNS['rename'](str(corpus), str(tmp_path / 'out'), plan_path=partial, shard=exif_tool.parse_shard("1/2"))
+    header, trailer = exif_tool.read_partial(partial)
+    assert trailer['scanned'] > 0
+
+    # A trailer larger than any fixed window at the end of the file
+    big = {**trailer, 'note': 'x' * 100000}
+    trailer_line = json.dumps(big) + '\n'
+    with open(partial, 'w') as f:
+        f.write(json.dumps({'version': exif_tool.PLAN_VERSION, **header}) + '\n')
+        f.write(trailer_line)
+        f.write(exif_tool.PARTIAL_FOOTER.format(len(trailer_line)))
+    assert exif_tool.read_partial(partial)[1] == big
+
+
+def test_unfinished_partial_has_no_trailer(corpus, tmp_path):
+    partial = str(tmp_path / 'part1.jsonl')
+    RUNS['rename'](str(corpus), str(tmp_path / 'out'), plan_path=partial, shard=exif_tool.parse_shard("1/2"))
+    with open(partial) as f:
+        lines = f.read().splitlines(keepends=True)
+    with open(partial, 'w') as f:
+        f.writelines(lines[:-2])
+    assert exif_tool.read_partial(partial)[1] is None